@@ -1,12 +1,24 @@
 # === Flask API Server for Manga Scraper ===
 
+import contextvars
 import os
-import traceback
-from flask import Flask, request, jsonify, Blueprint
+import queue
+import threading
+from flask import Flask, request, jsonify, Blueprint, g, make_response, Response, stream_with_context
 from flask_cors import CORS # Import CORS
 
 # Import the refactored scraper logic and DB query function
-from manga_scraper_logic import run_scrape, get_avg_price_from_db, get_db_connection
+from manga_scraper_logic import run_scrape
+from storage import open_store
+from scrape_logging import get_logger, correlation_scope
+from request_profiling import RequestProfiler, profiling_requested, stage
+from pricing import build_price_body, estimate_body, sse_event, SSE_HEADERS, SSE_KEEPALIVE
+from http_caching import make_validators, is_fresh, is_not_modified, apply_cache_headers
+from series_suggest import ensure_index
+from scrape_jobs import queued_execution, run_scrape_queued
+from scrape_budget import budget_from_request, descriptions_from_request
+
+log = get_logger("api")
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -15,6 +27,24 @@ CORS(app, origins=["https://manga-market.netlify.app", "http://localhost:3000"])
 # Create API blueprint with prefix
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# --- Per-request correlation id (carried into scrape logs) ---
+@app.before_request
+def bind_correlation_id():
+    g.correlation_scope = correlation_scope(request.headers.get('X-Request-ID'))
+    g.correlation_id = g.correlation_scope.__enter__()
+
+@app.after_request
+def add_correlation_header(response):
+    if 'correlation_id' in g:
+        response.headers['X-Request-ID'] = g.correlation_id
+    return response
+
+@app.teardown_request
+def release_correlation_id(exc):
+    scope = g.pop('correlation_scope', None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
 # --- API Test Endpoint ---
 @api_bp.route('/test', methods=['GET'])
 def test_endpoint():
@@ -23,106 +53,127 @@ def test_endpoint():
     """
     return jsonify({"success": True, "message": "API is connected and running!"})
 
-# --- API Endpoint to Trigger Scrape and Get Price ---
-@api_bp.route('/check-price', methods=['POST'])
-def check_manga_price():
+# --- Series Autocomplete ---
+@api_bp.route('/series/suggest', methods=['GET'])
+def suggest_series():
     """
-    API endpoint that receives manga details, triggers a scrape,
-    and returns the calculated average price from the database.
+    Ranked known series (and listing titles) for a partial or misspelled name,
+    so the frontend can offer a known series before a scrape is triggered.
     """
-    print("[API] Received /api/check-price request")
-    # Get data from the incoming JSON request from the frontend
-    data = request.json
-    if not data:
-        return jsonify({"success": False, "message": "Missing JSON payload"}), 400
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"success": False, "message": "Missing 'q' parameter"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return jsonify({"success": False, "message": "'limit' must be an integer"}), 400
 
-    manga_title = data.get('seriesName')
-    volumes_str = data.get('volumes') # e.g., "1", "1-10"
-    condition = data.get('condition', 'good') # Get condition or default to 'good'
-
-    if not manga_title:
-        return jsonify({"success": False, "message": "Missing 'seriesName' in request"}), 400
-    if not volumes_str:
-         return jsonify({"success": False, "message": "Missing 'volumes' in request"}), 400
+    # Until the index's first background build finishes this answers with no suggestions.
+    index = ensure_index(open_store)
+    return jsonify({"success": True, "query": query, "suggestions": index.suggest(query, limit),
+                    "indexReady": index.built_at is not None})
 
+# --- Shared Price Check (used by both /check-price and /prices) ---
+def price_check(manga_title, volumes_str, condition, scrape=True, budget=None, fetch_descriptions=False):
+    """
+    Triggers a scrape for the title (unless `scrape` is False, i.e. stored data
+    is still fresh) and returns (response_body, status_code) with the
+    calculated average price from the database. With a ScrapeBudget the scrape
+    stops at its deadline and the body's "scrape" key reports what was skipped.
+    fetch_descriptions resolves ambiguous listings from their descriptions
+    (within a budget: the largest price impact first, while time is left).
+    """
     # --- Simple Blocking Implementation ---
     # This runs the scrape directly when the API is called.
     # The frontend will wait until it completes. This might timeout for long scrapes.
     # TODO: Consider background tasks (Celery, Flask-Executor) for production.
-    print(f"[API] Triggering scrape for: {manga_title}")
     try:
-        # Run the scrape (using default pages=3, min_price=5 for now, could make these params too)
-        scrape_success = run_scrape(manga_title=manga_title, max_pages=3, min_price=5)
+        scrape_success = True
+        if scrape:
+            log.info("Triggering scrape", extra={"series": manga_title})
+            # Run the scrape (using default pages=3, min_price=5 for now, could make these params too)
+            # In queue mode a scrape worker runs it (see scrape_jobs.py) and this request waits for it.
+            with stage("scrape"):
+                if queued_execution():
+                    scrape_success = run_scrape_queued(manga_title=manga_title, max_pages=3, min_price=5, fetch_descriptions=fetch_descriptions,
+                                                       timeout=budget.remaining() if budget is not None else None)
+                    if budget is not None and not scrape_success:
+                        budget.mark_truncated()
+                else:
+                    scrape_success = run_scrape(manga_title=manga_title, max_pages=3, min_price=5, fetch_descriptions=fetch_descriptions, budget=budget)
 
         if not scrape_success:
-            print("[API] Scrape task indicated failure or incomplete run.")
+            log.warning("Scrape task indicated failure or incomplete run", extra={"series": manga_title})
             # Decide if we should still try to query DB or return error
             # Let's try querying anyway, maybe some data was inserted before failure
-            # return jsonify({"success": False, "message": "Scraping task failed or was interrupted."}), 500
+            # return {"success": False, "message": "Scraping task failed or was interrupted."}, 500
 
-        print(f"[API] Scrape finished. Querying database for average price...")
         # Connect to DB again to get fresh data
-        db_conn = get_db_connection()
-        if not db_conn:
-             return jsonify({"success": False, "message": "Failed to connect to database after scraping."}), 500
-
-        # Query the average price for the scraped title
-        # Note: Current DB query doesn't use volume range or condition yet
-        avg_price, count = get_avg_price_from_db(db_conn, manga_title_like=manga_title)
-
-        # Close connection after query
-        db_conn.close()
-        print("[DB] Query connection closed.")
-
-        if avg_price is not None:
-            # Calculate estimated price for all volumes
-            volume_count = 1  # Default for single volume
-            
-            # Parse volume range if present (e.g., "1-10")
-            if "-" in volumes_str:
-                try:
-                    start, end = map(int, volumes_str.split("-"))
-                    volume_count = end - start + 1
-                except ValueError:
-                    pass
-            
-            estimated_price = avg_price * volume_count
-            
-            response_data = {
-                "success": True,
-                "series": {"name": manga_title},
-                "query": {
-                    "volumes": volumes_str,
-                    "condition": condition
-                },
-                "pricing": {
-                    "pricePerVolume": avg_price,
-                    "estimatedPrice": estimated_price,
-                    "numVolumes": volume_count,
-                    "premiumApplied": 0,  # Set default values for these fields
-                    "matchType": "approximate",
-                    "discontinuityDiscount": 0
-                },
-                "trend": {
-                    "trend": 0,  # Add default trend data
-                    "confidence": "low",
-                    "recentSamples": count,
-                    "olderSamples": 0
-                }
-            }
-            return jsonify(response_data), 200
-        else:
-            return jsonify({
-                "success": False,
-                "message": f"Could not calculate average price for '{manga_title}'. No valid listings found in database.",
-                "series": {"name": manga_title},
-                "query": {"volumes": volumes_str}
-                }), 404
+        with stage("db_query"):
+            store = open_store()
+            if not store.available:
+                return {"success": False, "message": "Failed to connect to database after scraping."}, 500
+
+            # Query the average price for the scraped title
+            # Note: Current DB query doesn't use volume range or condition yet
+            avg_price, count = store.avg_price(manga_title)
+            # Median / percentiles / IQR mean from the series' price distribution
+            price_summary = store.price_summary(manga_title) if avg_price is not None else None
+
+            # Close connection after query
+            store.close()
+
+        body, status = build_price_body(manga_title, volumes_str, condition, avg_price, count, price_summary)
+        if budget is not None and scrape:
+            body["scrape"] = budget.report()
+        return body, status
 
     except Exception as e:
-        print(f"[API] !! UNEXPECTED Error during /check-price handling: {e}")
-        traceback.print_exc()
-        return jsonify({"success": False, "message": "An internal server error occurred."}), 500
+        log.exception("Unexpected error during price check handling: %s", e)
+        return {"success": False, "message": "An internal server error occurred."}, 500
+
+def price_check_response(data, scrape=True):
+    """ Validates a price-check payload, runs it (profiled on demand) and builds the Flask response. """
+    manga_title = data.get('seriesName')
+    volumes_str = data.get('volumes') # e.g., "1", "1-10"
+    condition = data.get('condition', 'good') # Get condition or default to 'good'
+
+    if not manga_title:
+        return jsonify({"success": False, "message": "Missing 'seriesName' in request"}), 400
+    if not volumes_str:
+         return jsonify({"success": False, "message": "Missing 'volumes' in request"}), 400
+    try:
+        # Optional per-request time budget in seconds
+        budget = budget_from_request(data.get('timeBudget'))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "'timeBudget' must be a positive number of seconds"}), 400
+    # Descriptions of ambiguous listings: on by default with a time budget, or asked for explicitly.
+    fetch_descriptions = descriptions_from_request(data.get('fetchDescriptions'), budget)
+
+    # --- Opt-in profiling (X-Profile header / ?profile=1 with X-Admin-Token, or PROFILE_REQUESTS=1) ---
+    if profiling_requested(request):
+        profiler = RequestProfiler(label=manga_title)
+        with profiler:
+            body, status = price_check(manga_title, volumes_str, condition, scrape=scrape, budget=budget, fetch_descriptions=fetch_descriptions)
+        body["profile"] = profiler.summary()
+    else:
+        body, status = price_check(manga_title, volumes_str, condition, scrape=scrape, budget=budget, fetch_descriptions=fetch_descriptions)
+    return jsonify(body), status
+
+# --- API Endpoint to Trigger Scrape and Get Price ---
+@api_bp.route('/check-price', methods=['POST'])
+def check_manga_price():
+    """
+    API endpoint that receives manga details, triggers a scrape,
+    and returns the calculated average price from the database.
+    """
+    log.info("Received /api/check-price request")
+    # Get data from the incoming JSON request from the frontend
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "Missing JSON payload"}), 400
+
+    return price_check_response(data)
 
 # --- API Endpoint for Compatibility with Frontend's GET Request ---
 @api_bp.route('/prices', methods=['GET'])
@@ -130,7 +181,7 @@ def get_manga_prices():
     """
     Compatibility endpoint for frontend's GET request
     """
-    print("[API] Received /api/prices GET request")
+    log.info("Received /api/prices GET request")
     
     # Extract params from query string
     series = request.args.get('series')
@@ -140,22 +191,184 @@ def get_manga_prices():
     if not series:
         return jsonify({"success": False, "message": "Missing 'series' parameter"}), 400
     
-    # Create a data payload for the POST handler
+    # Create a data payload matching the POST handler's JSON body
     data = {
         "seriesName": series,
         "volumes": volumes,
-        "condition": condition
+        "condition": condition,
+        "timeBudget": request.args.get('timeBudget'),
+        "fetchDescriptions": request.args.get('fetchDescriptions')
     }
-    
-    # Set the request data for the check_manga_price function
-    request.json = data
-    
-    # Call the POST endpoint function directly with the data
-    return check_manga_price()
+
+    # Profiled requests always run the full pipeline and are never cached
+    if profiling_requested(request):
+        return price_check_response(data)
+
+    # --- Conditional caching: answer from stored data while it is still fresh ---
+    newest, count = series_freshness(series)
+    etag, last_modified = make_validators(newest, count, series, volumes, condition)
+    fresh = is_fresh(newest)
+    if fresh and is_not_modified(request, etag, last_modified):
+        log.info("Serving 304 Not Modified", extra={"series": series})
+        return apply_cache_headers(make_response('', 304), etag, last_modified)
+
+    response, status = price_check_response(data, scrape=not fresh)
+    if status != 200:
+        return response, status
+
+    if not fresh:
+        newest, count = series_freshness(series)
+        etag, last_modified = make_validators(newest, count, series, volumes, condition)
+        if is_not_modified(request, etag, last_modified):
+            return apply_cache_headers(make_response('', 304), etag, last_modified)
+    return apply_cache_headers(response, etag, last_modified), status
+
+# --- Streaming Price Check (server-sent events) ---
+STREAM_MAX_PAGES = 3
+
+# One in-flight streaming scrape per series; every client streaming that series
+# subscribes to it instead of starting its own. series key -> subscriber queues.
+_stream_scrapes = {}
+_stream_scrapes_lock = threading.Lock()
+
+def subscribe_stream_scrape(series):
+    """
+    Queue that receives (pages, rows) after every page the series' streaming
+    scrape inserts, then its success flag. Starts the scrape unless one is
+    already running for the series, in which case this joins it mid-way.
+    """
+    key = series.strip().lower()
+    updates = queue.Queue()
+    with _stream_scrapes_lock:
+        if key in _stream_scrapes:
+            _stream_scrapes[key].append(updates)
+            return updates
+        _stream_scrapes[key] = [updates]
+    threading.Thread(target=contextvars.copy_context().run, args=(_stream_scrape, key, series),
+                     name="stream-scrape", daemon=True).start()
+    return updates
+
+def unsubscribe_stream_scrape(series, updates):
+    """ Stops delivering updates to a client that went away (the scrape keeps running). """
+    with _stream_scrapes_lock:
+        subscribers = _stream_scrapes.get(series.strip().lower(), [])
+        if updates in subscribers:
+            subscribers.remove(updates)
+
+def _stream_scrape(key, series):
+    def publish(update):
+        with _stream_scrapes_lock:
+            subscribers = list(_stream_scrapes.get(key, []))
+        for updates in subscribers:
+            updates.put(update)
+
+    # Keeps running if every client disconnects; its rows still land in the DB.
+    success = False
+    try:
+        run = run_scrape_queued if queued_execution() else run_scrape
+        success = run(manga_title=series, max_pages=STREAM_MAX_PAGES, min_price=5,
+                      on_page=lambda pages, rows: publish((pages, rows)))
+    except Exception as e:
+        log.exception("Streaming scrape failed: %s", e, extra={"series": series})
+    finally:
+        with _stream_scrapes_lock:
+            subscribers = _stream_scrapes.pop(key, [])
+        for updates in subscribers:
+            updates.put(success)
+
+def stored_prices(series, summary=False):
+    """
+    (avg_price, count, price_summary) from a store opened just for this read,
+    so a stream doesn't hold a connection (idle in transaction) between events.
+    None if the DB is unavailable.
+    """
+    store = open_store()
+    if not store.available:
+        return None
+    try:
+        avg_price, count = store.avg_price(series)
+        price_summary = store.price_summary(series) if summary and avg_price is not None else None
+        return avg_price, count, price_summary
+    finally:
+        store.close()
+
+@api_bp.route('/prices/stream', methods=['GET'])
+def stream_manga_prices():
+    """
+    Same query as /prices, answered as a text/event-stream: an `estimate`
+    event from stored data right away (if any), another after every scraped
+    page is inserted, then a `result` event with the /prices body. While the
+    stored data is fresh (see http_caching.is_fresh) only the `result` is sent.
+    """
+    series = request.args.get('series')
+    volumes = request.args.get('volumes')
+    condition = request.args.get('condition', 'good')
+    if not series:
+        return jsonify({"success": False, "message": "Missing 'series' parameter"}), 400
+    if not volumes:
+        return jsonify({"success": False, "message": "Missing 'volumes' parameter"}), 400
+    log.info("Received /api/prices/stream request", extra={"series": series})
+
+    def result_event():
+        stored = stored_prices(series, summary=True)
+        if stored is None:
+            return sse_event("error", {"success": False, "message": "Failed to connect to database."})
+        body, status = build_price_body(series, volumes, condition, *stored)
+        return sse_event("result", {**body, "status": status})
+
+    def generate():
+        newest, _ = series_freshness(series)
+        if is_fresh(newest):
+            log.info("Streaming stored prices, no scrape needed", extra={"series": series})
+            yield result_event()
+            return
+
+        updates = subscribe_stream_scrape(series)
+        try:
+            stored = stored_prices(series)
+            if stored is None:
+                yield sse_event("error", {"success": False, "message": "Failed to connect to database."})
+                return
+            avg_price, count, _ = stored
+            if avg_price is not None:
+                yield sse_event("estimate", estimate_body(series, volumes, avg_price, count, 0, STREAM_MAX_PAGES, 0, "stored"))
+            while True:
+                try:
+                    update = updates.get(timeout=15)
+                except queue.Empty:
+                    yield SSE_KEEPALIVE
+                    continue
+                if isinstance(update, bool):
+                    if not update:
+                        log.warning("Scrape task indicated failure or incomplete run", extra={"series": series})
+                    break
+                pages, rows = update
+                stored = stored_prices(series)
+                if stored is not None:
+                    avg_price, count, _ = stored
+                    yield sse_event("estimate", estimate_body(series, volumes, avg_price, count, pages, STREAM_MAX_PAGES, rows, "scrape"))
+            yield result_event()
+        finally:
+            unsubscribe_stream_scrape(series, updates)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def series_freshness(series):
+    """ (newest scraped_at, row count) for a series, or (None, 0) if the DB is unavailable. """
+    store = open_store()
+    if not store.available:
+        return None, 0
+    try:
+        return store.series_freshness(series)
+    finally:
+        store.close()
 
 # Register the blueprint
 app.register_blueprint(api_bp)
 
+# Start building the suggest index now rather than on the first suggest request.
+ensure_index(open_store)
+
 # Add a root route to redirect to API test endpoint
 @app.route('/')
 def root():
@@ -172,5 +385,5 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     # Run in debug mode for development (auto-reloads on code changes)
     # Set debug=False for production
-    print(f"[API Server] Starting Flask server on port {port}...")
+    log.info("Starting Flask server", extra={"port": port})
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
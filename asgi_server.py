@@ -0,0 +1,322 @@
+# === ASGI (asyncio) API Server for Manga Scraper ===
+# Same endpoints and JSON contract as api_server.py, served by Quart on an
+# event loop. Scrapes, description fetches and DB queries are awaited instead
+# of pinning a thread each, so one process can hold many concurrent checks.
+#
+# Run with:  hypercorn asgi_server:app --bind 0.0.0.0:5000
+# Requires: quart, quart-cors, hypercorn, httpx, asyncpg.
+
+import asyncio
+import os
+from quart import Quart, request, jsonify, Blueprint, g, make_response, Response
+from quart_cors import cors
+
+from async_scraper import (
+    resources, run_scrape_async, run_scrape_queued_async, get_avg_price_async, get_series_freshness_async, get_price_summary_async,
+    refresh_suggest_index_async,
+)
+from pricing import build_price_body, estimate_body, sse_event, SSE_HEADERS, SSE_KEEPALIVE
+from http_caching import make_validators, is_fresh, is_not_modified, apply_cache_headers
+from scrape_logging import get_logger, correlation_scope
+from series_suggest import get_suggest_index
+from scrape_budget import budget_from_request, descriptions_from_request
+from scrape_jobs import queued_execution
+
+log = get_logger("asgi")
+
+# Initialize Quart app
+app = Quart(__name__)
+app = cors(app, allow_origin=["https://manga-market.netlify.app", "http://localhost:3000"])
+
+# Create API blueprint with prefix
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+# --- Shared clients (HTTP + asyncpg pool) live for the server's lifetime ---
+@app.before_serving
+async def open_resources():
+    global _suggest_refresh
+    await resources.start()
+    # Start building the suggest index now rather than on the first suggest request.
+    _suggest_refresh = asyncio.create_task(refresh_suggest_index_async(resources.pool))
+
+@app.after_serving
+async def close_resources():
+    await resources.close()
+
+# --- Per-request correlation id (carried into scrape logs) ---
+@app.before_request
+async def bind_correlation_id():
+    g.correlation_scope = correlation_scope(request.headers.get('X-Request-ID'))
+    g.correlation_id = g.correlation_scope.__enter__()
+
+@app.after_request
+async def add_correlation_header(response):
+    if 'correlation_id' in g:
+        response.headers['X-Request-ID'] = g.correlation_id
+    return response
+
+@app.teardown_request
+async def release_correlation_id(exc):
+    scope = g.pop('correlation_scope', None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
+# --- API Test Endpoint ---
+@api_bp.route('/test', methods=['GET'])
+async def test_endpoint():
+    """
+    Simple test endpoint to verify API connectivity
+    """
+    return jsonify({"success": True, "message": "API is connected and running!"})
+
+# --- Series Autocomplete ---
+_suggest_refresh = None
+
+@api_bp.route('/series/suggest', methods=['GET'])
+async def suggest_series():
+    """
+    Ranked known series (and listing titles) for a partial or misspelled name.
+    """
+    global _suggest_refresh
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"success": False, "message": "Missing 'q' parameter"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return jsonify({"success": False, "message": "'limit' must be an integer"}), 400
+
+    index = get_suggest_index()
+    if index.refresh_due() and (_suggest_refresh is None or _suggest_refresh.done()):
+        # Build or pull the delta in the background; this request answers from the current index.
+        _suggest_refresh = asyncio.create_task(refresh_suggest_index_async(resources.pool))
+    return jsonify({"success": True, "query": query, "suggestions": index.suggest(query, limit),
+                    "indexReady": index.built_at is not None})
+
+# --- Shared Price Check ---
+async def price_check(manga_title, volumes_str, condition, scrape=True, budget=None, fetch_descriptions=False):
+    """ Async counterpart of api_server.price_check. Returns (response_body, status_code). """
+    try:
+        if scrape:
+            log.info("Triggering scrape", extra={"series": manga_title})
+            # In queue mode a scrape worker runs it (see scrape_jobs.py) and this request waits for it.
+            if queued_execution():
+                scrape_success = await run_scrape_queued_async(resources.pool, manga_title=manga_title, max_pages=3, min_price=5,
+                                                               fetch_descriptions=fetch_descriptions,
+                                                               timeout=budget.remaining() if budget is not None else None)
+                if budget is not None and not scrape_success:
+                    budget.mark_truncated()
+            else:
+                scrape_success = await run_scrape_async(manga_title=manga_title, max_pages=3, min_price=5,
+                                                        fetch_descriptions=fetch_descriptions, budget=budget)
+            if not scrape_success:
+                log.warning("Scrape task indicated failure or incomplete run", extra={"series": manga_title})
+
+        avg_price, count = await get_avg_price_async(resources.pool, manga_title)
+        price_summary = await get_price_summary_async(resources.pool, manga_title) if avg_price is not None else None
+        body, status = build_price_body(manga_title, volumes_str, condition, avg_price, count, price_summary)
+        if budget is not None and scrape:
+            body["scrape"] = budget.report()
+        return body, status
+
+    except Exception as e:
+        log.exception("Unexpected error during price check handling: %s", e)
+        return {"success": False, "message": "An internal server error occurred."}, 500
+
+async def price_check_response(data, scrape=True):
+    """ Validates a price-check payload and runs it. """
+    manga_title = data.get('seriesName')
+    volumes_str = data.get('volumes') # e.g., "1", "1-10"
+    condition = data.get('condition', 'good') # Get condition or default to 'good'
+
+    if not manga_title:
+        return jsonify({"success": False, "message": "Missing 'seriesName' in request"}), 400
+    if not volumes_str:
+         return jsonify({"success": False, "message": "Missing 'volumes' in request"}), 400
+    try:
+        # Optional per-request time budget in seconds
+        budget = budget_from_request(data.get('timeBudget'))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "'timeBudget' must be a positive number of seconds"}), 400
+    # Descriptions of ambiguous listings: on by default with a time budget, or asked for explicitly.
+    fetch_descriptions = descriptions_from_request(data.get('fetchDescriptions'), budget)
+
+    body, status = await price_check(manga_title, volumes_str, condition, scrape=scrape, budget=budget, fetch_descriptions=fetch_descriptions)
+    return jsonify(body), status
+
+# --- API Endpoint to Trigger Scrape and Get Price ---
+@api_bp.route('/check-price', methods=['POST'])
+async def check_manga_price():
+    """
+    API endpoint that receives manga details, triggers a scrape,
+    and returns the calculated average price from the database.
+    """
+    log.info("Received /api/check-price request")
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "message": "Missing JSON payload"}), 400
+
+    return await price_check_response(data)
+
+# --- API Endpoint for Compatibility with Frontend's GET Request ---
+@api_bp.route('/prices', methods=['GET'])
+async def get_manga_prices():
+    """
+    Compatibility endpoint for frontend's GET request (with conditional caching)
+    """
+    log.info("Received /api/prices GET request")
+
+    series = request.args.get('series')
+    volumes = request.args.get('volumes')
+    condition = request.args.get('condition', 'good')
+
+    if not series:
+        return jsonify({"success": False, "message": "Missing 'series' parameter"}), 400
+
+    data = {
+        "seriesName": series,
+        "volumes": volumes,
+        "condition": condition,
+        "timeBudget": request.args.get('timeBudget'),
+        "fetchDescriptions": request.args.get('fetchDescriptions')
+    }
+
+    newest, count = await get_series_freshness_async(resources.pool, series)
+    etag, last_modified = make_validators(newest, count, series, volumes, condition)
+    fresh = is_fresh(newest)
+    if fresh and is_not_modified(request, etag, last_modified):
+        return apply_cache_headers(await make_response('', 304), etag, last_modified)
+
+    response, status = await price_check_response(data, scrape=not fresh)
+    if status != 200:
+        return response, status
+
+    if not fresh:
+        newest, count = await get_series_freshness_async(resources.pool, series)
+        etag, last_modified = make_validators(newest, count, series, volumes, condition)
+        if is_not_modified(request, etag, last_modified):
+            return apply_cache_headers(await make_response('', 304), etag, last_modified)
+    return apply_cache_headers(response, etag, last_modified), status
+
+# --- Streaming Price Check (server-sent events) ---
+STREAM_MAX_PAGES = 3
+
+# One in-flight streaming scrape per series, shared by every client streaming it.
+# series key -> subscriber queues (the scrape task publishes to all of them).
+_stream_scrapes = {}
+
+def subscribe_stream_scrape(series):
+    """
+    Queue that receives (pages, rows) after every page the series' streaming
+    scrape inserts, then the finished task. Starts the scrape unless one is
+    already running for the series.
+    """
+    key = series.strip().lower()
+    updates = asyncio.Queue()
+    if key in _stream_scrapes:
+        _stream_scrapes[key].append(updates)
+        return updates
+    subscribers = _stream_scrapes[key] = [updates]
+
+    def publish(update):
+        for subscriber in subscribers:
+            subscriber.put_nowait(update)
+
+    def finished(task):
+        _stream_scrapes.pop(key, None)
+        publish(task)
+
+    # Runs as its own task so a client disconnect doesn't cancel the scrape.
+    def on_page(pages, rows):
+        publish((pages, rows))
+
+    if queued_execution():
+        run = run_scrape_queued_async(resources.pool, manga_title=series, max_pages=STREAM_MAX_PAGES, min_price=5, on_page=on_page)
+    else:
+        run = run_scrape_async(manga_title=series, max_pages=STREAM_MAX_PAGES, min_price=5, on_page=on_page)
+    scrape = asyncio.create_task(run)
+    scrape.add_done_callback(finished)
+    return updates
+
+def unsubscribe_stream_scrape(series, updates):
+    """ Stops delivering updates to a client that went away (the scrape keeps running). """
+    subscribers = _stream_scrapes.get(series.strip().lower(), [])
+    if updates in subscribers:
+        subscribers.remove(updates)
+
+@api_bp.route('/prices/stream', methods=['GET'])
+async def stream_manga_prices():
+    """
+    Async counterpart of api_server.stream_manga_prices: `estimate` events
+    (stored data, then one per inserted page) followed by a `result` event,
+    or just the `result` while stored data is fresh.
+    """
+    series = request.args.get('series')
+    volumes = request.args.get('volumes')
+    condition = request.args.get('condition', 'good')
+    if not series:
+        return jsonify({"success": False, "message": "Missing 'series' parameter"}), 400
+    if not volumes:
+        return jsonify({"success": False, "message": "Missing 'volumes' parameter"}), 400
+    log.info("Received /api/prices/stream request", extra={"series": series})
+
+    async def result_event():
+        avg_price, count = await get_avg_price_async(resources.pool, series)
+        price_summary = await get_price_summary_async(resources.pool, series) if avg_price is not None else None
+        body, status = build_price_body(series, volumes, condition, avg_price, count, price_summary)
+        return sse_event("result", {**body, "status": status})
+
+    async def generate():
+        newest, _ = await get_series_freshness_async(resources.pool, series)
+        if is_fresh(newest):
+            log.info("Streaming stored prices, no scrape needed", extra={"series": series})
+            yield await result_event()
+            return
+
+        updates = subscribe_stream_scrape(series)
+        try:
+            avg_price, count = await get_avg_price_async(resources.pool, series)
+            if avg_price is not None:
+                yield sse_event("estimate", estimate_body(series, volumes, avg_price, count, 0, STREAM_MAX_PAGES, 0, "stored"))
+            while True:
+                try:
+                    update = await asyncio.wait_for(updates.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield SSE_KEEPALIVE
+                    continue
+                if isinstance(update, asyncio.Task):
+                    scrape = update
+                    break
+                pages, rows = update
+                avg_price, count = await get_avg_price_async(resources.pool, series)
+                yield sse_event("estimate", estimate_body(series, volumes, avg_price, count, pages, STREAM_MAX_PAGES, rows, "scrape"))
+        finally:
+            unsubscribe_stream_scrape(series, updates)
+        # exception() raises CancelledError for a cancelled task (shutdown), so check that first.
+        if scrape.cancelled() or scrape.exception() is not None or not scrape.result():
+            log.warning("Scrape task indicated failure or incomplete run", extra={"series": series})
+        yield await result_event()
+
+    response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # A full scrape can outlast Quart's default response timeout.
+    response.timeout = None
+    return response
+
+# Register the blueprint
+app.register_blueprint(api_bp)
+
+@app.route('/')
+async def root():
+    return jsonify({
+        "name": "Manga Market API",
+        "version": "1.0.0",
+        "status": "running",
+        "mode": "asgi",
+        "test_endpoint": "/api/test"
+    })
+
+# --- Run the ASGI Server (development) ---
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    log.info("Starting Quart server", extra={"port": port})
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,560 @@
+# === Async Scraper Logic (asyncio serving mode) ===
+# Non-blocking counterparts of the network and database parts of
+# manga_scraper_logic.py, used by asgi_server.py. Oxylabs and description
+# requests go through one shared httpx.AsyncClient, paced, retried and
+# circuit-broken by the same fetch controllers as the sync scraper; queries
+# go through an asyncpg pool, so a single process can hold hundreds of
+# in-flight price checks. Parsing reuses the sync module's helpers unchanged.
+#
+# Requires: httpx, asyncpg (in addition to the sync scraper's dependencies).
+
+# --- Standard Libraries ---
+import asyncio
+import datetime
+import decimal
+import itertools
+import json
+import os
+import re
+
+# --- Async HTTP / Database Libraries ---
+import asyncpg
+import httpx
+import requests
+from bs4 import BeautifulSoup
+
+# --- Shared Scraper Logic ---
+from manga_scraper_logic import (
+    DESCRIPTION_USER_AGENT, SCHEMA_COMMANDS, oxylabs_realtime_endpoint,
+    apply_description_result, build_search_url, description_iframe_url, extract_page_content,
+    iframe_description_text, inline_description_text, listing_row, oxylabs_credentials,
+    oxylabs_payload, parse_search_page, volumes_from_description_text,
+)
+from listing_dedupe import WARM_LIMIT, get_dedupe_index
+from parse_memo import merge_counts
+from listing_partitions import create_partition_sql, mark_partitions, missing_partitions, partition_name, price_window_start
+from price_sketch import SKETCH_FORMATS, SKETCH_UPSERT_SQL, TDigest, series_key, sketch_key
+from series_suggest import SERIES_ROWS_QUERY, TITLE_ROWS_QUERY, get_suggest_index
+from series_registry import (
+    BACKFILL_BATCH, backfill_params, lookup_series_id, more_specific_aliases, remember_series, should_register,
+    sketch_series_after_backfill, tag_series,
+)
+from scrape_logging import get_logger, get_correlation_id, correlation_scope
+from scrape_jobs import ACTIVE_JOB_SQL, ENQUEUE_SQL, GET_JOB_SQL, JOB_COLUMNS, JOB_SCHEMA_COMMANDS, job_key
+from scrape_budget import DESCRIPTION, PAGE, DeadlineExceeded, by_price_impact
+from fetch_control import CircuitOpenError, get_controller
+
+log = get_logger("async_scraper")
+db_log = get_logger("async_db")
+
+# --- Configuration (env) ---
+# ASYNC_DB_POOL_MIN / ASYNC_DB_POOL_MAX - asyncpg pool size (default 2 / 20)
+# ASYNC_HTTP_MAX_CONNECTIONS          - httpx connection limit (default 200)
+
+
+class AsyncResources:
+    """Process-wide HTTP client and DB pool, opened when the ASGI app starts serving."""
+
+    def __init__(self):
+        self.http = None
+        self.pool = None
+        self._schema_ready = False
+
+    async def start(self):
+        limits = httpx.Limits(max_connections=int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', '200')))
+        self.http = httpx.AsyncClient(limits=limits, headers={"User-Agent": DESCRIPTION_USER_AGENT})
+        self.pool = await asyncpg.create_pool(
+            database=os.environ.get('DB_NAME'),
+            user=os.environ.get('DB_USER'),
+            password=os.environ.get('DB_PASSWORD'),
+            host=os.environ.get('DB_HOST'),
+            port=int(os.environ.get('DB_PORT') or 5432),
+            min_size=int(os.environ.get('ASYNC_DB_POOL_MIN', '2')),
+            max_size=int(os.environ.get('ASYNC_DB_POOL_MAX', '20')),
+        )
+        db_log.info("asyncpg pool ready")
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def ensure_schema(self):
+        if self._schema_ready:
+            return
+        async with self.pool.acquire() as conn:
+            # Schema migrations report through NOTICEs (e.g. legacy rows left unmigrated).
+            conn.add_log_listener(_log_schema_notice)
+            try:
+                for command in SCHEMA_COMMANDS:
+                    await conn.execute(command)
+            finally:
+                conn.remove_log_listener(_log_schema_notice)
+        self._schema_ready = True
+
+
+def _log_schema_notice(conn, message):
+    db_log.info("Schema notice: %s", message.message)
+
+
+resources = AsyncResources()
+
+
+# --- Database Helpers (asyncpg) ---
+INSERT_RETURNING_SQL = """INSERT INTO manga_listings(title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at, dup_cluster, series_id) VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11) ON CONFLICT (link, date_sold) DO NOTHING RETURNING format, price_per_volume, series_id;"""
+
+
+def _to_dollar(query):
+    """ A psycopg2 (%s) query with asyncpg's numbered placeholders. """
+    numbers = itertools.count(1)
+    return re.sub(r'%s', lambda _: f"${next(numbers)}", query)
+
+
+async def lookup_series_id_async(pool, name):
+    """ Async lookup_series_id (cache first). """
+    series_id = lookup_series_id(None, name)
+    if series_id is not None:
+        return series_id
+    key = series_key(name)
+    try:
+        series_id = await pool.fetchval("SELECT series_id FROM series_aliases WHERE alias_key = $1", key)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error looking up series: %s", error)
+        return None
+    if series_id is not None:
+        remember_series({key: series_id})
+    return series_id
+
+
+async def resolve_series_async(pool, name):
+    """ Async resolve_series: registers a new series and backfills its stored listings. """
+    series_id = await lookup_series_id_async(pool, name)
+    if series_id is not None:
+        return series_id
+    key = series_key(name)
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("INSERT INTO series (canonical_name, series_key) VALUES ($1, $2) ON CONFLICT (series_key) DO NOTHING", name.strip(), key)
+                series_id = await conn.fetchval("SELECT id FROM series WHERE series_key = $1", key)
+                await conn.execute("INSERT INTO series_aliases (alias_key, series_id) VALUES ($1, $2) ON CONFLICT (alias_key) DO NOTHING", key, series_id)
+            remember_series(dict(await conn.fetch("SELECT alias_key, series_id FROM series_aliases")), loaded=True)
+            patterns, excluded, reclaim = backfill_params(series_id)
+            backfilled = 0
+            while True:
+                status = await conn.execute("UPDATE manga_listings SET series_id = $1 WHERE (id, date_sold) IN ("
+                                            " SELECT id, date_sold FROM manga_listings WHERE (series_id IS NULL OR series_id = ANY($2::int[])) AND lower(title) LIKE ANY($3::text[])"
+                                            " AND NOT lower(title) LIKE ANY($4::text[]) LIMIT $5)",
+                                            series_id, reclaim, patterns, excluded, BACKFILL_BATCH)
+                updated = int(status.split()[-1])
+                backfilled += updated
+                if updated < BACKFILL_BATCH:
+                    break
+        # Rows moved between series: rebuild the sketches they feed (as series_registry.backfill_series does).
+        if backfilled:
+            for affected in sketch_series_after_backfill(series_id, reclaim):
+                await rebuild_series_sketch_async(pool, None, affected)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error registering series: %s", error, extra={"series": key})
+        return series_id
+    log.info("Registered series", extra={"series": key, "series_id": series_id})
+    return series_id
+
+
+async def series_filter_async(pool, manga_title):
+    """ Async series_filter ($-placeholders). """
+    series_id = await lookup_series_id_async(pool, manga_title)
+    if series_id is not None:
+        return """series_id = $1 AND format IN ('Single', 'Lot') AND price_per_volume IS NOT NULL AND date_sold >= $2""", [series_id, price_window_start()]
+    return """title ILIKE $1 AND format IN ('Single', 'Lot') AND price_per_volume IS NOT NULL AND date_sold >= $2""", [f'%{manga_title}%', price_window_start()]
+
+
+async def get_avg_price_async(pool, manga_title_like):
+    """ Async version of get_avg_price_from_db. Returns (avg_price, count). """
+    where, params = await series_filter_async(pool, manga_title_like)
+    try:
+        row = await pool.fetchrow(""" SELECT AVG(price_per_volume), COUNT(*) FROM manga_listings WHERE """ + where, *params)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error querying average price: %s", error)
+        return None, 0
+    if row and row[0] is not None:
+        return float(row[0]), int(row[1])
+    return None, 0
+
+
+async def get_series_freshness_async(pool, manga_title_like):
+    """ Async version of get_series_freshness. Returns (newest scraped_at, count). """
+    where, params = await series_filter_async(pool, manga_title_like)
+    try:
+        row = await pool.fetchrow(""" SELECT MAX(scraped_at), COUNT(*) FROM manga_listings WHERE """ + where, *params)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error querying series freshness: %s", error)
+        return None, 0
+    if row and row[0] is not None:
+        return row[0], int(row[1])
+    return None, 0
+
+
+async def get_price_summary_async(pool, manga_title):
+    """
+    Price distribution summary from the series' stored sketch, rebuilt (and
+    stored) from the same rows as the average price when there is none for the
+    current price window.
+    """
+    series_id = await lookup_series_id_async(pool, manga_title)
+    try:
+        row = await pool.fetchrow("SELECT sketch FROM series_price_sketches WHERE series_key = $1 AND window_start = $2",
+                                  sketch_key(manga_title, series_id), price_window_start())
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error reading price sketch: %s", error)
+        return None
+    digest = TDigest.from_json(row[0]) if row else await rebuild_series_sketch_async(pool, manga_title, series_id)
+    return digest.summary() if digest else None
+
+
+async def rebuild_series_sketch_async(pool, manga_title, series_id=None):
+    """ Async price_sketch.rebuild_series_sketch: builds the series' sketch for the price window and stores it. """
+    window_start = price_window_start()
+    key = sketch_key(manga_title, series_id)
+    match, param = ("series_id = $1", series_id) if series_id is not None else ("title ILIKE $1", f'%{manga_title}%')
+    digest = TDigest()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Cursor so large series are streamed, not loaded at once.
+                async for (price,) in conn.cursor(f"SELECT price_per_volume FROM manga_listings WHERE {match} AND format = ANY($2::text[]) "
+                                                  "AND price_per_volume IS NOT NULL AND date_sold >= $3", param, list(SKETCH_FORMATS), window_start):
+                    digest.add(float(price))
+                await conn.execute(_to_dollar(SKETCH_UPSERT_SQL), key, digest.to_json(), int(digest.count), datetime.datetime.now(), window_start)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error rebuilding price sketch: %s", error, extra={"series": key})
+        return None
+    db_log.info("Rebuilt price sketch", extra={"series": key, "samples": int(digest.count)})
+    return digest
+
+
+async def warm_dedupe_async(pool, manga_title):
+    """ Async warm_from_db: seeds the shared near-duplicate index once per series. """
+    index = get_dedupe_index()
+    if not index.needs_warm(manga_title):
+        return 0
+    series_id = await lookup_series_id_async(pool, manga_title)
+    match, param = ("series_id = $1", series_id) if series_id is not None else ("title ILIKE $1", f'%{manga_title}%')
+    query = f"SELECT title, num_volumes, format FROM manga_listings WHERE {match} AND parse_source = 'Description' AND num_volumes > 0 ORDER BY scraped_at DESC LIMIT $2"
+    try:
+        rows = await pool.fetch(query, param, WARM_LIMIT)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error loading resolved listings: %s", error)
+        return 0
+    return index.warm(manga_title, [tuple(row) for row in rows])
+
+
+async def refresh_suggest_index_async(pool):
+    """ Async series_suggest.load_delta. """
+    index = get_suggest_index()
+    after = index.series_rows_after()
+    try:
+        series_rows = await pool.fetch(_to_dollar(SERIES_ROWS_QUERY), after)
+        title_rows = await pool.fetch(_to_dollar(TITLE_ROWS_QUERY), index.last_listing_id, index.max_titles)
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error loading suggest index rows: %s", error)
+        index.refresh_failed()
+        return False
+    index.apply_rows([tuple(row) for row in series_rows], [tuple(row) for row in title_rows], recount=after == 0)
+    return True
+
+
+async def ensure_partitions_async(pool, dates):
+    """ Async ensure_partitions: creates month partitions this process hasn't seen yet. """
+    created = []
+    for start in missing_partitions(dates):
+        try:
+            await pool.execute(create_partition_sql(start))
+            created.append(start)
+        except (asyncpg.PostgresError, OSError) as error:
+            db_log.warning("Could not create partition %s: %s", partition_name(start), error)
+    mark_partitions(created)
+
+
+async def record_listings_async(pool, items, manga_title):
+    """ Inserts listings and folds newly inserted per-volume prices into the series' sketch. """
+    attempted, prices, new_rows = 0, [], 0
+    # Same rule as series_registry.assign_series: an unregistered name is registered only once its listings name it.
+    series_id = await lookup_series_id_async(pool, manga_title)
+    if series_id is None:
+        tag_series(items, None, more_specific_aliases(None, None, own=[series_key(manga_title)]))
+        if should_register(manga_title, items):
+            series_id = await resolve_series_async(pool, manga_title)
+    if series_id is not None:
+        tag_series(items, series_id, more_specific_aliases(None, series_id))
+    # listing_row is None for an unparseable sold date (see listing_row).
+    dated = [(item_data, row) for item_data, row in zip(items, map(listing_row, items)) if row is not None]
+    await ensure_partitions_async(pool, [row[2] for _, row in dated])
+    for item_data, row in dated:
+        try:
+            inserted = await pool.fetchrow(INSERT_RETURNING_SQL, *row)
+        except (asyncpg.PostgresError, OSError) as error:
+            db_log.error("Error inserting listing: %s", error, extra={"link": item_data.get('link')})
+            continue
+        attempted += 1
+        new_rows += 1 if inserted else 0
+        if (inserted and inserted['format'] in SKETCH_FORMATS and inserted['price_per_volume'] is not None
+                and inserted['series_id'] == series_id):
+            prices.append(float(inserted['price_per_volume']))
+    if prices:
+        key = sketch_key(manga_title, series_id)
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    existing = await conn.fetchrow("SELECT sketch FROM series_price_sketches WHERE series_key = $1 AND window_start = $2 FOR UPDATE",
+                                                   key, price_window_start())
+                    if existing is not None:
+                        digest = TDigest.from_json(existing[0]).update(prices)
+                        await conn.execute("UPDATE series_price_sketches SET sketch = $1, sample_count = $2, updated_at = now() WHERE series_key = $3",
+                                           digest.to_json(), int(digest.count), key)
+            if existing is None:
+                # No sketch for this window yet: build it from the windowed rows, which include this batch.
+                await rebuild_series_sketch_async(pool, manga_title, series_id)
+        except (asyncpg.PostgresError, OSError) as error:
+            db_log.error("Error updating price sketch: %s", error, extra={"series": key})
+    if new_rows:
+        get_suggest_index().observe_listings(manga_title if series_id is not None else None,
+                                             [item_data['title'] for item_data in items], new_rows)
+    return attempted
+
+
+# --- Network Helpers (httpx) ---
+async def get_volumes_from_description_async(client, listing_url):
+    """ Async version of get_volumes_from_description. Returns (count, format). """
+    try:
+        # Pacing, retries and circuit breaking are shared with the sync description fetches.
+        ebay = get_controller("ebay")
+        response = await ebay.request_async("GET", listing_url, client, timeout=30)
+        response.raise_for_status()
+        soup = await asyncio.to_thread(BeautifulSoup, response.text, 'html.parser')
+        iframe_url = description_iframe_url(soup)
+        desc_text = ""
+
+        if iframe_url:
+            try:
+                iframe_response = await ebay.request_async("GET", iframe_url, client, timeout=25)
+                iframe_response.raise_for_status()
+                desc_text = await asyncio.to_thread(iframe_description_text, iframe_response.text)
+            except (httpx.HTTPError, requests.exceptions.RequestException) as ie:
+                log.warning("Error fetching description iframe: %s", ie, extra={"url": iframe_url})
+                desc_text = inline_description_text(soup)
+        else:
+            desc_text = inline_description_text(soup)
+
+        if not desc_text:
+            log.warning("Could not extract description text", extra={"url": listing_url})
+            return 0, 'Unknown'
+        return volumes_from_description_text(desc_text)
+
+    except httpx.HTTPStatusError as e:
+        log.warning("HTTP error fetching description", extra={"url": listing_url, "status": e.response.status_code})
+        return 0, 'Exclude'
+    except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+        # RequestException: CircuitOpenError / DeadlineExceeded from the fetch controller
+        log.warning("Network error fetching description: %s", e, extra={"url": listing_url})
+        return 0, 'Unknown'
+    except Exception as e:
+        log.warning("Error parsing description: %s", e, extra={"url": listing_url})
+        return 0, 'Unknown'
+
+
+async def fetch_search_page_async(client, credentials, page_url, budget=None):
+    """ Fetches one rendered search page through Oxylabs (retried by the shared controller). Returns the HTML or None. """
+    response = await get_controller("oxylabs").request_async("POST", oxylabs_realtime_endpoint(), client, budget=budget,
+                                                             auth=credentials, json=oxylabs_payload(page_url), timeout=60)
+    response.raise_for_status()
+    return extract_page_content(response.json())
+
+
+# --- Core Async Scraping Function ---
+async def _describe_within(res, budget, link):
+    """ Description fetch, cut off at the budget's deadline (counted as unresolved). """
+    if budget is None:
+        return await get_volumes_from_description_async(res.http, link)
+    try:
+        with budget.measure(DESCRIPTION):
+            return await asyncio.wait_for(get_volumes_from_description_async(res.http, link), timeout=budget.remaining())
+    except asyncio.TimeoutError:
+        return 0, 'Unknown'
+
+
+async def run_scrape_async(manga_title, max_pages=3, min_price=5, fetch_descriptions=False, res=None, on_page=None, budget=None):
+    """
+    Async run_scrape: same flow and return value, without blocking the event loop.
+    on_page(pages, rows) reports progress; budget works as in run_scrape.
+    """
+    res = res or resources
+    with correlation_scope(get_correlation_id() if get_correlation_id() != "-" else None):
+        credentials = oxylabs_credentials()
+        if not credentials:
+            return False
+
+        await res.ensure_schema()
+        await warm_dedupe_async(res.pool, manga_title)
+        dedupe = get_dedupe_index()
+        log.info("Starting async scrape", extra={"series": manga_title, "max_pages": max_pages})
+        db_insert_count = 0
+        success = True
+        deferred, page_prices = [], []
+        memo_totals = {}
+
+        for page_num in range(1, max_pages + 1):
+            if budget is not None and not budget.can_afford(PAGE):
+                budget.skip(PAGE, max_pages - page_num + 1)
+                log.info("Time budget too short for another page, stopping", extra={"page": page_num, "remaining": round(budget.remaining(), 2)})
+                break
+            page_url = build_search_url(manga_title, min_price, page_num)
+            try:
+                if budget is None:
+                    page_content = await fetch_search_page_async(res.http, credentials, page_url)
+                else:
+                    with budget.measure(PAGE):
+                        page_content = await asyncio.wait_for(fetch_search_page_async(res.http, credentials, page_url, budget), timeout=budget.remaining())
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                budget.skip(PAGE, max_pages - page_num + 1)
+                log.info("Time budget exhausted, page not fetched", extra={"page": page_num})
+                break
+            except CircuitOpenError as e:
+                log.error("Oxylabs circuit open, skipping page: %s", e, extra={"page": page_num})
+                success = False
+                break
+            except httpx.TimeoutException:
+                log.error("Oxylabs request timed out after retries", extra={"page": page_num})
+                success = False
+                break
+            except httpx.HTTPStatusError as e:
+                log.error("Oxylabs HTTP error", extra={"page": page_num, "status": e.response.status_code, "details": e.response.text[:500]})
+                success = False
+                break
+            except (httpx.HTTPError, ValueError) as e:
+                log.error("Oxylabs request failed: %s", e, extra={"page": page_num})
+                success = False
+                break
+
+            if not page_content:
+                log.error("No HTML content, stopping", extra={"page": page_num})
+                success = False
+                break
+
+            # BeautifulSoup parsing is CPU-bound; keep it off the event loop.
+            listings_found, candidates, memo_counts = await asyncio.to_thread(parse_search_page, page_content, manga_title, min_price)
+            merge_counts(memo_totals, memo_counts)
+            if not listings_found:
+                log.info("No listings found, stopping", extra={"page": page_num})
+                break
+
+            page_items = []
+            for item_data in candidates:
+                # Same resolution order as manga_scraper_logic.enrich_candidate, with an awaited description fetch.
+                if not item_data["ambiguous"]:
+                    dedupe.record(manga_title, item_data)
+                elif not dedupe.resolve_ambiguous(manga_title, item_data):
+                    if not fetch_descriptions:
+                        continue
+                    if budget is not None:
+                        # Descriptions wait until the pages are in, then go by price impact.
+                        deferred.append(item_data)
+                        continue
+                    desc_volumes, desc_format = await get_volumes_from_description_async(res.http, item_data["link"])
+                    if apply_description_result(item_data, desc_volumes, desc_format) is None:
+                        continue
+                    dedupe.record(manga_title, item_data)
+                page_items.append(item_data)
+                if item_data.get("num_volumes") and item_data.get("format") in SKETCH_FORMATS:
+                    page_prices.append(item_data["total_price"] / item_data["num_volumes"])
+            page_insert_count = await record_listings_async(res.pool, page_items, manga_title)
+
+            db_insert_count += page_insert_count
+            log.info("Finished page", extra={"page": page_num, "inserted": page_insert_count})
+            if on_page:
+                on_page(page_num, db_insert_count)
+
+        if deferred:
+            ranked = by_price_impact(deferred, page_prices)
+            resolved = []
+            for position, item_data in enumerate(ranked):
+                if not budget.can_afford(DESCRIPTION):
+                    budget.skip(DESCRIPTION, len(ranked) - position)
+                    break
+                if not dedupe.resolve_ambiguous(manga_title, item_data):
+                    desc_volumes, desc_format = await _describe_within(res, budget, item_data["link"])
+                    if apply_description_result(item_data, desc_volumes, desc_format) is None:
+                        continue
+                    dedupe.record(manga_title, item_data)
+                resolved.append(item_data)
+            if resolved:
+                db_insert_count += await record_listings_async(res.pool, resolved, manga_title)
+            log.info("Deferred descriptions", extra={"deferred": len(ranked), "resolved": len(resolved), "budget": budget.report()})
+
+        log.info("Async scrape finished", extra={"series": manga_title, "inserted": db_insert_count, "success": success, "parse_memo": memo_totals,
+                                                 "budget": budget.report() if budget is not None else None})
+        return success
+
+
+# --- Scrapes through the job queue (SCRAPE_EXECUTION=queue) ---
+async def enqueue_job_async(pool, manga_title, max_pages=3, min_price=5, fetch_descriptions=False, correlation_id=None):
+    """ Async version of scrape_jobs.enqueue_job. Returns the job id, or None. """
+    max_attempts = int(os.environ.get('SCRAPE_JOB_MAX_ATTEMPTS', '3'))
+    key = job_key(manga_title)
+    async with pool.acquire() as conn:
+        for command in JOB_SCHEMA_COMMANDS:
+            await conn.execute(command)
+        # Two tries: the active job we conflicted with may finish before we can read its id.
+        for _ in range(2):
+            job_id = await conn.fetchval(_to_dollar(ENQUEUE_SQL), key, manga_title.strip(), max_pages, decimal.Decimal(str(min_price)),
+                                         fetch_descriptions, 0, max_attempts, correlation_id)
+            if job_id is None:
+                job_id = await conn.fetchval(_to_dollar(ACTIVE_JOB_SQL), key)
+            if job_id is not None:
+                return job_id
+    return None
+
+
+async def get_job_async(pool, job_id):
+    row = await pool.fetchrow(_to_dollar(GET_JOB_SQL), job_id)
+    if row is None:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    # asyncpg returns JSONB as text.
+    for column in ("progress", "result"):
+        if isinstance(job[column], str):
+            job[column] = json.loads(job[column])
+    return job
+
+
+async def run_scrape_queued_async(pool, manga_title, max_pages=3, min_price=5, fetch_descriptions=False, timeout=None, on_page=None):
+    """ Async version of scrape_jobs.run_scrape_queued: enqueue (or join) the series' job and poll until it is done. """
+    timeout = timeout if timeout is not None else float(os.environ.get('SCRAPE_JOB_WAIT_SECONDS', '300'))
+    correlation_id = get_correlation_id()
+    try:
+        job_id = await enqueue_job_async(pool, manga_title, max_pages=max_pages, min_price=min_price, fetch_descriptions=fetch_descriptions,
+                                         correlation_id=correlation_id if correlation_id != "-" else None)
+        if job_id is None:
+            return False
+        log.info("Scrape queued", extra={"job": job_id, "series": manga_title})
+        deadline = asyncio.get_running_loop().time() + timeout
+        seen = None
+        while True:
+            job = await get_job_async(pool, job_id)
+            progress = job and job["progress"]
+            if on_page and progress and progress != seen:
+                seen = progress
+                on_page(progress["pages"], progress["rows"])
+            if job is None or job["status"] in ('succeeded', 'failed') or asyncio.get_running_loop().time() >= deadline:
+                break
+            await asyncio.sleep(1.0)
+        if job is None or job["status"] != 'succeeded':
+            log.warning("Queued scrape not finished", extra={"job": job_id, "status": job and job["status"], "timeout": timeout})
+            return False
+        return True
+    except (asyncpg.PostgresError, OSError) as error:
+        db_log.error("Error queueing scrape: %s", error, extra={"series": manga_title})
+        return False
@@ -0,0 +1,304 @@
+# === Adaptive Fetch Control (pacing, retries, circuit breaking) ===
+# One FetchController per upstream ("oxylabs", "ebay") is shared by every scrape
+# thread (and, through request_async, every async scrape) in the process. It
+# replaces the fixed random sleeps:
+#
+#   * Pacing (AIMD): the gap between requests shrinks by a fixed step after each
+#     fast success and doubles on 429/5xx or a latency spike, so throughput
+#     rises to what the upstream tolerates and backs off quickly when it pushes back.
+#   * Retries: transient failures (timeouts, connection errors, 429, 5xx) are
+#     retried with full-jitter exponential backoff, honouring Retry-After.
+#   * Circuit breaker: after N consecutive failures the upstream is considered
+#     down for a cooldown; callers fail fast instead of queueing behind it, then
+#     a single probe request decides whether to close the circuit again.
+#   * Time budget: under an active ScrapeBudget (scrape_budget.py) timeouts are
+#     capped to the time left and waits that would overrun it raise DeadlineExceeded.
+#     A timeout that only fired because the budget shortened it raises
+#     DeadlineExceeded too and does not count against the upstream.
+
+# --- Standard Libraries ---
+import asyncio
+import os
+import random
+import threading
+import time
+
+# --- Web Scraping Libraries ---
+import requests
+
+# --- Logging ---
+from scrape_logging import get_logger
+from scrape_budget import DeadlineExceeded, current_budget
+
+log = get_logger("fetch_control")
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while an upstream's circuit is open."""
+
+
+class FetchController:
+    """Shared pacing + retry + circuit-breaker state for one upstream."""
+
+    def __init__(self, name, initial_interval=1.0, min_interval=0.0, max_interval=60.0,
+                 additive_step=0.25, target_latency=None, max_retries=3, backoff_base=1.0,
+                 backoff_cap=30.0, failure_threshold=5, cooldown=60.0):
+        self.name = name
+        self.interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.additive_step = additive_step
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._latency_ewma = None
+
+    # --- Pacing ---
+    def _reserve(self, max_wait=None):
+        """Reserves this caller's request slot (slots are spaced `interval` apart); returns seconds until it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            if max_wait is not None and slot - now > max_wait:
+                raise DeadlineExceeded(f"next '{self.name}' request slot is past the time budget")
+            self._next_slot = slot + self.interval
+        return slot - time.monotonic()
+
+    def acquire(self, max_wait=None):
+        """Blocks until this caller's request slot."""
+        wait = self._reserve(max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait=None):
+        """Waits (without blocking the event loop) until this caller's request slot."""
+        wait = self._reserve(max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _on_success(self, latency):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            target = self.target_latency or 2.0 * self._latency_ewma
+            if latency > target:
+                # Latency spike: the upstream is queueing us, back off.
+                self.interval = min(self.max_interval, max(self.interval, self.additive_step) * 2)
+            else:
+                self.interval = max(self.min_interval, self.interval - self.additive_step)
+
+    def _on_failure(self, throttled):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._probe_in_flight = False
+            if throttled:
+                self.interval = min(self.max_interval, max(self.interval, self.additive_step) * 2)
+            if self._consecutive_failures >= self.failure_threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                log.error("Circuit opened", extra={"upstream": self.name, "failures": self._consecutive_failures, "cooldown": self.cooldown})
+            elif self._opened_at is not None:
+                # Failed half-open probe: start a fresh cooldown.
+                self._opened_at = time.monotonic()
+
+    # --- Circuit breaker ---
+    def _check_circuit(self):
+        """ Raises CircuitOpenError while the circuit is open; True if this caller is the half-open probe. """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.cooldown or self._probe_in_flight:
+                raise CircuitOpenError(f"circuit open for upstream '{self.name}'")
+            # Half-open: let exactly one probe through.
+            self._probe_in_flight = True
+            log.info("Circuit half-open, probing", extra={"upstream": self.name})
+            return True
+
+    def _end_probe(self):
+        # A probe that ended without a verdict (e.g. InvalidURL) must not block later probes.
+        with self._lock:
+            self._probe_in_flight = False
+
+    @property
+    def circuit_open(self):
+        return self._opened_at is not None
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.backoff_cap, retry_after)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    # --- Request wrapper ---
+    def _retry_after_error(self, error, attempt):
+        """ Records a transient error; returns the retry delay, or re-raises it after the last attempt. """
+        self._on_failure(throttled=False)
+        if attempt >= self.max_retries:
+            raise error
+        delay = self._backoff(attempt)
+        log.warning("Transient error, retrying: %s", error, extra={"upstream": self.name, "attempt": attempt + 1, "delay": round(delay, 2)})
+        return delay
+
+    def _retry_after_response(self, response, latency, attempt):
+        """ Records a response; returns the retry delay, or None if the response is final. """
+        if response.status_code not in RETRYABLE_STATUSES:
+            self._on_success(latency)
+            return None
+        self._on_failure(throttled=True)
+        if attempt >= self.max_retries:
+            return None
+        delay = self._backoff(attempt, _retry_after_seconds(response))
+        log.warning("Upstream returned %d, retrying", response.status_code, extra={"upstream": self.name, "attempt": attempt + 1, "delay": round(delay, 2)})
+        return delay
+
+    @staticmethod
+    def _budget_timeout(budget, timeout):
+        """
+        (timeout capped to the budget, whether the cap shortened it). A
+        timeout the budget shortened says nothing about the upstream, so it
+        is not counted as a failure or throttle signal.
+        """
+        capped = budget.cap(timeout)
+        return capped, not isinstance(timeout, (int, float)) or capped < timeout
+
+    def _check_retry(self, budget, delay):
+        if budget is not None and delay >= budget.remaining():
+            raise DeadlineExceeded(f"'{self.name}' retry would overrun the time budget")
+
+    def request(self, method, url, session=None, **kwargs):
+        """
+        Sends a request with pacing, retries and circuit breaking.
+        Returns the final response (4xx other than 429 are returned as-is for the caller to handle);
+        raises the last RequestException if every attempt failed, or CircuitOpenError.
+        """
+        sender = session or requests
+        budget = current_budget()
+        timeout = kwargs.get('timeout')
+        attempt = 0
+        while True:
+            # Budget first: running out of time must not take (and strand) the half-open probe.
+            if budget is not None:
+                budget.cap(timeout)
+            probing = self._check_circuit()
+            try:
+                shortened = False
+                if budget is not None:
+                    self.acquire(max_wait=budget.remaining())
+                    kwargs['timeout'], shortened = self._budget_timeout(budget, timeout)
+                else:
+                    self.acquire()
+                started = time.monotonic()
+                try:
+                    response = sender.request(method, url, **kwargs)
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as error:
+                    if shortened and isinstance(error, requests.exceptions.Timeout):
+                        raise DeadlineExceeded(f"'{self.name}' request cut off by the time budget") from error
+                    delay = self._retry_after_error(error, attempt)
+                else:
+                    delay = self._retry_after_response(response, time.monotonic() - started, attempt)
+                    if delay is None:
+                        return response
+            finally:
+                if probing:
+                    self._end_probe()
+            self._check_retry(budget, delay)
+            attempt += 1
+            time.sleep(delay)
+
+    async def request_async(self, method, url, client, budget=None, **kwargs):
+        """
+        request() for an httpx.AsyncClient: same pacing, retries and circuit,
+        shared with the sync callers of this upstream. httpx transport errors
+        (timeouts, connection errors) are the transient ones.
+        """
+        import httpx  # only the async scraper depends on httpx
+
+        timeout = kwargs.get('timeout')
+        attempt = 0
+        while True:
+            if budget is not None:
+                budget.cap(timeout)
+            probing = self._check_circuit()
+            try:
+                shortened = False
+                if budget is not None:
+                    await self.acquire_async(max_wait=budget.remaining())
+                    kwargs['timeout'], shortened = self._budget_timeout(budget, timeout)
+                else:
+                    await self.acquire_async()
+                started = time.monotonic()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except httpx.TransportError as error:
+                    if shortened and isinstance(error, httpx.TimeoutException):
+                        raise DeadlineExceeded(f"'{self.name}' request cut off by the time budget") from error
+                    delay = self._retry_after_error(error, attempt)
+                else:
+                    delay = self._retry_after_response(response, time.monotonic() - started, attempt)
+                    if delay is None:
+                        return response
+            finally:
+                if probing:
+                    self._end_probe()
+            self._check_retry(budget, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        return {
+            "interval": round(self.interval, 3),
+            "latencyEwma": round(self._latency_ewma, 3) if self._latency_ewma is not None else None,
+            "consecutiveFailures": self._consecutive_failures,
+            "circuitOpen": self.circuit_open,
+        }
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+# --- Shared controllers ---
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+# Defaults per upstream; the eBay values keep description fetches at least as polite as the old sleeps.
+_DEFAULTS = {
+    "oxylabs": dict(initial_interval=1.0, min_interval=0.0, max_interval=30.0, additive_step=0.25),
+    "ebay": dict(initial_interval=5.0, min_interval=2.0, max_interval=60.0, additive_step=0.5),
+}
+
+
+def get_controller(name):
+    """Returns the process-wide controller for an upstream (FETCH_<NAME>_MIN_INTERVAL etc. override defaults)."""
+    with _controllers_lock:
+        controller = _controllers.get(name)
+        if controller is None:
+            settings = dict(_DEFAULTS.get(name, {}))
+            prefix = f"FETCH_{name.upper()}_"
+            for key, env in (("min_interval", "MIN_INTERVAL"), ("max_interval", "MAX_INTERVAL"),
+                             ("max_retries", "MAX_RETRIES"), ("failure_threshold", "FAILURE_THRESHOLD"),
+                             ("cooldown", "COOLDOWN")):
+                if os.environ.get(prefix + env):
+                    settings[key] = float(os.environ[prefix + env])
+            for key in ("max_retries", "failure_threshold"):
+                if key in settings:
+                    settings[key] = int(settings[key])
+            controller = _controllers[name] = FetchController(name, **settings)
+        return controller
@@ -0,0 +1,89 @@
+# === HTTP Conditional Caching for Price Lookups ===
+# Validators (ETag / Last-Modified) are derived from the newest `scraped_at`
+# and the listing count for a series, so they change exactly when the data
+# behind a price changes. Cache-Control lets the browser and the CDN in front
+# of the Netlify frontend answer repeat lookups without reaching Python.
+
+# --- Standard Libraries ---
+import datetime
+import hashlib
+import os
+from email.utils import format_datetime, parsedate_to_datetime
+
+# --- Configuration (env) ---
+# PRICES_CACHE_MAX_AGE - seconds a /api/prices response is fresh (default 3600)
+# PRICES_CACHE_SWR     - seconds a stale response may be served while revalidating (default 86400)
+
+
+def cache_max_age():
+    return int(os.environ.get('PRICES_CACHE_MAX_AGE', '3600'))
+
+
+def cache_stale_while_revalidate():
+    return int(os.environ.get('PRICES_CACHE_SWR', '86400'))
+
+
+def cache_control_header():
+    """Cache-Control value for successful price responses."""
+    return f"public, max-age={cache_max_age()}, stale-while-revalidate={cache_stale_while_revalidate()}"
+
+
+def as_utc(timestamp):
+    """ An aware UTC datetime; scraped_at is stored as a naive TIMESTAMP holding UTC. """
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc)
+
+
+def make_validators(newest_scraped_at, row_count, *key_parts):
+    """
+    Returns (etag, last_modified) for a series' data state.
+    `key_parts` are the request parameters that shape the body (series, volumes, condition).
+    """
+    if newest_scraped_at is None:
+        return None, None
+    # HTTP dates have second precision.
+    last_modified = as_utc(newest_scraped_at).replace(microsecond=0)
+    fingerprint = "|".join([newest_scraped_at.isoformat(), str(row_count)] + [str(p).strip().lower() for p in key_parts])
+    etag = 'W/"' + hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:20] + '"'
+    return etag, last_modified
+
+
+def is_fresh(newest_scraped_at, now=None):
+    """True if the newest stored listing is younger than max-age (no re-scrape needed)."""
+    if newest_scraped_at is None:
+        return False
+    now = as_utc(now) if now is not None else datetime.datetime.now(datetime.timezone.utc)
+    return (now - as_utc(newest_scraped_at)).total_seconds() < cache_max_age()
+
+
+def is_not_modified(req, etag, last_modified):
+    """Evaluates If-None-Match / If-Modified-Since (RFC 9110: If-None-Match wins when present)."""
+    if etag is None:
+        return False
+    if_none_match = req.headers.get('If-None-Match')
+    if if_none_match is not None:
+        candidates = [c.strip() for c in if_none_match.split(',')]
+        # Weak comparison: ignore the W/ prefix on both sides.
+        bare = etag[2:] if etag.startswith('W/') else etag
+        return '*' in candidates or any((c[2:] if c.startswith('W/') else c) == bare for c in candidates)
+    if_modified_since = req.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return last_modified <= since
+    return False
+
+
+def apply_cache_headers(response, etag, last_modified):
+    """Adds validators and Cache-Control to a Flask response."""
+    if etag is not None:
+        response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    response.headers['Cache-Control'] = cache_control_header()
+    return response
@@ -0,0 +1,227 @@
+# === Near-Duplicate Listing Detection ===
+# Sellers relist the same lot over and over with near-identical titles
+# ("NARUTO Manga Lot English VIZ" / "Naruto manga lot - English, Viz!"). Each
+# ambiguous copy used to cost its own description fetch. Titles are reduced to
+# a MinHash signature over character shingles and bucketed with LSH, so a new
+# listing finds its cluster in O(bands) lookups. A cluster whose volume count
+# was already resolved hands that count and format to every later copy.
+#
+# Only titles with identical numbers can share a cluster: "Vol 1" and "Vol 2"
+# are near-identical strings but different books.
+
+# --- Standard Libraries ---
+import hashlib
+import os
+import random
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+# --- Database Library ---
+import psycopg2
+
+# --- Logging / Series Identity ---
+from scrape_logging import get_logger
+from series_registry import series_match
+
+log = get_logger("dedupe")
+
+# --- Configuration (env) ---
+# DEDUPE_THRESHOLD    - minimum estimated Jaccard similarity to join a cluster (default 0.8)
+# DEDUPE_MAX_CLUSTERS - clusters kept per process before the oldest are evicted (default 50000)
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed: signatures (and so cluster ids) must be stable across processes and restarts.
+_rng = random.Random(0x6D616E6761)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+# Listing boilerplate that differs between relists of the same item.
+_NOISE_WORDS = re.compile(r'\b(new listing|free shipping|fast shipping|ships fast|brand new|like new|used|good condition|very good|great condition|english|viz|paperback|manga|lot of|rare|oop)\b')
+
+
+def normalize_listing_title(title):
+    """ Lowercased title without punctuation and common listing boilerplate. """
+    text = _NOISE_WORDS.sub(' ', title.lower())
+    text = re.sub(r'[^a-z0-9]+', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def number_key(normalized_title):
+    """ The title's numbers in order; titles must agree on these to be duplicates. """
+    return ' '.join(re.findall(r'\d+', normalized_title))
+
+
+def minhash_signature(normalized_title):
+    """ MinHash signature over character shingles (tuple of NUM_PERMUTATIONS ints). """
+    text = f" {normalized_title} "
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """
+    Per-process LSH index of listing clusters, partitioned by series and by the
+    title's numbers. A cluster is {'id', 'signature', 'num_volumes', 'format'};
+    num_volumes is None until some member's volume count has been resolved.
+    """
+
+    def __init__(self, threshold=None, max_clusters=None):
+        self.threshold = threshold if threshold is not None else float(os.environ.get('DEDUPE_THRESHOLD', '0.8'))
+        self.max_clusters = max_clusters if max_clusters is not None else int(os.environ.get('DEDUPE_MAX_CLUSTERS', '50000'))
+        self._lock = threading.Lock()
+        self._clusters = OrderedDict()   # cluster id -> cluster (LRU order)
+        self._buckets = {}               # (series, numbers, band, band hash) -> set of cluster ids
+        self._warmed = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _band_keys(self, series, numbers, signature):
+        return [(series, numbers, band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+                for band in range(NUM_BANDS)]
+
+    def _find(self, band_keys, signature):
+        best, best_score = None, self.threshold
+        seen = set()
+        for key in band_keys:
+            for cluster_id in self._buckets.get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                score = estimated_similarity(signature, self._clusters[cluster_id]['signature'])
+                if score >= best_score:
+                    best, best_score = self._clusters[cluster_id], score
+        return best
+
+    def _evict(self):
+        while len(self._clusters) > self.max_clusters:
+            cluster_id, cluster = self._clusters.popitem(last=False)
+            for key in cluster['band_keys']:
+                members = self._buckets.get(key)
+                if members is not None:
+                    members.discard(cluster_id)
+                    if not members:
+                        del self._buckets[key]
+
+    def assign(self, manga_title, title, num_volumes=None, format_type=None):
+        """
+        Returns the cluster for a listing title, creating one if no near-duplicate
+        is known. Passing num_volumes/format_type records them as the cluster's
+        resolved values (the first resolution wins).
+        """
+        normalized = normalize_listing_title(title)
+        series = manga_title.strip().lower()
+        numbers = number_key(normalized)
+        signature = minhash_signature(normalized)
+        band_keys = self._band_keys(series, numbers, signature)
+        with self._lock:
+            cluster = self._find(band_keys, signature)
+            if cluster is None:
+                digest = hashlib.blake2b(f"{series}|{normalized}".encode('utf-8'), digest_size=8).hexdigest()
+                cluster = self._clusters.get(digest)
+                if cluster is None:
+                    cluster = {'id': digest, 'signature': signature, 'band_keys': band_keys, 'num_volumes': None, 'format': None}
+                    self._clusters[digest] = cluster
+                    for key in band_keys:
+                        self._buckets.setdefault(key, set()).add(digest)
+                    self._evict()
+            else:
+                self._clusters.move_to_end(cluster['id'])
+            if num_volumes and cluster['num_volumes'] is None:
+                cluster['num_volumes'], cluster['format'] = num_volumes, format_type
+            return dict(cluster)
+
+    def resolve_ambiguous(self, manga_title, item_data):
+        """
+        Gives an ambiguous listing its cluster's resolved volume count and format.
+        Tags item_data['dup_cluster'] either way; returns True if it was resolved.
+        """
+        cluster = self.assign(manga_title, item_data['title'])
+        item_data['dup_cluster'] = cluster['id']
+        with self._lock:
+            if cluster['num_volumes'] is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+        item_data['num_volumes'] = cluster['num_volumes']
+        item_data['format'] = cluster['format']
+        item_data['parse_source'] = "Duplicate"
+        item_data['ambiguous'] = False
+        return True
+
+    def record(self, manga_title, item_data):
+        """ Files a resolved listing under its cluster (tagging item_data['dup_cluster']). """
+        resolved = item_data['num_volumes'] if item_data.get('parse_source') == "Description" else None
+        cluster = self.assign(manga_title, item_data['title'], resolved, item_data.get('format'))
+        item_data['dup_cluster'] = cluster['id']
+        return cluster['id']
+
+    def needs_warm(self, manga_title):
+        with self._lock:
+            return manga_title.strip().lower() not in self._warmed
+
+    def warm(self, manga_title, rows):
+        """ Seeds the index from stored (title, num_volumes, format) rows resolved by description. """
+        with self._lock:
+            self._warmed.add(manga_title.strip().lower())
+        count = 0
+        for title, num_volumes, format_type in rows:
+            self.assign(manga_title, title, num_volumes, format_type)
+            count += 1
+        log.debug("Warmed near-duplicate index", extra={"series": manga_title, "rows": count})
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {"clusters": len(self._clusters), "hits": self.hits, "misses": self.misses}
+
+
+# Description-resolved listings are the ones worth reusing: they cost a fetch each.
+# {match}: series_registry.series_match (series_id, or title ILIKE for an unregistered name)
+WARM_QUERY = "SELECT title, num_volumes, format FROM manga_listings WHERE {match} AND parse_source = 'Description' AND num_volumes > 0 ORDER BY scraped_at DESC LIMIT %s"
+WARM_LIMIT = 5000
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_dedupe_index():
+    """ Process-wide near-duplicate index, shared by every scrape in the process. """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+        return _index
+
+
+def warm_from_db(conn, manga_title, index=None):
+    """ Seeds the index for a series from the DB once per process. """
+    index = index or get_dedupe_index()
+    if not conn or not index.needs_warm(manga_title):
+        return 0
+    cur = None
+    try:
+        match, params = series_match(conn, manga_title)
+        cur = conn.cursor()
+        cur.execute(WARM_QUERY.format(match=match), params + [WARM_LIMIT])
+        rows = cur.fetchall()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("Error loading resolved listings: %s", error, extra={"series": manga_title})
+        conn.rollback()
+        return 0
+    finally:
+        if cur:
+            cur.close()
+    return index.warm(manga_title, rows)
@@ -0,0 +1,234 @@
+# === Time-Partitioned manga_listings ===
+# manga_listings is range-partitioned by date_sold month
+# (manga_listings_pYYYYMM). Price and freshness queries filter on a recent
+# date_sold window, so the planner prunes to the last few partitions instead
+# of scanning every sale ever scraped. Indexes are declared on the parent and
+# exist on every partition.
+#
+#   * Partitions are created on demand, just before a batch containing a new
+#     month is inserted (process-wide cache, so normally zero extra queries).
+#   * A legacy unpartitioned table is migrated in place the first time the
+#     schema is checked; the old heap is kept as manga_listings_legacy.
+#   * Retention: partitions older than LISTINGS_RETENTION_MONTHS are detached
+#     and moved to the listings_archive schema (optionally another tablespace),
+#     or dropped with --drop.
+#
+# Partitioned unique constraints must include the partition key, so uniqueness
+# is (link, date_sold) and date_sold is NOT NULL. One eBay item sells on one
+# date, so this dedupes like the old UNIQUE(link) as long as date_sold is the
+# real sold date: listings whose sold date can't be parsed are skipped at
+# insert (listing_row), not stored under the scrape date.
+
+# --- Standard Libraries ---
+import argparse
+import datetime
+import os
+import re
+import threading
+
+# --- Database Library ---
+import psycopg2
+
+# --- Logging ---
+from scrape_logging import get_logger
+
+log = get_logger("partitions")
+
+# --- Configuration (env) ---
+# PRICE_WINDOW_MONTHS       - months of sales used for prices/freshness (default 24, 0 = all)
+# LISTINGS_RETENTION_MONTHS - partitions kept attached by the retention job (default 36)
+# LISTINGS_COLD_TABLESPACE  - tablespace for archived partitions (optional)
+ARCHIVE_SCHEMA = 'listings_archive'
+_PARTITION_NAME = re.compile(r'^manga_listings_p(\d{4})(\d{2})$')
+
+_LISTINGS_COLUMNS_DDL = """(id BIGSERIAL, title VARCHAR(500) NOT NULL, total_price NUMERIC(10, 2) NOT NULL, date_sold DATE NOT NULL, num_volumes INTEGER, price_per_volume NUMERIC(10, 2), format VARCHAR(50), parse_source VARCHAR(50), link VARCHAR(1000) NOT NULL, scraped_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'), dup_cluster VARCHAR(32), PRIMARY KEY (id, date_sold), UNIQUE (link, date_sold)) PARTITION BY RANGE (date_sold)"""
+LISTINGS_TABLE_DDL = "CREATE TABLE IF NOT EXISTS manga_listings " + _LISTINGS_COLUMNS_DDL
+
+# One-time migration of a pre-partitioning (plain heap) manga_listings. Rows
+# without a sold date are not migrated (no date stands in for one, see above);
+# they stay in manga_listings_legacy and the NOTICE reports how many.
+MIGRATE_LEGACY_DDL = """
+DO $$
+DECLARE
+    month_start DATE;
+    undated BIGINT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+               WHERE c.relname = 'manga_listings' AND n.nspname = current_schema() AND c.relkind = 'r') THEN
+        ALTER TABLE manga_listings ADD COLUMN IF NOT EXISTS dup_cluster VARCHAR(32);
+        ALTER TABLE manga_listings RENAME TO manga_listings_legacy;
+        ALTER INDEX IF EXISTS manga_listings_pkey RENAME TO manga_listings_legacy_pkey;
+        ALTER INDEX IF EXISTS manga_listings_link_key RENAME TO manga_listings_legacy_link_key;
+        ALTER INDEX IF EXISTS idx_manga_listings_dup_cluster RENAME TO idx_manga_listings_legacy_dup_cluster;
+        ALTER SEQUENCE IF EXISTS manga_listings_id_seq RENAME TO manga_listings_legacy_id_seq;
+        CREATE TABLE manga_listings """ + _LISTINGS_COLUMNS_DDL + """;
+        FOR month_start IN SELECT DISTINCT date_trunc('month', date_sold)::date FROM manga_listings_legacy WHERE date_sold IS NOT NULL LOOP
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF manga_listings FOR VALUES FROM (%L) TO (%L)',
+                           'manga_listings_p' || to_char(month_start, 'YYYYMM'), month_start, (month_start + interval '1 month')::date);
+        END LOOP;
+        INSERT INTO manga_listings (id, title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at, dup_cluster)
+            SELECT id, title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at, dup_cluster
+            FROM manga_listings_legacy WHERE date_sold IS NOT NULL ON CONFLICT DO NOTHING;
+        PERFORM setval(pg_get_serial_sequence('manga_listings', 'id'), GREATEST((SELECT MAX(id) FROM manga_listings_legacy), 1));
+        SELECT COUNT(*) INTO undated FROM manga_listings_legacy WHERE date_sold IS NULL;
+        RAISE NOTICE 'manga_listings migrated to monthly partitions; old rows kept in manga_listings_legacy, % without a sold date not migrated', undated;
+    END IF;
+END
+$$"""
+
+LISTINGS_SCHEMA_COMMANDS = (
+    MIGRATE_LEGACY_DDL,
+    LISTINGS_TABLE_DDL,
+    # scraped_at holds UTC (listing_row writes it; older tables defaulted to server-local time).
+    """ALTER TABLE manga_listings ALTER COLUMN scraped_at SET DEFAULT (now() AT TIME ZONE 'utc')""",
+    """CREATE INDEX IF NOT EXISTS idx_manga_listings_dup_cluster ON manga_listings (dup_cluster)""",
+    """CREATE INDEX IF NOT EXISTS idx_manga_listings_format_date ON manga_listings (format, date_sold)""",
+)
+
+
+# --- Partition naming ---
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def partition_name(day):
+    return f"manga_listings_p{day.year:04d}{day.month:02d}"
+
+
+def create_partition_sql(day):
+    """ DDL for the month partition holding `day` (dates are formatted, never user text). """
+    start = month_start(day)
+    return (f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF manga_listings "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_month(start).isoformat()}')")
+
+
+def price_window_start(today=None):
+    """ Earliest date_sold used for prices (date.min when the window is disabled). """
+    months = int(os.environ.get('PRICE_WINDOW_MONTHS', '24'))
+    if months <= 0:
+        return datetime.date.min
+    start = month_start(today or datetime.date.today())
+    for _ in range(months):
+        start = month_start(start - datetime.timedelta(days=1))
+    return start
+
+
+# --- On-demand partition creation ---
+_known_partitions = set()
+_known_lock = threading.Lock()
+
+
+def missing_partitions(dates):
+    """ Month starts among `dates` not yet ensured by this process. """
+    months = {month_start(day) for day in dates if day is not None}
+    with _known_lock:
+        return sorted(months - _known_partitions)
+
+
+def mark_partitions(months):
+    with _known_lock:
+        _known_partitions.update(months)
+
+
+def ensure_partitions(conn, dates):
+    """ Creates the month partitions needed for `dates` (own transaction; safe to race). """
+    months = missing_partitions(dates)
+    if not conn or not months:
+        return 0
+    created = []
+    for start in months:
+        cur = conn.cursor()
+        try:
+            cur.execute(create_partition_sql(start))
+            conn.commit()
+            created.append(start)
+        except psycopg2.DatabaseError as error:
+            # Another process created it first (or it's being created); the insert will tell.
+            conn.rollback()
+            log.warning("Could not create partition %s: %s", partition_name(start), error)
+        finally:
+            cur.close()
+    mark_partitions(created)
+    log.debug("Partitions ensured", extra={"months": [partition_name(m) for m in created]})
+    return len(created)
+
+
+# --- Retention ---
+def list_partitions(conn):
+    """ [(partition table name, month start)] attached to manga_listings, oldest first. """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'manga_listings'")
+        names = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, datetime.date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def apply_retention(conn, keep_months=None, drop=False, today=None):
+    """
+    Detaches partitions older than keep_months. Detached partitions move to the
+    archive schema (and LISTINGS_COLD_TABLESPACE if set), or are dropped.
+    Returns the names of the partitions handled.
+    """
+    keep_months = keep_months if keep_months is not None else int(os.environ.get('LISTINGS_RETENTION_MONTHS', '36'))
+    cutoff = month_start(today or datetime.date.today())
+    for _ in range(keep_months):
+        cutoff = month_start(cutoff - datetime.timedelta(days=1))
+    tablespace = os.environ.get('LISTINGS_COLD_TABLESPACE')
+    handled, handled_months = [], []
+    for name, start in list_partitions(conn):
+        if start >= cutoff:
+            break
+        cur = conn.cursor()
+        try:
+            cur.execute(f"ALTER TABLE manga_listings DETACH PARTITION {name}")
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+            else:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+                cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+                if tablespace:
+                    cur.execute(f"ALTER TABLE {ARCHIVE_SCHEMA}.{name} SET TABLESPACE {tablespace}")
+            conn.commit()
+            handled.append(name)
+            handled_months.append(start)
+            log.info("Partition %s", "dropped" if drop else "archived", extra={"partition": name})
+        except psycopg2.DatabaseError as error:
+            conn.rollback()
+            log.error("Retention failed for partition: %s", error, extra={"partition": name})
+            break
+        finally:
+            cur.close()
+    with _known_lock:
+        _known_partitions.difference_update(handled_months)
+    return handled
+
+
+# --- Command-line entry point for retention runs ---
+if __name__ == "__main__":
+    from manga_scraper_logic import create_tables, get_db_connection
+
+    parser = argparse.ArgumentParser(description="Archive or drop old manga_listings partitions.")
+    parser.add_argument("--keep-months", type=int, default=None)
+    parser.add_argument("--drop", action="store_true", help="Drop old partitions instead of archiving them")
+    args = parser.parse_args()
+    conn = get_db_connection()
+    if not conn:
+        raise SystemExit(1)
+    try:
+        create_tables(conn)
+        handled = apply_retention(conn, keep_months=args.keep_months, drop=args.drop)
+        log.info("Retention finished", extra={"partitions": handled})
+    finally:
+        conn.close()
@@ -2,14 +2,14 @@
 # Renamed from manga_price_scraper.py to be used as a module
 
 # --- Standard Libraries ---
+import contextlib
 import csv
 import datetime
+import functools
+import hashlib
+import inspect
 import os
-import time
 import re
-import random
-import traceback
-from pprint import pprint
 from urllib.parse import urlparse
 
 # --- Environment Variable Loading ---
@@ -21,12 +21,31 @@ import requests
 
 # --- Database Library ---
 import psycopg2
+import psycopg2.extras
 from psycopg2 import sql # For safe SQL query construction
 
+# --- Logging ---
+from scrape_logging import get_logger, get_correlation_id, correlation_scope
+from request_profiling import stage
+from scrape_pipeline import END_OF_PAGES, ScrapePipeline
+from fetch_control import get_controller, CircuitOpenError
+from scrape_budget import DESCRIPTION, PAGE, DeadlineExceeded, budget_scope, by_price_impact
+from price_sketch import SKETCH_SCHEMA_COMMANDS, SKETCH_FORMATS, update_series_sketch
+from listing_dedupe import get_dedupe_index
+from parse_memo import get_parse_memo
+from listing_partitions import LISTINGS_SCHEMA_COMMANDS, ensure_partitions, price_window_start
+from series_registry import SERIES_SCHEMA_COMMANDS, assign_series, series_match
+from series_suggest import get_suggest_index
+from series_fanout import SeriesRouter, listing_series
+import storage # module import: storage imports this module back
+
 # --- Load Environment Variables ---
 # Load variables from .env file. Ensure .env is in the root where the API server runs.
 load_dotenv()
 
+log = get_logger("scraper")
+db_log = get_logger("db")
+
 # --- Helper Functions (is_mixed_lot, parse_volume_info, get_volumes_from_description) ---
 def is_mixed_lot(title, target_manga_title):
     """Checks if a title likely represents a lot of mixed manga series."""
@@ -179,111 +198,153 @@ def parse_volume_info(title, manga_title):
 
     return count, format_type, False
 
+# --- Memoized Title Classification ---
+# Bump when is_mixed_lot / parse_volume_info change meaning; memoized results
+# are also keyed on the functions' source, so an edit without a bump still
+# invalidates them.
+PARSER_VERSION = "14.5"
+
+@functools.lru_cache(maxsize=None)
+def parser_fingerprint():
+    """ PARSER_VERSION plus a hash of the parsing functions' source. """
+    try:
+        source = inspect.getsource(is_mixed_lot) + inspect.getsource(parse_volume_info)
+    except (OSError, TypeError):
+        return PARSER_VERSION
+    return f"{PARSER_VERSION}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:10]}"
+
+def _classify_title(title, manga_title):
+    if is_mixed_lot(title, manga_title):
+        return True, 0, 'Exclude', False
+    num_volumes, format_type, is_ambiguous = parse_volume_info(title, manga_title)
+    return False, num_volumes, format_type, is_ambiguous
+
+def classify_title(title, manga_title):
+    """ Memoized (is mixed lot, volume count, format, ambiguous) for a listing title. """
+    return get_parse_memo(parser_fingerprint()).lookup(title, manga_title, _classify_title)
+
+# --- Description Parsing Helpers (shared by the sync and async fetchers) ---
+def description_iframe_url(soup):
+    """ Returns the absolute URL of the item description iframe, or None. """
+    iframe = soup.select_one('iframe#desc_ifr')
+    if not (iframe and iframe.get('src')):
+        return None
+    iframe_url = iframe['src']
+    if iframe_url.startswith("//"):
+        iframe_url = "https:" + iframe_url
+    elif iframe_url.startswith("/"):
+        iframe_url = "https://www.ebay.com" + iframe_url
+    return iframe_url
+
+def inline_description_text(soup):
+    """ Description text embedded directly in the listing page (no iframe). """
+    desc_container = soup.select_one('#desc_div') or soup.select_one('#descriptionContent') or soup.select_one('div[itemprop="description"]')
+    return desc_container.get_text(" ", strip=True) if desc_container else ""
+
+def iframe_description_text(iframe_html):
+    """ Description text from the iframe document. """
+    iframe_soup = BeautifulSoup(iframe_html, 'html.parser')
+    desc_container = iframe_soup.select_one('#ds_div') or iframe_soup.body
+    return desc_container.get_text(" ", strip=True) if desc_container else ""
+
+def volumes_from_description_text(desc_text):
+    """ Counts volumes mentioned in description text. Returns (count, format). """
+    volumes_found_in_desc = set()
+
+    # Find volume patterns in description text
+    volume_patterns = re.findall(
+        r'(?:vol(?:ume)?s?\.?\s*|#\s*)(\d+\s*-\s*\d+)|'
+        r'(?:vol(?:ume)?s?\.?\s*|#\s*)(\d+)|'
+        r'(?<!\w)(\d+\s*-\s*\d+)(?!\w)|'
+        r'(?<![\w\d-])(\d{1,3})(?![\w\d-])(?!\s*-\s*\d)(?!\s*(?:in|st|nd|rd|th|:|/|\.\d)\b)',
+        desc_text, re.IGNORECASE
+    )
+
+    for p_r, p_s, s_r, s_s in volume_patterns:
+        if p_r:
+            try:
+                s, e = map(int, re.split(r'\s*-\s*', p_r))
+                [volumes_found_in_desc.add(i) for i in range(s, e + 1) if 0 < s <= e < 200]
+            except ValueError:
+                continue
+        elif p_s:
+            try:
+                v = int(p_s)
+                if 0 < v < 200:
+                    volumes_found_in_desc.add(v)
+            except ValueError:
+                continue
+        elif s_r:
+            try:
+                s, e = map(int, re.split(r'\s*-\s*', s_r))
+                [volumes_found_in_desc.add(i) for i in range(s, e + 1) if 0 < s <= e < 200]
+            except ValueError:
+                continue
+        elif s_s:
+            try:
+                v = int(s_s)
+                if 0 < v < 200:
+                    volumes_found_in_desc.add(v)
+            except ValueError:
+                continue
+
+    count = len(volumes_found_in_desc)
+    if count > 1:
+        return count, 'Lot'
+    elif count == 1:
+        return count, 'Single'
+    else:
+        return 0, 'Unknown'
+
 # --- Function to get volumes from description (Fixed) ---
 def get_volumes_from_description(listing_url, session_headers):
     """ Fetches description page using provided session headers (requests). """
-    print(f"      Attempting to fetch description from: {listing_url}")
-    volumes_found_in_desc = set()
+    log.debug("Fetching description", extra={"url": listing_url, "sampled": True})
     desc_text = ""
     
+    # Pacing, retries and circuit breaking are shared across all description fetches.
+    ebay = get_controller("ebay")
     try:
-        time.sleep(random.uniform(4.5, 7.5))
-        response = requests.get(listing_url, headers=session_headers, timeout=30)
+        response = ebay.request("GET", listing_url, headers=session_headers, timeout=30)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
-        iframe = soup.select_one('iframe#desc_ifr')
+        iframe_url = description_iframe_url(soup)
         
-        if iframe and iframe.get('src'):
-            iframe_url = iframe['src']
-            if iframe_url.startswith("//"):
-                iframe_url = "https:" + iframe_url
-            elif iframe_url.startswith("/"):
-                iframe_url = "https://www.ebay.com" + iframe_url
-                
-            print(f"        Desc in iframe: {iframe_url}")
-            time.sleep(random.uniform(2.5, 4.5))
+        if iframe_url:
+            log.debug("Description in iframe", extra={"url": iframe_url, "sampled": True})
             
             try:
-                iframe_response = requests.get(iframe_url, headers=session_headers, timeout=25)
+                iframe_response = ebay.request("GET", iframe_url, headers=session_headers, timeout=25)
                 iframe_response.raise_for_status()
-                iframe_soup = BeautifulSoup(iframe_response.text, 'html.parser')
-                desc_container = iframe_soup.select_one('#ds_div') or iframe_soup.body
-                if desc_container:
-                    desc_text = desc_container.get_text(" ", strip=True)
+                desc_text = iframe_description_text(iframe_response.text)
             except requests.exceptions.RequestException as ie:
-                print(f"        Error fetching iframe URL {iframe_url}: {ie}")
-                desc_container = soup.select_one('#desc_div') or soup.select_one('#descriptionContent') or soup.select_one('div[itemprop="description"]')
-                if desc_container:
-                    desc_text = desc_container.get_text(" ", strip=True)
+                log.warning("Error fetching description iframe: %s", ie, extra={"url": iframe_url})
+                desc_text = inline_description_text(soup)
             except Exception as ie_parse:
-                print(f"        Error parsing iframe from {iframe_url}: {ie_parse}")
-                desc_container = soup.select_one('#desc_div') or soup.select_one('#descriptionContent') or soup.select_one('div[itemprop="description"]')
-                if desc_container:
-                    desc_text = desc_container.get_text(" ", strip=True)
+                log.warning("Error parsing description iframe: %s", ie_parse, extra={"url": iframe_url})
+                desc_text = inline_description_text(soup)
         else:
-            desc_container = soup.select_one('#desc_div') or soup.select_one('#descriptionContent') or soup.select_one('div[itemprop="description"]')
-            if desc_container:
-                desc_text = desc_container.get_text(" ", strip=True)
+            desc_text = inline_description_text(soup)
                 
         if not desc_text:
-            print("        WARNING: Could not extract description text.")
+            log.warning("Could not extract description text", extra={"url": listing_url})
             return 0, 'Unknown'
 
-        # Find volume patterns in description text
-        volume_patterns = re.findall(
-            r'(?:vol(?:ume)?s?\.?\s*|#\s*)(\d+\s*-\s*\d+)|'
-            r'(?:vol(?:ume)?s?\.?\s*|#\s*)(\d+)|'
-            r'(?<!\w)(\d+\s*-\s*\d+)(?!\w)|'
-            r'(?<![\w\d-])(\d{1,3})(?![\w\d-])(?!\s*-\s*\d)(?!\s*(?:in|st|nd|rd|th|:|/|\.\d)\b)',
-            desc_text, re.IGNORECASE
-        )
-
-        for p_r, p_s, s_r, s_s in volume_patterns:
-            if p_r:
-                try:
-                    s, e = map(int, re.split(r'\s*-\s*', p_r))
-                    [volumes_found_in_desc.add(i) for i in range(s, e + 1) if 0 < s <= e < 200]
-                except ValueError:
-                    continue
-            elif p_s:
-                try:
-                    v = int(p_s)
-                    if 0 < v < 200:
-                        volumes_found_in_desc.add(v)
-                except ValueError:
-                    continue
-            elif s_r:
-                try:
-                    s, e = map(int, re.split(r'\s*-\s*', s_r))
-                    [volumes_found_in_desc.add(i) for i in range(s, e + 1) if 0 < s <= e < 200]
-                except ValueError:
-                    continue
-            elif s_s:
-                try:
-                    v = int(s_s)
-                    if 0 < v < 200:
-                        volumes_found_in_desc.add(v)
-                except ValueError:
-                    continue
-
-        count = len(volumes_found_in_desc)
-        print(f"        Found {count} volumes in description.")
-        
-        if count > 1:
-            return count, 'Lot'
-        elif count == 1:
-            return count, 'Single'
-        else:
-            return 0, 'Unknown'
+        count, format_type = volumes_from_description_text(desc_text)
+        log.debug("Volumes found in description", extra={"url": listing_url, "volumes": count, "sampled": True})
+        return count, format_type
             
+    except DeadlineExceeded:
+        log.info("Time budget exhausted, description not fetched", extra={"url": listing_url})
+        return 0, 'Unknown'
     except requests.exceptions.HTTPError as e:
-        print(f"        HTTP Error fetching description URL {listing_url}: {e.response.status_code}")
+        log.warning("HTTP error fetching description", extra={"url": listing_url, "status": e.response.status_code})
         return 0, 'Exclude'
     except requests.exceptions.RequestException as e:
-        print(f"        Network Error fetching description URL {listing_url}: {e}")
+        log.warning("Network error fetching description: %s", e, extra={"url": listing_url})
         return 0, 'Unknown'
     except Exception as e:
-        print(f"        Error parsing description from {listing_url}: {e}")
+        log.warning("Error parsing description: %s", e, extra={"url": listing_url})
         return 0, 'Unknown'
 
 # --- Database Helper Functions ---
@@ -299,63 +360,86 @@ def get_db_connection():
         
         missing_vars = [var for var, val in locals().items() if var.startswith('db_') and not val]
         if missing_vars:
-            print(f"!! ERROR: Missing database environment variables: {', '.join(missing_vars)}\n   Please ensure DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD are set in your .env file.")
+            db_log.error("Missing database environment variables: %s. Please ensure DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD are set in your .env file.", ', '.join(missing_vars))
             return None
             
         conn = psycopg2.connect(dbname=db_name, user=db_user, password=db_pass, host=db_host, port=db_port)
-        print("[DB] Successfully connected to PostgreSQL using .env variables.")
+        db_log.debug("Connected to PostgreSQL using .env variables")
         return conn
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"[DB] !! Error connecting to PostgreSQL: {error}")
+        db_log.error("Error connecting to PostgreSQL: %s", error)
         return None
 
+# Schema statements, shared with the asyncpg client in async_scraper.py
+SCHEMA_COMMANDS = LISTINGS_SCHEMA_COMMANDS + SERIES_SCHEMA_COMMANDS + SKETCH_SCHEMA_COMMANDS
+
 def create_tables(conn):
     """ Creates the necessary database table if it doesn't exist. """
-    commands = ("""CREATE TABLE IF NOT EXISTS manga_listings (id SERIAL PRIMARY KEY, title VARCHAR(500) NOT NULL, total_price NUMERIC(10, 2) NOT NULL, date_sold DATE, num_volumes INTEGER, price_per_volume NUMERIC(10, 2), format VARCHAR(50), parse_source VARCHAR(50), link VARCHAR(1000) UNIQUE NOT NULL, scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",)
+    commands = SCHEMA_COMMANDS
     cur = None
     try:
         cur = conn.cursor()
         [cur.execute(command) for command in commands]
         conn.commit()
-        print("[DB] Table 'manga_listings' checked/created successfully.")
+        # Schema migrations report through NOTICEs (e.g. legacy rows left unmigrated).
+        for notice in conn.notices:
+            db_log.info("Schema notice: %s", notice.strip())
+        del conn.notices[:]
+        db_log.debug("Tables checked/created")
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"[DB] !! Error creating table: {error}")
+        db_log.error("Error creating table: %s", error)
     finally:
         if cur:
             cur.close()
 
+def utc_now():
+    """ Naive UTC now: scraped_at is a TIMESTAMP without time zone that holds UTC (see http_caching.as_utc). """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+LISTING_COLUMNS = ('title', 'total_price', 'date_sold', 'num_volumes', 'price_per_volume', 'format', 'parse_source', 'link', 'scraped_at', 'dup_cluster', 'series_id')
+
+def listing_row(item_data):
+    """
+    Converts scraped item_data into a manga_listings row tuple (LISTING_COLUMNS
+    order), or None if the sold date can't be parsed: uniqueness is
+    (link, date_sold), so a made-up date would let every re-scrape insert the
+    same listing again.
+    """
+    title = item_data.get('title')
+    total_price = item_data.get('total_price')
+    date_str = item_data.get('date')
+    num_volumes = item_data.get('num_volumes')
+    format_type = item_data.get('format')
+    link = item_data.get('link')
+    parse_source = item_data.get('parse_source')
+    scraped_at = utc_now()
+    try:
+        date_sold = datetime.datetime.strptime(date_str or '', '%b %d, %Y').date()
+    except ValueError:
+        db_log.warning("Skipping listing with unparseable sold date", extra={"date": date_str, "link": link, "sampled": True})
+        return None
+
+    price_per_volume = None
+    if total_price is not None and num_volumes is not None and num_volumes > 0:
+        price_per_volume = total_price / num_volumes
+
+    return (title, total_price, date_sold, num_volumes, price_per_volume, format_type, parse_source, link, scraped_at, item_data.get('dup_cluster'), item_data.get('series_id'))
+
 def insert_listing(conn, item_data):
     """ Inserts a single listing into the database. """
-    sql_insert = """INSERT INTO manga_listings(title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (link) DO NOTHING;"""
+    sql_insert = """INSERT INTO manga_listings(title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at, dup_cluster, series_id) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (link, date_sold) DO NOTHING;"""
     cur = None
     try:
+        row = listing_row(item_data)
+        if row is None:
+            return False
+        ensure_partitions(conn, [row[2]])
         cur = conn.cursor()
-        title = item_data.get('title')
-        total_price = item_data.get('total_price')
-        date_str = item_data.get('date')
-        num_volumes = item_data.get('num_volumes')
-        format_type = item_data.get('format')
-        link = item_data.get('link')
-        parse_source = item_data.get('parse_source')
-        scraped_at = datetime.datetime.now()
-        date_sold = None
-        
-        if date_str:
-            try:
-                date_sold = datetime.datetime.strptime(date_str, '%b %d, %Y').date()
-            except ValueError:
-                print(f"  [DB] Warning: Could not parse date string: {date_str}")
-                date_sold = None
-                
-        price_per_volume = None
-        if total_price is not None and num_volumes is not None and num_volumes > 0:
-            price_per_volume = total_price / num_volumes
-            
-        cur.execute(sql_insert, (title, total_price, date_sold, num_volumes, price_per_volume, format_type, parse_source, link, scraped_at))
+        cur.execute(sql_insert, row)
         conn.commit()
         return True
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"[DB] !! Error inserting listing: {error}\n   Failed Item Data: {item_data}")
+        db_log.error("Error inserting listing: %s", error, extra={"link": item_data.get('link')})
         if conn:
             conn.rollback()
         return False
@@ -363,249 +447,465 @@ def insert_listing(conn, item_data):
         if cur:
             cur.close()
 
+def insert_listings(conn, items):
+    """
+    Inserts a batch of listings in one round trip.
+    Returns (rows attempted successfully, [(format, price_per_volume, series_id) of newly inserted rows]).
+    """
+    if not items:
+        return 0, []
+    sql_insert = """INSERT INTO manga_listings(title, total_price, date_sold, num_volumes, price_per_volume, format, parse_source, link, scraped_at, dup_cluster, series_id) VALUES %s ON CONFLICT (link, date_sold) DO NOTHING RETURNING format, price_per_volume, series_id;"""
+    cur = None
+    try:
+        rows = [row for row in map(listing_row, items) if row is not None]
+        if not rows:
+            return 0, []
+        ensure_partitions(conn, [row[2] for row in rows])
+        cur = conn.cursor()
+        new_rows = psycopg2.extras.execute_values(cur, sql_insert, rows, page_size=len(rows), fetch=True)
+        conn.commit()
+        return len(rows), new_rows
+    except (Exception, psycopg2.DatabaseError) as error:
+        db_log.warning("Batch insert failed (%s); retrying row by row", error, extra={"rows": len(items)})
+        if conn:
+            conn.rollback()
+    finally:
+        if cur:
+            cur.close()
+    if len(items) == 1:
+        return 0, []
+    # Isolate the bad row(s) so one malformed listing doesn't lose the whole batch.
+    attempted, new_rows = 0, []
+    for item_data in items:
+        count, rows = insert_listings(conn, [item_data])
+        attempted += count
+        new_rows.extend(rows)
+    return attempted, new_rows
+
+def record_listings(conn, items, manga_title):
+    """
+    Tags a batch with its canonical series, inserts it and folds the newly
+    inserted per-volume prices into the series' price sketch.
+    """
+    series_id = assign_series(conn, items, manga_title)
+    attempted, new_rows = insert_listings(conn, items)
+    # Listings filed under a more specific series don't belong in this series' sketch.
+    prices = [price for format_type, price, row_series in new_rows if format_type in SKETCH_FORMATS and row_series == series_id]
+    if prices:
+        update_series_sketch(conn, manga_title, prices, series_id=series_id)
+    if new_rows:
+        # Only registered series are suggested; an unregistered name contributes its listing titles.
+        get_suggest_index().observe_listings(manga_title if series_id is not None else None,
+                                             [item_data['title'] for item_data in items], len(new_rows))
+    return attempted
+
+def series_filter(conn, manga_title):
+    """
+    WHERE clause + params selecting a series' priced listings: an indexed
+    series_id equality for registered series, the legacy title ILIKE otherwise.
+    The date_sold window lets the planner skip partitions outside PRICE_WINDOW_MONTHS.
+    """
+    match, params = series_match(conn, manga_title)
+    return match + """ AND format IN ('Single', 'Lot') AND price_per_volume IS NOT NULL AND date_sold >= %s""", params + [price_window_start()]
+
 def get_avg_price_from_db(conn, manga_title_like, start_volume=None, end_volume=None):
     """ Queries the DB for average price per volume for a given manga title and optional volume range. """
     if not conn:
-        print("[DB Query] No database connection.")
+        db_log.error("No database connection for price query")
         return None, 0
         
     cur = None
     try:
         cur = conn.cursor()
-        query = sql.SQL(""" SELECT AVG(price_per_volume), COUNT(*) FROM manga_listings WHERE title ILIKE %s AND format IN ('Single', 'Lot') AND price_per_volume IS NOT NULL """)
-        params = [f'%{manga_title_like}%']
+        query, params = series_filter(conn, manga_title_like)
+        query = sql.SQL(""" SELECT AVG(price_per_volume), COUNT(*) FROM manga_listings WHERE """ + query)
         
-        print(f"[DB Query] Executing query for title like: {manga_title_like}")
+        db_log.debug("Querying average price", extra={"title_like": manga_title_like})
         cur.execute(query, params)
         result = cur.fetchone()
         
         if result and result[0] is not None:
             avg_price = float(result[0])
             count = int(result[1])
-            print(f"[DB Query] Found average price ${avg_price:.2f} based on {count} listings.")
+            db_log.info("Average price $%.2f based on %d listings", avg_price, count, extra={"title_like": manga_title_like})
             return avg_price, count
         else:
-            print(f"[DB Query] No listings found matching criteria for average price calculation.")
+            db_log.info("No listings found for average price", extra={"title_like": manga_title_like})
             return None, 0
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"[DB Query] !! Error querying average price: {error}")
+        db_log.error("Error querying average price: %s", error)
         return None, 0
     finally:
         if cur:
             cur.close()
 
+def get_series_freshness(conn, manga_title_like):
+    """ Returns (newest scraped_at, row count) of the listings behind a series' average price. """
+    if not conn:
+        db_log.error("No database connection for freshness query")
+        return None, 0
 
-# --- Core Scraping Function (Modified to be callable) ---
-def run_scrape(manga_title, max_pages=3, min_price=5, fetch_descriptions=False):
-    """Runs the Oxylabs scrape and inserts data into the DB."""
-    search_query = f'"{manga_title}" manga english'.replace(" ", "+")
+    cur = None
+    try:
+        cur = conn.cursor()
+        query, params = series_filter(conn, manga_title_like)
+        cur.execute(sql.SQL(""" SELECT MAX(scraped_at), COUNT(*) FROM manga_listings WHERE """ + query), params)
+        result = cur.fetchone()
+        if result and result[0] is not None:
+            return result[0], int(result[1])
+        return None, 0
+    except (Exception, psycopg2.DatabaseError) as error:
+        db_log.error("Error querying series freshness: %s", error)
+        return None, 0
+    finally:
+        if cur:
+            cur.close()
+
+# --- Search Page Helpers (shared by the sync and async scrapers) ---
+# OXYLABS_REALTIME_ENDPOINT - realtime API URL (default below; point it at oxylabs_stub_server.py locally)
+DEFAULT_OXYLABS_REALTIME_ENDPOINT = 'https://realtime.oxylabs.io/v1/queries'
+DESCRIPTION_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+
+def oxylabs_realtime_endpoint():
+    return os.environ.get('OXYLABS_REALTIME_ENDPOINT', DEFAULT_OXYLABS_REALTIME_ENDPOINT)
+
+def build_search_url(manga_title, min_price, page_num):
+    """ eBay sold-listings search URL for one results page of a series. """
+    return build_query_url(f'"{manga_title}" manga english', min_price, page_num)
+
+def build_query_url(query, min_price, page_num):
+    """ eBay sold-listings search URL for one results page of free search terms. """
+    search_query = query.replace(" ", "+")
+    return f"https://www.ebay.com/sch/i.html?_from=R40&_nkw={search_query}&_sacat=0&rt=1&LH_Sold=1&LH_Complete=1&_udlo={min_price}&LH_PrefLoc=1&Language=English&_trksid=p2045573.m1684&_pgn={page_num}"
+
+def oxylabs_payload(page_url):
+    """ Oxylabs request body for rendering an eBay page. """
+    return {
+        'source': 'universal_ecommerce',
+        'url': page_url,
+        'geo_location': 'United States',
+        'render': 'html'
+    }
+
+def oxylabs_credentials():
+    """ (username, password) from the environment, or None if either is missing. """
     credentials = (os.environ.get('OXYLABS_USERNAME'), os.environ.get('OXYLABS_PASSWORD'))
-    
     if not credentials[0] or not credentials[1]:
-        print("!! ERROR: Oxylabs credentials not found in environment !!")
+        log.error("Oxylabs credentials not found in environment")
+        return None
+    return credentials
+
+def extract_page_content(response_data):
+    """ HTML content from an Oxylabs result payload, or None. """
+    if (response_data and 'results' in response_data and 
+        len(response_data['results']) > 0 and 'content' in response_data['results'][0]):
+        return response_data['results'][0]['content']
+    return None
+
+def parse_listing_item(item, manga_title, min_price, router=None):
+    """
+    Extracts one listing from an 's-item' element.
+    Returns an item_data dict plus an 'ambiguous' flag and the 'series' it is
+    filed under, or None if the listing is rejected. With a SeriesRouter the
+    listing is classified against the tracked series its title names.
+    """
+    title_elem = item.select_one('div.s-item__title span[role="heading"]') or item.select_one('.s-item__title span') or item.select_one('.s-item__title')
+    title = title_elem.get_text(strip=True).replace('New Listing','').strip() if title_elem else None
+    
+    price_elem = item.select_one('.s-item__price')
+    price_text = price_elem.get_text(strip=True) if price_elem else None
+    
+    date_parent = (
+        item.find("span", class_="POSITIVE", string=re.compile(r'Sold\s+[A-Za-z]{3}\s+\d{1,2},\s+\d{4}')) or 
+        item.find("div", class_="s-item__title--tag", string=re.compile(r'Sold\s+')) or 
+        item.find("span", class_="s-item__dynamic", string=re.compile(r'Sold\s+')) or 
+        item.find("span", string=re.compile(r'Sold\s+[A-Za-z]{3}\s+\d{1,2},\s+\d{4}'))
+    )
+    date_text = date_parent.get_text(strip=True) if date_parent else None
+    
+    if date_text and "Sold" in date_text:
+        match = re.search(r'([A-Za-z]{3}\s+\d{1,2},\s+\d{4})', date_text)
+        date_text = match.group(1) if match else date_text
+        
+    link_elem = item.select_one('a.s-item__link')
+    link = link_elem['href'].split("?")[0] if link_elem and link_elem.has_attr('href') else None
+    
+    if not all([title, price_text, date_text, link]) or not price_text.startswith('$'):
+        return None
+        
+    series = listing_series(router, title, manga_title)
+    if series is None:
+        return None
+    is_mixed, num_volumes, format_type, is_ambiguous = classify_title(title, series)
+    
+    if is_mixed or format_type == 'Exclude' or num_volumes == 0:
+        return None
+        
+    clean_price = None
+    price_match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+\.?\d*)', price_text.replace("$","").replace(",",""))
+    
+    if price_match:
+        try:
+            clean_price = float(price_match.group(1))
+        except ValueError:
+            return None
+    else:
+        return None
+        
+    if clean_price < min_price:
+        return None
+        
+    return {
+        "title": title,
+        "total_price": clean_price,
+        "date": date_text,
+        "num_volumes": num_volumes,
+        "format": format_type,
+        "link": link,
+        "parse_source": "Title",
+        "ambiguous": is_ambiguous,
+        "series": series
+    }
+
+def parse_search_page(page_content, manga_title, min_price, router=None):
+    """
+    Parses one search results page. Returns (number of listing elements found,
+    list of candidate item dicts, parse memo hits/misses for this page); the
+    memo counts come back with the result because pages are parsed in pool
+    workers, whose own counters the caller can't see.
+    """
+    memo = get_parse_memo(parser_fingerprint())
+    before = memo.counters()
+    soup = BeautifulSoup(page_content, "html.parser")
+    results_container = soup.select_one('ul.srp-results.srp-list.clearfix') or soup.select_one('ul#srp-results') or soup.select_one('#srp-river-results ul')
+    if not results_container:
+        log.warning("Results container not found")
+        return 0, [], memo.counters_since(before)
+
+    listings = results_container.select('li.s-item')
+    candidates = []
+    for item_index, item in enumerate(listings):
+        try:
+            candidate = parse_listing_item(item, manga_title, min_price, router)
+        except Exception as e_item:
+            log.warning("Error processing item #%d: %s", item_index + 1, e_item, extra={"sampled": True})
+            continue
+        if candidate is not None:
+            candidates.append(candidate)
+    # Pool workers exit without atexit hooks, so persist memo results per page.
+    memo.flush()
+    memo_counts = memo.counters_since(before)
+    log.debug("Parsed page", extra={"listings": len(listings), "candidates": len(candidates), "parse_memo": memo_counts})
+    return len(listings), candidates, memo_counts
+
+def apply_description_result(candidate, desc_volumes, desc_format):
+    """ Resolves an ambiguous candidate with a description lookup. Returns it, or None to drop it. """
+    if desc_volumes > 0:
+        candidate["num_volumes"] = desc_volumes
+        candidate["format"] = desc_format if desc_format != 'Unknown' else candidate["format"]
+        candidate["parse_source"] = "Description"
+        candidate["ambiguous"] = False
+        return candidate
+    return None
+
+def enrich_candidate(item_data, manga_title, fetch_descriptions, describe, dedupe=None, defer=None):
+    """
+    Final volume resolution for a parsed candidate. An ambiguous listing takes
+    its near-duplicate cluster's resolved count if one is known, otherwise it
+    needs describe(link) -> (volumes, format) (only when fetch_descriptions).
+    With `defer`, such a listing is handed to defer(item_data) for a later
+    description pass instead. Returns the candidate, or None to drop it.
+    """
+    dedupe = dedupe or get_dedupe_index()
+    if not item_data["ambiguous"]:
+        dedupe.record(manga_title, item_data)
+        return item_data
+    if dedupe.resolve_ambiguous(manga_title, item_data):
+        return item_data
+    if not fetch_descriptions:
+        return None
+    if defer is not None:
+        defer(item_data)
+        return None
+    desc_volumes, desc_format = describe(item_data["link"])
+    resolved = apply_description_result(item_data, desc_volumes, desc_format)
+    if resolved is not None:
+        dedupe.record(manga_title, resolved)
+    return resolved
+
+# --- Core Scraping Function (Modified to be callable) ---
+def run_scrape(manga_title, max_pages=3, min_price=5, fetch_descriptions=False, on_page=None, budget=None, fan_out=None, cancel=None):
+    """
+    Runs the Oxylabs scrape and inserts data into the DB. on_page(pages, rows)
+    reports progress. With a ScrapeBudget the scrape stops at its deadline with
+    what it has (budget.report() says what was skipped); that still counts as success.
+    Setting the `cancel` event (e.g. a queued job's lease was lost) stops it
+    before its next request, and it reports failure.
+    With fan_out (off unless SCRAPE_FANOUT=1) listings of other tracked series are
+    filed under those series instead of being dropped.
+    """
+    if fan_out is None:
+        fan_out = os.environ.get('SCRAPE_FANOUT', '0') == '1'
+    # Reuse the caller's correlation id (e.g. the API request) so request and scrape logs line up.
+    with correlation_scope(get_correlation_id() if get_correlation_id() != "-" else None), budget_scope(budget):
+        return _run_scrape(manga_title, max_pages, min_price, fetch_descriptions, on_page, budget, fan_out=fan_out, cancel=cancel)
+
+def run_fanout_scrape(query, max_pages=3, min_price=5, fetch_descriptions=False, on_page=None, budget=None):
+    """ One broad search (e.g. "manga english") whose listings are filed under every tracked series they name. """
+    with correlation_scope(get_correlation_id() if get_correlation_id() != "-" else None), budget_scope(budget):
+        return _run_scrape(None, max_pages, min_price, fetch_descriptions, on_page, budget, fan_out=True, query=query)
+
+
+def fetch_search_page(credentials, page_url, page_num):
+    """ Fetches one rendered search page through the Oxylabs realtime API. Returns the HTML or None. """
+    response = None
+    try:
+        with stage("oxylabs_fetch"):
+            response = get_controller("oxylabs").request("POST", oxylabs_realtime_endpoint(), auth=credentials, json=oxylabs_payload(page_url), timeout=60)
+        log.debug("Oxylabs response", extra={"page": page_num, "status": response.status_code})
+        response.raise_for_status()
+        response_data = response.json()
+        page_content = extract_page_content(response_data)
+        
+        if not page_content:
+            log.error("Oxylabs response has no HTML 'content'", extra={"page": page_num, "response": str(response_data)[:500]})
+            return None
+        return page_content
+    except CircuitOpenError as e:
+        log.error("Oxylabs circuit open, skipping page: %s", e, extra={"page": page_num})
+    except DeadlineExceeded:
+        log.info("Time budget exhausted, page not fetched", extra={"page": page_num})
+    except requests.exceptions.Timeout:
+        log.error("Oxylabs request timed out after retries", extra={"page": page_num})
+    except requests.exceptions.HTTPError as e:
+        log.error("Oxylabs HTTP error", extra={"page": page_num, "status": e.response.status_code, "details": e.response.text[:500]})
+    except requests.exceptions.RequestException as e:
+        log.error("Oxylabs network error: %s", e, extra={"page": page_num})
+    except Exception as e_resp:
+        log.error("Error processing Oxylabs response: %s", e_resp, extra={"page": page_num, "response": response.text[:200] if response is not None else None})
+    return None
+
+
+def _run_scrape(manga_title, max_pages, min_price, fetch_descriptions, on_page=None, budget=None, fan_out=False, query=None, cancel=None):
+    credentials = oxylabs_credentials()
+    if not credentials:
         return False
         
-    oxylabs_endpoint = 'https://realtime.oxylabs.io/v1/queries'
     description_session = requests.Session()
-    description_session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
-    })
+    description_session.headers.update({"User-Agent": DESCRIPTION_USER_AGENT})
     
-    print(f"[Scraper Task] Starting scrape for: {manga_title} (Max Pages: {max_pages})")
+    log.info("Starting scrape", extra={"series": manga_title, "query": query, "max_pages": max_pages, "fan_out": fan_out})
     
-    db_conn = get_db_connection()
-    if not db_conn:
-        print("[Scraper Task] !! Cannot proceed without database connection.")
+    store = storage.open_store()
+    if not store.available:
+        log.error("Cannot proceed without database connection")
         return False
         
-    create_tables(db_conn)
-    db_insert_count = 0
-    success = True
+    store.create_schema()
+    # Seed near-duplicate clusters from listings already resolved by description
+    # (other series reached through fan-out are seeded on first sight).
+    if manga_title:
+        store.warm_dedupe(manga_title)
+    router = None
+    if fan_out:
+        aliases, names = store.tracked_series()
+        router = SeriesRouter(aliases, names) if names else None
+        log.info("Fan-out routing", extra={"tracked_series": len(names)})
+        if router is None and manga_title is None:
+            log.error("No tracked series to file a broad search under")
+            store.close()
+            return False
+    filed = {}
+
+    # With a time budget, descriptions wait until the pages are in (see resolve_deferred).
+    deferred = []
+    page_prices = []
+
+    # --- Pipeline stage functions ---
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    def fetch_page(page_num):
+        if cancelled():
+            log.warning("Scrape cancelled, stopping", extra={"page": page_num})
+            return END_OF_PAGES
+        if budget is not None and not budget.can_afford(PAGE):
+            budget.skip(PAGE, max_pages - page_num + 1)
+            log.info("Time budget too short for another page, stopping", extra={"page": page_num, "remaining": round(budget.remaining(), 2)})
+            return END_OF_PAGES
+        page_url = build_query_url(query, min_price, page_num) if query else build_search_url(manga_title, min_price, page_num)
+        log.debug("Processing page", extra={"page": page_num, "url": page_url})
+        with budget.measure(PAGE) if budget is not None else contextlib.nullcontext():
+            html = fetch_search_page(credentials, page_url, page_num)
+        if html is None and budget is not None and budget.expired():
+            budget.skip(PAGE, max_pages - page_num + 1)
+            return END_OF_PAGES
+        return html
+
+    def describe(link):
+        if cancelled():
+            return 0, 'Unknown'
+        with stage("description_fetch"), budget.measure(DESCRIPTION) if budget is not None else contextlib.nullcontext():
+            return get_volumes_from_description(link, description_session.headers)
+
+    def enrich_item(item_data):
+        if item_data["series"] != manga_title:
+            store.warm_dedupe(item_data["series"])
+        return enrich_candidate(item_data, item_data["series"], fetch_descriptions, describe,
+                                defer=deferred.append if budget is not None else None)
+
+    def write_batch(items):
+        if budget is not None:
+            page_prices.extend(item_data["total_price"] / item_data["num_volumes"] for item_data in items
+                               if item_data.get("num_volumes") and item_data.get("format") in SKETCH_FORMATS)
+        by_series = {}
+        for item_data in items:
+            by_series.setdefault(item_data["series"], []).append(item_data)
+        written = 0
+        with stage("db_insert"):
+            for series, series_items in by_series.items():
+                written += store.record_listings(series_items, series)
+                filed[series] = filed.get(series, 0) + len(series_items)
+        return written
+
+    def resolve_deferred():
+        """ Spends what is left of the budget on descriptions, largest price impact first. """
+        ranked = by_price_impact(deferred, page_prices)
+        resolved = []
+        for position, item_data in enumerate(ranked):
+            if not budget.can_afford(DESCRIPTION):
+                budget.skip(DESCRIPTION, len(ranked) - position)
+                break
+            enriched = enrich_candidate(item_data, item_data["series"], fetch_descriptions, describe)
+            if enriched is not None:
+                resolved.append(enriched)
+        log.info("Deferred descriptions", extra={"deferred": len(ranked), "resolved": len(resolved), "budget": budget.report()})
+        return write_batch(resolved) if resolved else 0
+
+    pipeline = ScrapePipeline(
+        fetch_page=fetch_page,
+        # Top-level function + keyword arguments, so it can be pickled to the parse processes.
+        parse_page=functools.partial(parse_search_page, manga_title=manga_title, min_price=min_price, router=router),
+        enrich_item=enrich_item,
+        write_batch=write_batch,
+        max_pages=max_pages,
+        on_page=on_page,
+    )
     
     try:
-        for page_num in range(1, max_pages + 1):
-            print(f"\n[Scraper Task] === Processing page {page_num} ===")
-            page_url = f"https://www.ebay.com/sch/i.html?_from=R40&_nkw={search_query}&_sacat=0&rt=1&LH_Sold=1&LH_Complete=1&_udlo={min_price}&LH_PrefLoc=1&Language=English&_trksid=p2045573.m1684&_pgn={page_num}"
-            print(f"[Scraper Task] Target URL: {page_url}")
-            
-            page_content = None
-            listings = []
-            
-            try:
-                payload = {
-                    'source': 'universal_ecommerce',
-                    'url': page_url,
-                    'geo_location': 'United States',
-                    'render': 'html'
-                }
-                
-                print(f"[Oxylabs Task] Sending request for page {page_num}...")
-                response = None
-                
-                try:
-                    response = requests.post(oxylabs_endpoint, auth=credentials, json=payload, timeout=60)
-                    print(f"[Oxylabs Task] Response Status Code: {response.status_code}")
-                    response.raise_for_status()
-                    response_data = response.json()
-                    
-                    if (response_data and 'results' in response_data and 
-                        len(response_data['results']) > 0 and 'content' in response_data['results'][0]):
-                        page_content = response_data['results'][0]['content']
-                        print("[Oxylabs Task] Successfully extracted HTML content.")
-                    else:
-                        print("[Oxylabs Task] !! ERROR: Could not find HTML 'content'.")
-                        pprint(response_data)
-                        success = False
-                        break
-                except requests.exceptions.Timeout:
-                    print(f"[Oxylabs Task] !! ERROR: Timeout connecting.")
-                    success = False
-                    break
-                except requests.exceptions.HTTPError as e:
-                    print(f"[Oxylabs Task] !! HTTP Error: {e.response.status_code}")
-                    try:
-                        print("Error details:", e.response.json())
-                    except:
-                        pass
-                    success = False
-                    break
-                except requests.exceptions.RequestException as e:
-                    print(f"[Oxylabs Task] !! Network Error: {e}")
-                    success = False
-                    break
-                except Exception as e_resp:
-                    print(f"[Oxylabs Task] !! Error processing response: {e_resp}")
-                    if response:
-                        print("Response text:", response.text[:200] + "...")
-                    success = False
-                    break
-                    
-                if not page_content:
-                    print("[Scraper Task] No HTML content. Stopping page.")
-                    success = False
-                    break
-                    
-                print("[Scraper Task] Creating Soup object...")
-                soup = BeautifulSoup(page_content, "html.parser")
-                
-                results_container = soup.select_one('ul.srp-results.srp-list.clearfix') or soup.select_one('ul#srp-results') or soup.select_one('#srp-river-results ul')
-                
-                if results_container:
-                    listings = results_container.select('li.s-item')
-                    print(f"[Scraper Task] Found {len(listings)} potential listings.")
-                else:
-                    print(f"[Scraper Task] !! WARNING: Container not found page {page_num}.")
-                    listings = []
-                    
-                if not listings:
-                    print(f"[Scraper Task] No listings found page {page_num}. Stopping.")
-                    break
-                    
-                print(f"[Scraper Task] Processing {len(listings)} listings...")
-                page_insert_count = 0
-                
-                for item_index, item in enumerate(listings):
-                    try:
-                        title_elem = item.select_one('div.s-item__title span[role="heading"]') or item.select_one('.s-item__title span') or item.select_one('.s-item__title')
-                        title = title_elem.get_text(strip=True).replace('New Listing','').strip() if title_elem else None
-                        
-                        price_elem = item.select_one('.s-item__price')
-                        price_text = price_elem.get_text(strip=True) if price_elem else None
-                        
-                        date_parent = (
-                            item.find("span", class_="POSITIVE", string=re.compile(r'Sold\s+[A-Za-z]{3}\s+\d{1,2},\s+\d{4}')) or 
-                            item.find("div", class_="s-item__title--tag", string=re.compile(r'Sold\s+')) or 
-                            item.find("span", class_="s-item__dynamic", string=re.compile(r'Sold\s+')) or 
-                            item.find("span", string=re.compile(r'Sold\s+[A-Za-z]{3}\s+\d{1,2},\s+\d{4}'))
-                        )
-                        date_text = date_parent.get_text(strip=True) if date_parent else None
-                        
-                        if date_text and "Sold" in date_text:
-                            match = re.search(r'([A-Za-z]{3}\s+\d{1,2},\s+\d{4})', date_text)
-                            date_text = match.group(1) if match else date_text
-                            
-                        link_elem = item.select_one('a.s-item__link')
-                        link = link_elem['href'].split("?")[0] if link_elem and link_elem.has_attr('href') else None
-                        
-                        if not all([title, price_text, date_text, link]) or not price_text.startswith('$'):
-                            continue
-                            
-                        if is_mixed_lot(title, manga_title):
-                            continue
-                            
-                        num_volumes, format_type, is_ambiguous = parse_volume_info(title, manga_title)
-                        
-                        if format_type == 'Exclude' or num_volumes == 0:
-                            continue
-                            
-                        parse_source = "Title"
-                        
-                        if fetch_descriptions and is_ambiguous:
-                            desc_volumes, desc_format = get_volumes_from_description(link, description_session.headers)
-                            if desc_volumes > 0:
-                                num_volumes = desc_volumes
-                                format_type = desc_format if desc_format != 'Unknown' else format_type
-                                parse_source = "Description"
-                                is_ambiguous = False
-                            elif desc_format == 'Exclude':
-                                continue
-                                
-                        if is_ambiguous:
-                            continue
-                            
-                        clean_price = None
-                        price_match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+\.?\d*)', price_text.replace("$","").replace(",",""))
-                        
-                        if price_match:
-                            try:
-                                clean_price = float(price_match.group(1))
-                            except ValueError:
-                                continue
-                        else:
-                            continue
-                            
-                        if clean_price < min_price:
-                            continue
-                            
-                        item_data = {
-                            "title": title,
-                            "total_price": clean_price,
-                            "date": date_text,
-                            "num_volumes": num_volumes,
-                            "format": format_type,
-                            "link": link,
-                            "parse_source": parse_source
-                        }
-                        
-                        if db_conn:
-                            if insert_listing(db_conn, item_data):
-                                page_insert_count += 1
-                                
-                    except Exception as e_item:
-                        print(f"[Scraper Task] !! Error processing item #{item_index+1}: {e_item}")
-                        print(f"   Item Title: {title or 'N/A'}")
-                        continue
-                        
-                db_insert_count += page_insert_count
-                print(f"[Scraper Task] Finished page {page_num}. Processed {page_insert_count} valid listings.")
-                
-            except Exception as e_page_loop:
-                print(f"[Scraper Task] !! UNEXPECTED Error page {page_num}: {e_page_loop}")
-                traceback.print_exc()
-                success = False
-                break
-                
-            print(f"[Scraper Task] Delaying...")
-            time.sleep(random.uniform(3.0, 6.0))
-            
-        print(f"\n[Scraper Task] --- Scrape Finished for {manga_title} ---")
-        print(f"[DB] Total DB inserts/attempts during scrape: {db_insert_count}")
+        success = pipeline.run()
+        inserted = pipeline.rows_written
+        if deferred and not cancelled():
+            inserted += resolve_deferred()
+        success = success and not cancelled()
+        log.info("Scrape finished", extra={"series": manga_title, "query": query, "inserted": inserted, "success": success, "dedupe": get_dedupe_index().stats(),
+                                           "parse_memo": pipeline.parse_stats, "budget": budget.report() if budget is not None else None,
+                                           "filed": filed if fan_out else None})
         return success
         
     finally:
-        if db_conn is not None:
-            db_conn.close()
-            print("[DB] PostgreSQL connection closed.")
+        store.close()
+        db_log.debug("Storage connection closed", extra={"backend": store.name})
 
 # --- Main Execution Block (Removed - Logic moved to API server) ---
 # if __name__ == "__main__":
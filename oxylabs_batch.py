@@ -0,0 +1,191 @@
+# === Oxylabs Batch (Push-Pull) Scraping ===
+# For large refresh sweeps: instead of one blocking 60 s realtime POST per
+# page, every page of every requested series is submitted as one asynchronous
+# Oxylabs job batch. Jobs are then polled and each finished page goes straight
+# into the fetch/parse/write pipeline, in completion order. A faulted or
+# timed-out page is logged and skipped rather than ending the sweep.
+#
+# Point OXYLABS_BATCH_BASE_URL at oxylabs_stub_server.py to run this locally.
+
+# --- Standard Libraries ---
+import argparse
+import functools
+import os
+import time
+
+# --- Web Scraping Libraries ---
+import requests
+
+# --- Scraper Logic ---
+from manga_scraper_logic import (
+    DESCRIPTION_USER_AGENT, build_search_url, enrich_candidate,
+    get_volumes_from_description, oxylabs_credentials, parse_search_page,
+)
+from storage import open_store
+from scrape_logging import get_logger, correlation_scope
+from scrape_pipeline import ScrapePipeline
+
+log = get_logger("oxylabs_batch")
+
+# --- Configuration (env) ---
+# OXYLABS_BATCH_BASE_URL      - push-pull API root (default https://data.oxylabs.io/v1)
+# OXYLABS_BATCH_POLL_SECONDS  - delay between status polls (default 5)
+# OXYLABS_BATCH_TIMEOUT       - give up on unfinished jobs after this many seconds (default 900)
+DEFAULT_BATCH_BASE_URL = 'https://data.oxylabs.io/v1'
+PENDING_STATUSES = ('pending', 'queued')
+
+
+def batch_base_url():
+    return os.environ.get('OXYLABS_BATCH_BASE_URL', DEFAULT_BATCH_BASE_URL).rstrip('/')
+
+
+def submit_batch(session, credentials, urls):
+    """ Submits one job per URL in a single request. Returns [{'id': ..., 'url': ...}, ...]. """
+    payload = {
+        'source': 'universal_ecommerce',
+        'url': list(urls),
+        'geo_location': 'United States',
+        'render': 'html'
+    }
+    response = session.post(f"{batch_base_url()}/queries/batch", auth=credentials, json=payload, timeout=60)
+    response.raise_for_status()
+    jobs = response.json().get('queries', [])
+    log.info("Submitted Oxylabs batch", extra={"jobs": len(jobs)})
+    return [{'id': job['id'], 'url': job.get('url')} for job in jobs]
+
+
+def poll_batch(session, credentials, jobs, poll_seconds=None, timeout=None):
+    """
+    Yields (job, html) as jobs finish; html is None for faulted or timed-out jobs.
+    Completed jobs are yielded as soon as they are seen, so parsing starts
+    before the slowest page is ready.
+    """
+    poll_seconds = poll_seconds if poll_seconds is not None else float(os.environ.get('OXYLABS_BATCH_POLL_SECONDS', '5'))
+    timeout = timeout if timeout is not None else float(os.environ.get('OXYLABS_BATCH_TIMEOUT', '900'))
+    deadline = time.monotonic() + timeout
+    pending = {job['id']: job for job in jobs}
+
+    while pending:
+        for job_id in list(pending):
+            job = pending[job_id]
+            try:
+                status_response = session.get(f"{batch_base_url()}/queries/{job_id}", auth=credentials, timeout=30)
+                status_response.raise_for_status()
+                status = status_response.json().get('status')
+            except requests.exceptions.RequestException as e:
+                # Transient poll failures are retried on the next round.
+                log.warning("Error polling Oxylabs job: %s", e, extra={"job": job_id})
+                continue
+
+            if status in PENDING_STATUSES:
+                continue
+            del pending[job_id]
+            if status != 'done':
+                log.error("Oxylabs job did not complete", extra={"job": job_id, "status": status, "url": job['url']})
+                yield job, None
+                continue
+            try:
+                results_response = session.get(f"{batch_base_url()}/queries/{job_id}/results", auth=credentials, timeout=60)
+                results_response.raise_for_status()
+                results = results_response.json().get('results') or []
+                yield job, (results[0].get('content') if results else None)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                log.error("Error fetching Oxylabs job results: %s", e, extra={"job": job_id})
+                yield job, None
+
+        if pending:
+            if time.monotonic() >= deadline:
+                for job in pending.values():
+                    log.error("Oxylabs job timed out", extra={"job": job['id'], "url": job['url']})
+                    yield job, None
+                return
+            time.sleep(poll_seconds)
+
+
+def parse_series_page(payload, min_price):
+    """ parse_search_page for a (manga_title, html) payload; top-level so it pickles to the parse pool. """
+    manga_title, page_content = payload
+    listings_found, candidates, memo_counts = parse_search_page(page_content, manga_title, min_price)
+    for candidate in candidates:
+        candidate["series"] = manga_title
+    return listings_found, candidates, memo_counts
+
+
+def run_batch_scrape(manga_titles, max_pages=3, min_price=5, fetch_descriptions=False):
+    """
+    Scrapes pages 1..max_pages of every title in one Oxylabs batch and inserts
+    the listings into the DB. Returns True if every page was fetched.
+    """
+    with correlation_scope():
+        credentials = oxylabs_credentials()
+        if not credentials:
+            return False
+
+        store = open_store()
+        if not store.available:
+            log.error("Cannot proceed without database connection")
+            return False
+        store.create_schema()
+        for manga_title in manga_titles:
+            store.warm_dedupe(manga_title)
+
+        session = requests.Session()
+        description_session = requests.Session()
+        description_session.headers.update({"User-Agent": DESCRIPTION_USER_AGENT})
+
+        # url -> (series, page) so finished jobs can be routed back to their series
+        page_keys = {}
+        for manga_title in manga_titles:
+            for page_num in range(1, max_pages + 1):
+                page_keys[build_search_url(manga_title, min_price, page_num)] = (manga_title, page_num)
+
+        try:
+            try:
+                jobs = submit_batch(session, credentials, page_keys)
+            except requests.exceptions.RequestException as e:
+                log.error("Oxylabs batch submission failed: %s", e)
+                return False
+
+            def page_source():
+                for job, html in poll_batch(session, credentials, jobs):
+                    key = page_keys.get(job['url'], (None, job['id']))
+                    yield key, ((key[0], html) if html else None)
+
+            def describe(link):
+                return get_volumes_from_description(link, description_session.headers)
+
+            def enrich_item(item_data):
+                return enrich_candidate(item_data, item_data["series"], fetch_descriptions, describe)
+
+            def write_batch(items):
+                by_series = {}
+                for item_data in items:
+                    by_series.setdefault(item_data["series"], []).append(item_data)
+                return sum(store.record_listings(series_items, manga_title) for manga_title, series_items in by_series.items())
+
+            pipeline = ScrapePipeline(
+                fetch_page=None,
+                parse_page=functools.partial(parse_series_page, min_price=min_price),
+                enrich_item=enrich_item,
+                write_batch=write_batch,
+                max_pages=max_pages,
+                page_source=page_source(),
+            )
+            success = pipeline.run()
+            log.info("Batch scrape finished", extra={"series": len(manga_titles), "pages": len(page_keys), "inserted": pipeline.rows_written, "success": success,
+                                                 "parse_memo": pipeline.parse_stats})
+            return success
+        finally:
+            store.close()
+
+
+# --- Command-line entry point for refresh sweeps ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh many series through one Oxylabs job batch.")
+    parser.add_argument("titles", nargs="+", help="Series titles to scrape")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--min-price", type=float, default=5)
+    parser.add_argument("--descriptions", action="store_true", help="Fetch descriptions for ambiguous listings")
+    args = parser.parse_args()
+    ok = run_batch_scrape(args.titles, max_pages=args.pages, min_price=args.min_price, fetch_descriptions=args.descriptions)
+    raise SystemExit(0 if ok else 1)
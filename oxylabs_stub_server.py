@@ -0,0 +1,108 @@
+# === Local Oxylabs Stub Server ===
+# Minimal stand-in for the Oxylabs realtime and push-pull (batch) APIs, for
+# exercising run_scrape / run_batch_scrape without credentials or network.
+# Every job "renders" the same HTML file; jobs finish after --delay seconds,
+# and URLs containing --fault-marker are reported as faulted.
+#
+#   python oxylabs_stub_server.py --html page.html --port 8765
+#   OXYLABS_BATCH_BASE_URL=http://localhost:8765/v1 python oxylabs_batch.py Naruto
+#   OXYLABS_REALTIME_ENDPOINT=http://localhost:8765/v1/queries python api_server.py
+#
+# tests/test_oxylabs_batch.py runs batch mode against it (port 0 picks a free port).
+
+# --- Standard Libraries ---
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, html, delay, fault_marker):
+        self.html = html
+        self.delay = delay
+        self.fault_marker = fault_marker
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def create_job(self, url):
+        with self.lock:
+            job_id = str(next(self.ids))
+            self.jobs[job_id] = {"id": job_id, "url": url, "created": time.monotonic()}
+        return self.jobs[job_id]
+
+    def status(self, job):
+        if time.monotonic() - job["created"] < self.delay:
+            return "pending"
+        if self.fault_marker and self.fault_marker in job["url"]:
+            return "faulted"
+        return "done"
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _json_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            body = self._json_body()
+            if self.path.rstrip("/") == "/v1/queries/batch":
+                jobs = [state.create_job(url) for url in body.get("url", [])]
+                return self._send(200, {"queries": [{"id": j["id"], "url": j["url"]} for j in jobs]})
+            if self.path.rstrip("/") == "/v1/queries":
+                # Realtime endpoint: answer immediately.
+                return self._send(200, {"results": [{"content": state.html, "status_code": 200}]})
+            self._send(404, {"message": "not found"})
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) >= 3 and parts[:2] == ["v1", "queries"] and parts[2] in state.jobs:
+                job = state.jobs[parts[2]]
+                status = state.status(job)
+                if len(parts) == 4 and parts[3] == "results":
+                    if status != "done":
+                        return self._send(404, {"message": "results not ready"})
+                    return self._send(200, {"results": [{"content": state.html, "status_code": 200}]})
+                return self._send(200, {"id": job["id"], "url": job["url"], "status": status})
+            self._send(404, {"message": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(html, port=8765, delay=1.0, fault_marker=None):
+    """ Starts the stub in a background thread; returns the server (call .shutdown() to stop). """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(StubState(html, delay, fault_marker)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Oxylabs API stub.")
+    parser.add_argument("--html", required=True, help="HTML file returned as every page's content")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=1.0, help="Seconds before a batch job is done")
+    parser.add_argument("--fault-marker", help="Jobs whose URL contains this string are faulted")
+    args = parser.parse_args()
+    with open(args.html, encoding="utf-8") as f:
+        server = serve(f.read(), args.port, args.delay, args.fault_marker)
+    print(f"[Oxylabs Stub] Listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
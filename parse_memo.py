@@ -0,0 +1,174 @@
+# === Versioned Parse Memo ===
+# Refreshes see the same listing titles again and again, and is_mixed_lot +
+# parse_volume_info re-derive the same answer every time. Results are
+# memoized per (normalized title, series) in a bounded in-process LRU, with an
+# optional SQLite file shared by every process on the host (the parse pool
+# workers included) so results survive restarts.
+#
+# Every entry is stamped with the parser version. The scraper passes a
+# fingerprint of PARSER_VERSION plus the parsing functions' source, so editing
+# the parser invalidates old results even if nobody remembers to bump the
+# version.
+
+# --- Standard Libraries ---
+import atexit
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# --- Logging ---
+from scrape_logging import get_logger
+
+log = get_logger("parse_memo")
+
+# --- Configuration (env) ---
+# PARSE_MEMO_SIZE - LRU entries per process (default 50000, 0 disables the memo)
+# PARSE_MEMO_PATH - SQLite file for the persistent memo (unset: in-memory only)
+FLUSH_EVERY = 200
+
+
+def memo_key(title, manga_title):
+    """ Parsing is case-insensitive and whitespace-tolerant, so equal keys parse identically. """
+    return ' '.join(title.lower().split()), manga_title.lower()
+
+
+class ParseMemo:
+    """LRU of key -> (mixed, count, format, ambiguous), optionally backed by SQLite."""
+
+    def __init__(self, version, max_entries=None, path=None):
+        self.version = version
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get('PARSE_MEMO_SIZE', '50000'))
+        self.path = path if path is not None else os.environ.get('PARSE_MEMO_PATH')
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = []
+        self._db = None
+        self._db_pid = None
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    # --- Persistent store ---
+    def _store(self):
+        if not self.path:
+            return None
+        # Connections are per process: pool workers must not reuse a forked parent's handle.
+        if self._db is None or self._db_pid != os.getpid():
+            try:
+                db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute("CREATE TABLE IF NOT EXISTS parse_memo (version TEXT NOT NULL, series TEXT NOT NULL, title TEXT NOT NULL, mixed INTEGER NOT NULL, count INTEGER NOT NULL, format TEXT NOT NULL, ambiguous INTEGER NOT NULL, PRIMARY KEY (series, title, version))")
+                # Results from any other parser version are stale.
+                db.execute("DELETE FROM parse_memo WHERE version != ?", (self.version,))
+                db.commit()
+            except sqlite3.Error as error:
+                log.error("Parse memo store unavailable, continuing in-memory: %s", error, extra={"path": self.path})
+                self.path = None
+                return None
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _store_get(self, key):
+        db = self._store()
+        if db is None:
+            return None
+        try:
+            row = db.execute("SELECT mixed, count, format, ambiguous FROM parse_memo WHERE series = ? AND title = ? AND version = ?",
+                             (key[1], key[0], self.version)).fetchone()
+        except sqlite3.Error as error:
+            log.warning("Parse memo read failed: %s", error, extra={"sampled": True})
+            return None
+        return (bool(row[0]), row[1], row[2], bool(row[3])) if row else None
+
+    def flush(self):
+        """ Writes pending results to the persistent store. """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        db = self._store() if pending else None
+        if db is None:
+            return 0
+        try:
+            db.executemany("INSERT OR REPLACE INTO parse_memo (version, series, title, mixed, count, format, ambiguous) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(self.version, key[1], key[0], int(v[0]), v[1], v[2], int(v[3])) for key, v in pending])
+            db.commit()
+        except sqlite3.Error as error:
+            log.warning("Parse memo write failed: %s", error, extra={"rows": len(pending)})
+            return 0
+        return len(pending)
+
+    # --- Lookup ---
+    def lookup(self, title, manga_title, compute):
+        """ Memoized compute(title, manga_title). """
+        if not self.max_entries:
+            return compute(title, manga_title)
+        key = memo_key(title, manga_title)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._store_get(key)
+        if value is not None:
+            with self._lock:
+                self.store_hits += 1
+        else:
+            value = compute(title, manga_title)
+            with self._lock:
+                self.misses += 1
+                if self.path:
+                    self._pending.append((key, value))
+            if len(self._pending) >= FLUSH_EVERY:
+                self.flush()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def counters(self):
+        """ (hits, store hits, misses) so far in this process. """
+        with self._lock:
+            return self.hits, self.store_hits, self.misses
+
+    def counters_since(self, before):
+        """ {'hits', 'storeHits', 'misses'} since an earlier counters() snapshot (per parsed page). """
+        hits, store_hits, misses = (now - then for now, then in zip(self.counters(), before))
+        return {"hits": hits, "storeHits": store_hits, "misses": misses}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "storeHits": self.store_hits,
+                "misses": self.misses,
+                "hitRatio": round((self.hits + self.store_hits) / lookups, 4) if lookups else None,
+            }
+
+
+def merge_counts(total, delta):
+    """ Adds a counters_since() delta into a running total (in place) and refreshes its hit ratio. """
+    for key in ("hits", "storeHits", "misses"):
+        total[key] = total.get(key, 0) + delta.get(key, 0)
+    lookups = total["hits"] + total["storeHits"] + total["misses"]
+    total["hitRatio"] = round((total["hits"] + total["storeHits"]) / lookups, 4) if lookups else None
+    return total
+
+
+_memos = {}
+_memos_lock = threading.Lock()
+
+
+def get_parse_memo(version):
+    """ Process-wide memo for a parser version. """
+    with _memos_lock:
+        memo = _memos.get(version)
+        if memo is None:
+            memo = _memos[version] = ParseMemo(version)
+            atexit.register(memo.flush)
+        return memo
@@ -0,0 +1,341 @@
+# === Columnar Price History Store ===
+# manga_price_data/ gets a full CSV snapshot pair (Omnibus + SinglesLots) per
+# series per run, so most rows are repeats of earlier snapshots and every load
+# re-parses text prices and "Sold  Apr 7, 2025" strings. This module folds the
+# snapshots into one compact, memory-mapped file:
+#
+#   * one listing per eBay item id (the newest snapshot's row wins),
+#   * fixed-width little-endian columns: dates as days since 1970-01-01,
+#     prices in cents, titles / formats / parse sources / series as indexes
+#     into per-file dictionaries,
+#   * rows sorted by (series, date sold), so a series is a contiguous row
+#     range and a date window inside it is found by bisection.
+#
+# Readers map the file and scan the columns in place (memoryview casts, no
+# parsing). Building merges into an existing file, so new snapshots can be
+# folded in after each run:
+#
+#   python price_history.py build            # manga_price_data/*.csv -> price_history.bin
+#   python price_history.py stats --series Naruto
+#
+# File layout: HEADER, then each column of COLUMNS in order (padded to 8
+# bytes), then the dictionaries as a UTF-8 JSON object.
+
+# --- Standard Libraries ---
+import argparse
+import array
+import bisect
+import csv
+import datetime
+import functools
+import glob
+import json
+import mmap
+import os
+import re
+import statistics
+import struct
+import sys
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manga_price_data')
+DEFAULT_PATH = os.path.join(CORPUS_DIR, 'price_history.bin')
+
+MAGIC = b'MGHIST01'
+VERSION = 1
+# magic, version, column count, row count, dictionary offset, dictionary length
+HEADER = struct.Struct('<8sHHQQQ')
+# (name, array typecode, dictionary); the order is the on-disk order
+COLUMNS = (
+    ('item_id', 'Q', None),       # eBay item id (/itm/<id>)
+    ('sold', 'i', None),          # date sold, days since 1970-01-01
+    ('price', 'I', None),         # total price, cents
+    ('volumes', 'h', None),       # volume count, -1 if unknown
+    ('title', 'I', 'titles'),
+    ('format', 'B', 'formats'),
+    ('source', 'B', 'sources'),   # parse source
+    ('series', 'H', 'series'),
+    ('scraped', 'I', None),       # snapshot the row was last seen in, epoch seconds (UTC)
+)
+DICTIONARIES = ('titles', 'formats', 'sources', 'series')
+SERIES_FORMATS = ('Single', 'Lot')  # formats used for per-volume prices, as in avg_price
+UNKNOWN_VOLUMES = -1
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+_FILE_NAME = re.compile(r'^(?P<series>.+?)_(?:Omnibus|SinglesLots)_(?P<date>\d{4}-\d{2}-\d{2})(?:_(?P<time>\d{6}))?\.csv$')
+_ITEM_ID = re.compile(r'/itm/(?:[^/?#]+/)?(\d+)')
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _column_offsets(rows):
+    """ {column: byte offset} and the offset where the dictionaries start. """
+    offsets, offset = {}, _align(HEADER.size)
+    for name, typecode, _ in COLUMNS:
+        offsets[name] = offset
+        offset = _align(offset + rows * array.array(typecode).itemsize)
+    return offsets, offset
+
+
+# --- Parsing the CSV snapshots ---
+def item_id(link):
+    """ Numeric eBay item id from a listing link, or None. """
+    match = _ITEM_ID.search(link or '')
+    return int(match.group(1)) if match else None
+
+
+@functools.lru_cache(maxsize=4096)
+def sold_day(date_sold):
+    """ "Sold  Apr 7, 2025" (or "Apr 7, 2025") -> days since 1970-01-01, or None. """
+    try:
+        sold = datetime.datetime.strptime(re.sub(r'^Sold\s+', '', date_sold).strip(), '%b %d, %Y').date()
+    except ValueError:
+        return None
+    return sold.toordinal() - _EPOCH
+
+
+def day_to_date(day):
+    return datetime.date.fromordinal(day + _EPOCH)
+
+
+def snapshot_info(path):
+    """ (series, snapshot time as epoch seconds) from an export's file name, or None. """
+    match = _FILE_NAME.match(os.path.basename(path))
+    if not match:
+        return None
+    taken = datetime.datetime.strptime(match.group('date') + (match.group('time') or '000000'), '%Y-%m-%d%H%M%S')
+    return match.group('series').replace('_', ' '), int(taken.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def read_snapshot(path, series, scraped):
+    """
+    Rows of one CSV export as (item_id, sold, cents, volumes, title, format,
+    source, series, scraped) tuples, plus the number of rows skipped (no item
+    id, date or price). Reads both export layouts: omnibus files carry
+    "Volumes Contained (est.)", singles/lots files "Num Volumes" and "Parse Source".
+    """
+    records, skipped = [], 0
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            listing_id, day = item_id(row.get('Link')), sold_day(row.get('Date Sold') or '')
+            try:
+                cents = round(float(row['Total Price']) * 100)
+            except (KeyError, TypeError, ValueError):
+                cents = None
+            if listing_id is None or day is None or cents is None:
+                skipped += 1
+                continue
+            volumes = row.get('Num Volumes') or row.get('Volumes Contained (est.)') or ''
+            records.append((listing_id, day, cents, int(volumes) if volumes.isdigit() else UNKNOWN_VOLUMES,
+                            row.get('Title') or '', row.get('Format') or '', row.get('Parse Source') or 'Title', series, scraped))
+    return records, skipped
+
+
+# --- Writing ---
+def write_history(path, records):
+    """
+    Writes (item_id, sold, cents, volumes, title, format, source, series,
+    scraped) records as a history file, replacing `path` atomically. Records
+    must already be unique per item id. Returns the file size in bytes.
+    """
+    records = sorted(records, key=lambda record: (record[7], record[1], record[0]))
+    lookups = {name: {} for name in DICTIONARIES}
+    columns = {name: array.array(typecode) for name, typecode, _ in COLUMNS}
+    for record in records:
+        for (name, _, dictionary), value in zip(COLUMNS, record):
+            if dictionary is not None:
+                value = lookups[dictionary].setdefault(value, len(lookups[dictionary]))
+            # OverflowError if a dictionary outgrows its column's index width
+            columns[name].append(value)
+    dictionaries = json.dumps({name: list(lookups[name]) for name in DICTIONARIES}, ensure_ascii=False).encode('utf-8')
+
+    offsets, dictionary_offset = _column_offsets(len(records))
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, VERSION, len(COLUMNS), len(records), dictionary_offset, len(dictionaries)))
+        for name, _, _ in COLUMNS:
+            handle.write(b'\0' * (offsets[name] - handle.tell()))
+            if not _LITTLE_ENDIAN:
+                columns[name].byteswap()
+            columns[name].tofile(handle)
+        handle.write(b'\0' * (dictionary_offset - handle.tell()))
+        handle.write(dictionaries)
+        size = handle.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+def build_history(csv_paths, path=DEFAULT_PATH):
+    """
+    Folds CSV exports into the history file at `path`, merging with what it
+    already holds. Per item id the row from the newest snapshot wins. Returns
+    counts for the build.
+    """
+    latest = {}
+    if os.path.exists(path):
+        with PriceHistory(path) as history:
+            for record in history.records():
+                latest[record[0]] = record
+    stats = {"files": 0, "rows_read": 0, "rows_skipped": 0, "csv_bytes": 0, "previous_rows": len(latest)}
+    for csv_path in sorted(csv_paths):
+        info = snapshot_info(csv_path)
+        if info is None:
+            continue
+        records, skipped = read_snapshot(csv_path, *info)
+        stats["files"] += 1
+        stats["rows_read"] += len(records)
+        stats["rows_skipped"] += skipped
+        stats["csv_bytes"] += os.path.getsize(csv_path)
+        for record in records:
+            current = latest.get(record[0])
+            if current is None or record[8] >= current[8]:
+                latest[record[0]] = record
+    stats["rows"] = len(latest)
+    stats["bytes"] = write_history(path, latest.values())
+    return stats
+
+
+# --- Reading (memory-mapped) ---
+class PriceHistory:
+    """Read-only, memory-mapped view of a history file. Columns are memoryviews over the mapping."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file can't be mapped
+            self._file.close()
+            raise ValueError(f"{path} is not a price history file")
+        magic, version, column_count, rows, dictionary_offset, dictionary_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or column_count != len(COLUMNS):
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} price history file")
+        self.rows = rows
+        offsets, _ = _column_offsets(rows)
+        self._views = []
+        self.columns = {}
+        for name, typecode, _ in COLUMNS:
+            raw = memoryview(self._map)[offsets[name]:offsets[name] + rows * array.array(typecode).itemsize]
+            self._views.append(raw)
+            if _LITTLE_ENDIAN:
+                column = raw.cast(typecode)
+                self._views.append(column)
+            else:
+                column = array.array(typecode, raw.tobytes())
+                column.byteswap()
+            self.columns[name] = column
+        dictionaries = json.loads(self._map[dictionary_offset:dictionary_offset + dictionary_length].decode('utf-8'))
+        self.titles, self.formats, self.sources, self.series = (dictionaries[name] for name in DICTIONARIES)
+        # Rows are sorted by series, so each series is one contiguous range.
+        series_column = self.columns['series']
+        self._ranges = {name: (bisect.bisect_left(series_column, index), bisect.bisect_right(series_column, index))
+                        for index, name in enumerate(self.series)}
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views over the mapping must be released before it can be closed.
+        self.columns = {}
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def row_range(self, series=None, since=None, until=None):
+        """
+        range of row numbers for a series (case-insensitive; all rows when
+        None). For a series, since/until limit it to date sold in [since, until).
+        """
+        if series is None:
+            start, end = 0, self.rows
+        else:
+            key = series.casefold()
+            start, end = next((bounds for name, bounds in self._ranges.items() if name.casefold() == key), (0, 0))
+        if series is not None and (since is not None or until is not None):
+            sold = self.columns['sold']
+            if since is not None:
+                start = bisect.bisect_left(sold, since.toordinal() - _EPOCH, start, end)
+            if until is not None:
+                end = bisect.bisect_left(sold, until.toordinal() - _EPOCH, start, end)
+        return range(start, end)
+
+    def records(self, rows=None):
+        """ Rows as (item_id, sold, cents, volumes, title, format, source, series, scraped) tuples. """
+        columns = [self.columns[name] for name, _, _ in COLUMNS]
+        titles, formats, sources, series = self.titles, self.formats, self.sources, self.series
+        for row in rows if rows is not None else range(self.rows):
+            listing_id, day, cents, volumes, title, format_index, source, series_index, scraped = (column[row] for column in columns)
+            yield listing_id, day, cents, volumes, titles[title], formats[format_index], sources[source], series[series_index], scraped
+
+    def items(self, series=None, since=None, until=None):
+        """ Rows in the scraper's item_data shape (e.g. to load into a store with insert_listings). """
+        for listing_id, day, cents, volumes, title, format_type, source, _, _ in self.records(self.row_range(series, since, until)):
+            sold = day_to_date(day)
+            yield {
+                'title': title,
+                'total_price': cents / 100,
+                'date': f"{sold:%b} {sold.day}, {sold.year}",
+                'num_volumes': volumes if volumes != UNKNOWN_VOLUMES else None,
+                'format': format_type,
+                'link': f"https://www.ebay.com/itm/{listing_id}",
+                'parse_source': source,
+            }
+
+    def price_per_volume(self, series, since=None, until=None, formats=SERIES_FORMATS):
+        """ Per-volume prices (dollars) of a series' rows in the given formats, scanned from the columns. """
+        wanted = {index for index, name in enumerate(self.formats) if name in formats}
+        price, volumes, format_column = self.columns['price'], self.columns['volumes'], self.columns['format']
+        return [price[row] / volumes[row] / 100 for row in self.row_range(series, since, until)
+                if format_column[row] in wanted and volumes[row] > 0]
+
+    def avg_price(self, series, since=None):
+        """ (average price per volume, count) for singles and lots, like the stores' avg_price; (None, 0) if none. """
+        prices = self.price_per_volume(series, since=since)
+        return (statistics.fmean(prices), len(prices)) if prices else (None, 0)
+
+
+# --- Command-line entry point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the columnar price history store.")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="History file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Fold CSV exports into the history file")
+    build.add_argument("csv", nargs="*", help="CSV exports (default: manga_price_data/*.csv)")
+    stats = commands.add_parser("stats", help="Summarize the history file")
+    stats.add_argument("--series", help="Price summary for one series")
+    stats.add_argument("--since", type=datetime.date.fromisoformat, help="Only sales on or after YYYY-MM-DD")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        result = build_history(args.csv or glob.glob(os.path.join(CORPUS_DIR, '*.csv')), args.path)
+        print(f"{result['files']} files, {result['rows_read']} rows read ({result['rows_skipped']} skipped), "
+              f"{result['previous_rows']} rows before -> {result['rows']} unique listings")
+        print(f"{result['csv_bytes']} CSV bytes read, history file is {result['bytes']} bytes")
+    else:
+        with PriceHistory(args.path) as history:
+            if args.series:
+                prices = history.price_per_volume(args.series, since=args.since)
+                if not prices:
+                    raise SystemExit(f"No singles or lots for {args.series!r}")
+                rows = history.row_range(args.series, since=args.since)
+                print(f"{args.series}: {len(rows)} listings, {len(prices)} priced singles/lots, "
+                      f"mean {statistics.fmean(prices):.2f}, median {statistics.median(prices):.2f} per volume")
+            else:
+                sold = history.columns['sold']
+                print(f"{len(history)} listings, {len(history.series)} series, {len(history.titles)} distinct titles")
+                for name in history.series:
+                    rows = history.row_range(name)
+                    print(f"  {name:<24} {len(rows):>6}  {day_to_date(sold[rows[0]])} .. {day_to_date(sold[rows[-1]])}")
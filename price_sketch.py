@@ -0,0 +1,282 @@
+# === Streaming Price Quantile Sketches ===
+# A mergeable t-digest of price_per_volume per series, updated on the insert
+# path and persisted in `series_price_sketches`. A price request then reads one
+# row to get the median, p10/p90 and an outlier-filtered (IQR) mean, instead
+# of aggregating every raw listing. Box sets and mispriced lots that skew the
+# plain AVG() fall outside the IQR fences.
+#
+# A registered series has one sketch, keyed by its series_id ("series:<id>"),
+# whatever alias a request or scrape uses; its rows are the series_id rows the
+# average reads. An unregistered name keeps a sketch under its normalized
+# name, over the legacy title ILIKE rows.
+
+# --- Standard Libraries ---
+import bisect
+import datetime
+import json
+import re
+
+# --- Database Library ---
+import psycopg2
+
+# --- Logging / Price Window ---
+from listing_partitions import price_window_start
+from scrape_logging import get_logger
+
+db_log = get_logger("sketch")
+
+SKETCH_SCHEMA_COMMANDS = (
+    """CREATE TABLE IF NOT EXISTS series_price_sketches (series_key VARCHAR(500) PRIMARY KEY, sketch JSONB NOT NULL, sample_count BIGINT NOT NULL DEFAULT 0, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    # PRICE_WINDOW_MONTHS start the sketch was built for; a sketch is rebuilt once the window moves on.
+    """ALTER TABLE series_price_sketches ADD COLUMN IF NOT EXISTS window_start DATE""",
+)
+
+# Only these formats feed the per-volume price (matches get_avg_price_from_db).
+SKETCH_FORMATS = ('Single', 'Lot')
+
+# (series_key, sketch, sample_count, updated_at, window_start); the async client uses it with $-placeholders.
+SKETCH_UPSERT_SQL = ("INSERT INTO series_price_sketches (series_key, sketch, sample_count, updated_at, window_start) VALUES (%s, %s, %s, %s, %s) "
+                     "ON CONFLICT (series_key) DO UPDATE SET sketch = EXCLUDED.sketch, sample_count = EXCLUDED.sample_count, "
+                     "updated_at = EXCLUDED.updated_at, window_start = EXCLUDED.window_start")
+
+
+def series_key(manga_title):
+    """ Normalized series name (registry and alias key; sketch key of an unregistered name). """
+    return re.sub(r'\s+', ' ', manga_title.strip().lower())
+
+
+def sketch_key(manga_title, series_id=None):
+    """ Sketch identity: the registered series (shared by all its aliases), else the normalized name. """
+    return f"series:{series_id}" if series_id is not None else series_key(manga_title)
+
+
+def _sketch_series(conn, manga_title, series_id=None):
+    """ (series_id or None, sketch key) for a name, looking the series up when no id is given. """
+    # Imported here: series_registry imports from this module.
+    from series_registry import lookup_series_id
+    if series_id is None and manga_title is not None:
+        series_id = lookup_series_id(conn, manga_title)
+    return series_id, sketch_key(manga_title, series_id)
+
+
+class TDigest:
+    """Merging t-digest (Dunning) with the k1 scale function; centroids are [mean, weight]."""
+
+    def __init__(self, compression=100, centroids=None, count=0, total=0.0, min_value=None, max_value=None):
+        self.compression = compression
+        self.centroids = centroids or []
+        self.count = count
+        self.total = total
+        self.min = min_value
+        self.max = max_value
+        self._buffer = []
+
+    # --- Updates ---
+    def add(self, value, weight=1):
+        value = float(value)
+        self._buffer.append([value, weight])
+        self.count += weight
+        self.total += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend([list(c) for c in other.centroids])
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(self.centroids + self._buffer, key=lambda c: c[0])
+        self._buffer = []
+        total_weight = sum(w for _, w in items)
+        merged = []
+        cumulative = 0.0
+        cur_mean, cur_weight = items[0]
+        for mean, weight in items[1:]:
+            q = (cumulative + (cur_weight + weight) / 2.0) / total_weight
+            limit = 4.0 * total_weight * q * (1.0 - q) / self.compression
+            if cur_weight + weight <= limit:
+                cur_mean = (cur_mean * cur_weight + mean * weight) / (cur_weight + weight)
+                cur_weight += weight
+            else:
+                merged.append([cur_mean, cur_weight])
+                cumulative += cur_weight
+                cur_mean, cur_weight = mean, weight
+        merged.append([cur_mean, cur_weight])
+        self.centroids = merged
+
+    # --- Queries ---
+    def quantile(self, q):
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        target = q * self.count
+        # Centroid i covers the weight around its midpoint; interpolate between midpoints.
+        midpoints, cumulative = [], 0.0
+        for _, weight in self.centroids:
+            midpoints.append(cumulative + weight / 2.0)
+            cumulative += weight
+        if target <= midpoints[0]:
+            first_mean, first_weight = self.centroids[0]
+            if first_weight <= 1 or midpoints[0] == 0:
+                return first_mean
+            return self.min + (first_mean - self.min) * (target / midpoints[0])
+        if target >= midpoints[-1]:
+            last_mean = self.centroids[-1][0]
+            tail = self.count - midpoints[-1]
+            if tail <= 0 or self.centroids[-1][1] <= 1:
+                return last_mean
+            return last_mean + (self.max - last_mean) * ((target - midpoints[-1]) / tail)
+        i = bisect.bisect_right(midpoints, target) - 1
+        left_mean, right_mean = self.centroids[i][0], self.centroids[i + 1][0]
+        span = midpoints[i + 1] - midpoints[i]
+        return left_mean + (right_mean - left_mean) * ((target - midpoints[i]) / span)
+
+    def mean_between(self, low, high):
+        """ Weighted mean of centroids whose mean lies in [low, high] (None if empty). """
+        self._compress()
+        weight = sum(w for m, w in self.centroids if low <= m <= high)
+        if not weight:
+            return None
+        return sum(m * w for m, w in self.centroids if low <= m <= high) / weight
+
+    def summary(self):
+        """ Median, p10/p90, quartiles and an IQR-filtered mean. """
+        if not self.count:
+            return None
+        p25, p75 = self.quantile(0.25), self.quantile(0.75)
+        iqr = p75 - p25
+        return {
+            "count": int(self.count),
+            "mean": self.total / self.count,
+            "median": self.quantile(0.5),
+            "p10": self.quantile(0.10),
+            "p25": p25,
+            "p75": p75,
+            "p90": self.quantile(0.90),
+            "iqrMean": self.mean_between(p25 - 1.5 * iqr, p75 + 1.5 * iqr),
+        }
+
+    # --- Serialization ---
+    def to_json(self):
+        self._compress()
+        return json.dumps({"v": 1, "compression": self.compression, "c": self.centroids,
+                           "n": self.count, "sum": self.total, "min": self.min, "max": self.max})
+
+    @classmethod
+    def from_json(cls, data):
+        if isinstance(data, str):
+            data = json.loads(data)
+        return cls(compression=data.get("compression", 100), centroids=[list(c) for c in data.get("c", [])],
+                   count=data.get("n", 0), total=data.get("sum", 0.0), min_value=data.get("min"), max_value=data.get("max"))
+
+
+# --- Persistence ---
+def update_series_sketch(conn, manga_title, prices, series_id=None):
+    """
+    Merges newly inserted per-volume prices into the series' stored sketch
+    (row-locked read-modify-write). The rows must already be committed: a
+    series without a sketch for the current price window is rebuilt from its
+    stored listings. series_id: the series the rows were filed under (looked
+    up from the name if not given).
+    """
+    prices = [float(p) for p in prices if p is not None]
+    if not conn or not prices:
+        return False
+    series_id, key = _sketch_series(conn, manga_title, series_id)
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT sketch, window_start FROM series_price_sketches WHERE series_key = %s FOR UPDATE", (key,))
+        row = cur.fetchone()
+        if row is None or row[1] != price_window_start():
+            conn.rollback()
+            return rebuild_series_sketch(conn, manga_title, series_id=series_id) is not None
+        digest = TDigest.from_json(row[0]).update(prices)
+        cur.execute("UPDATE series_price_sketches SET sketch = %s, sample_count = %s, updated_at = %s WHERE series_key = %s",
+                    (digest.to_json(), int(digest.count), datetime.datetime.now(), key))
+        conn.commit()
+        return True
+    except (Exception, psycopg2.DatabaseError) as error:
+        db_log.error("Error updating price sketch: %s", error, extra={"series": key})
+        conn.rollback()
+        return False
+    finally:
+        if cur:
+            cur.close()
+
+
+def rebuild_series_sketch(conn, manga_title, batch_size=5000, series_id=None):
+    """
+    Rebuilds a series' sketch from stored listings, over the same rows as the
+    average price: the series' singles and lots sold within the price window.
+    With series_id the name may be None (e.g. a series that lost rows to a backfill).
+    """
+    series_id, key = _sketch_series(conn, manga_title, series_id)
+    window_start = price_window_start()
+    digest = TDigest()
+    cur = None
+    try:
+        match, params = ("series_id = %s", [series_id]) if series_id is not None else ("title ILIKE %s", [f'%{manga_title}%'])
+        # Named (server-side) cursor so large series are streamed, not loaded at once.
+        cur = conn.cursor(name=f"sketch_rebuild_{abs(hash(key))}")
+        cur.itersize = batch_size
+        cur.execute(f"SELECT price_per_volume FROM manga_listings WHERE {match} AND format IN %s AND price_per_volume IS NOT NULL AND date_sold >= %s",
+                    params + [SKETCH_FORMATS, window_start])
+        for (price,) in cur:
+            digest.add(float(price))
+        cur.close()
+        cur = conn.cursor()
+        cur.execute(SKETCH_UPSERT_SQL, (key, digest.to_json(), int(digest.count), datetime.datetime.now(), window_start))
+        conn.commit()
+        db_log.info("Rebuilt price sketch", extra={"series": key, "samples": int(digest.count)})
+        return digest
+    except (Exception, psycopg2.DatabaseError) as error:
+        db_log.error("Error rebuilding price sketch: %s", error, extra={"series": key})
+        conn.rollback()
+        return None
+    finally:
+        if cur and not cur.closed:
+            cur.close()
+
+
+def get_price_summary_from_db(conn, manga_title):
+    """
+    Price distribution summary for a series from its stored sketch (one row
+    lookup). Builds it on first use, and again once the price window has moved on.
+    """
+    if not conn:
+        return None
+    series_id, key = _sketch_series(conn, manga_title)
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT sketch FROM series_price_sketches WHERE series_key = %s AND window_start = %s", (key, price_window_start()))
+        row = cur.fetchone()
+    except (Exception, psycopg2.DatabaseError) as error:
+        db_log.error("Error reading price sketch: %s", error, extra={"series": key})
+        conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+    digest = TDigest.from_json(row[0]) if row else rebuild_series_sketch(conn, manga_title, series_id=series_id)
+    return digest.summary() if digest else None
@@ -0,0 +1,251 @@
+# === Bulk Re-parse of Stored Listings ===
+# After is_mixed_lot / parse_volume_info improve, rows already in
+# manga_listings keep the num_volumes, format and price_per_volume the old
+# parser gave them. This job re-derives them from the stored titles instead
+# of re-scraping:
+#
+#   * rows are read per series in keyset pages on id, each in its own short
+#     read (autocommit), so no snapshot stays open through the rate limit's
+#     sleeps and holds back vacuum,
+#   * chunks are classified in the shared parse process pool,
+#   * only rows whose values changed are written, in batched UPDATEs,
+#   * progress is checkpointed per (series, parser fingerprint), so an
+#     interrupted run resumes where it stopped and a finished one is a no-op
+#     until the parser changes again,
+#   * writes are rate limited and run with a short lock_timeout so live
+#     price queries and scrapes are not starved.
+#
+# Rows whose volume count came from a description (or a duplicate cluster)
+# are left alone: their titles never carried the count.
+
+# --- Standard Libraries ---
+import argparse
+import collections
+import datetime
+import os
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+# --- Database Library ---
+import psycopg2
+import psycopg2.extras
+
+# --- Scraper Logic ---
+from manga_scraper_logic import classify_title, create_tables, get_db_connection, parser_fingerprint
+from price_sketch import rebuild_series_sketch
+from scrape_logging import call_in_correlation_scope, correlation_scope, get_correlation_id, get_logger
+from scrape_pipeline import get_parse_pool
+from series_registry import series_match
+
+log = get_logger("reparse")
+
+# --- Configuration (env) ---
+# REPARSE_CHUNK_SIZE      - rows per parse task / UPDATE batch (default 500)
+# REPARSE_MAX_ROWS_PER_SEC - scan rate limit (default 2000, 0 = unlimited)
+REPARSE_SCHEMA_COMMANDS = ("""CREATE TABLE IF NOT EXISTS reparse_checkpoints (job_key VARCHAR(600) PRIMARY KEY, parser_version VARCHAR(50) NOT NULL, last_id BIGINT NOT NULL DEFAULT 0, scanned BIGINT NOT NULL DEFAULT 0, updated BIGINT NOT NULL DEFAULT 0, finished BOOLEAN NOT NULL DEFAULT FALSE, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",)
+
+_CENT = Decimal('0.01')
+
+
+def _price(total_price, num_volumes):
+    if total_price is None or not num_volumes or num_volumes <= 0:
+        return None
+    # Compare at the column's NUMERIC(10, 2) precision.
+    return (Decimal(total_price) / num_volumes).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def reparse_chunk(rows, manga_title):
+    """
+    Re-classifies (id, date_sold, title, total_price, num_volumes, format, price_per_volume) rows.
+    Returns [(id, date_sold, num_volumes, format, price_per_volume)] for rows whose values changed.
+    Top-level so it can run in the parse process pool.
+    """
+    changed = []
+    for row_id, date_sold, title, total_price, old_volumes, old_format, old_price in rows:
+        is_mixed, num_volumes, format_type, is_ambiguous = classify_title(title, manga_title)
+        if is_mixed or format_type == 'Exclude' or num_volumes == 0:
+            # The current parser would have rejected this listing; keep the row but take it out of pricing.
+            num_volumes, format_type = 0, 'Exclude'
+        elif is_ambiguous:
+            # Would now need a description lookup; the title alone no longer supports a count.
+            num_volumes, format_type = None, 'Unknown'
+        new_price = _price(total_price, num_volumes)
+        old_price = Decimal(old_price).quantize(_CENT) if old_price is not None else None
+        if (num_volumes, format_type, new_price) != (old_volumes, old_format, old_price):
+            changed.append((row_id, date_sold, num_volumes, format_type, new_price))
+    return changed
+
+
+def _job_key(manga_title):
+    return manga_title.strip().lower()
+
+
+def load_checkpoint(conn, manga_title, version):
+    """ Returns (last_id, scanned, updated, finished) for this series and parser version. """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT parser_version, last_id, scanned, updated, finished FROM reparse_checkpoints WHERE job_key = %s", (_job_key(manga_title),))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if row is None or row[0] != version:
+        return 0, 0, 0, False
+    return row[1], row[2], row[3], row[4]
+
+
+def _save_checkpoint(cur, manga_title, version, last_id, scanned, updated, finished):
+    cur.execute("INSERT INTO reparse_checkpoints (job_key, parser_version, last_id, scanned, updated, finished, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (job_key) DO UPDATE SET parser_version = EXCLUDED.parser_version, last_id = EXCLUDED.last_id, scanned = EXCLUDED.scanned, "
+                "updated = EXCLUDED.updated, finished = EXCLUDED.finished, updated_at = EXCLUDED.updated_at",
+                (_job_key(manga_title), version, last_id, scanned, updated, finished, datetime.datetime.now()))
+
+
+def _apply_updates(write_conn, manga_title, version, changed, last_id, scanned, updated, finished=False):
+    """ Writes one chunk's changed rows and its checkpoint in a single transaction. """
+    cur = write_conn.cursor()
+    try:
+        if changed:
+            psycopg2.extras.execute_values(
+                cur,
+                # date_sold is the partition key: matching on it lets the planner touch only the rows' partitions.
+                "UPDATE manga_listings AS m SET num_volumes = v.num_volumes, format = v.format, price_per_volume = v.price_per_volume "
+                "FROM (VALUES %s) AS v(id, date_sold, num_volumes, format, price_per_volume) WHERE m.id = v.id AND m.date_sold = v.date_sold",
+                changed, template="(%s, %s::date, %s::integer, %s::varchar, %s::numeric)", page_size=len(changed))
+        _save_checkpoint(cur, manga_title, version, last_id, scanned, updated, finished)
+        write_conn.commit()
+    except (Exception, psycopg2.DatabaseError):
+        write_conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def reparse_series(manga_title, chunk_size=None, max_rows_per_sec=None, restart=False, pool=None):
+    """
+    Re-derives volume/format/price for one series' title-parsed rows.
+    Returns {'scanned', 'updated', 'resumedFrom', 'seconds'} or None on error.
+    """
+    chunk_size = chunk_size or int(os.environ.get('REPARSE_CHUNK_SIZE', '500'))
+    max_rows_per_sec = max_rows_per_sec if max_rows_per_sec is not None else float(os.environ.get('REPARSE_MAX_ROWS_PER_SEC', '2000'))
+    version = parser_fingerprint()
+    pool = pool or get_parse_pool()
+    workers = int(os.environ.get('SCRAPE_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+
+    read_conn = get_db_connection()
+    write_conn = get_db_connection()
+    if not read_conn or not write_conn:
+        log.error("Cannot re-parse without database connections")
+        for conn in (read_conn, write_conn):
+            if conn:
+                conn.close()
+        return None
+    started = time.perf_counter()
+    last_id = 0
+    try:
+        create_tables(write_conn)
+        cur = write_conn.cursor()
+        for command in REPARSE_SCHEMA_COMMANDS:
+            cur.execute(command)
+        # Back off instead of queueing behind live writers holding row locks.
+        cur.execute("SET lock_timeout = '2s'")
+        write_conn.commit()
+        cur.close()
+
+        last_id, scanned, updated, finished = (0, 0, 0, False) if restart else load_checkpoint(write_conn, manga_title, version)
+        resumed_from = last_id
+        if finished:
+            log.info("Series already re-parsed with this parser version", extra={"series": manga_title, "parser_version": version})
+            return {"scanned": scanned, "updated": updated, "resumedFrom": resumed_from, "seconds": 0.0}
+        log.info("Starting re-parse", extra={"series": manga_title, "parser_version": version, "resume_after_id": last_id})
+
+        # Keyset pages, each read on its own: nothing holds a snapshot between pages.
+        read_conn.autocommit = True
+        read_cur = read_conn.cursor()
+        match, params = series_match(write_conn, manga_title)
+        page_sql = ("SELECT id, date_sold, title, total_price, num_volumes, format, price_per_volume FROM manga_listings "
+                    f"WHERE {match} AND parse_source = 'Title' AND id > %s ORDER BY id LIMIT %s")
+        read_after = last_id
+
+        # Parse chunks in parallel; apply results in id order so the checkpoint only moves past written rows.
+        inflight = collections.deque()
+        throttle_started, throttle_rows = time.monotonic(), 0
+
+        def apply_done(limit):
+            nonlocal scanned, updated, last_id
+            while inflight and (len(inflight) > limit or inflight[0][2].done()):
+                chunk_last_id, chunk_len, future = inflight.popleft()
+                changed = future.result()
+                scanned += chunk_len
+                updated += len(changed)
+                last_id = chunk_last_id
+                _apply_updates(write_conn, manga_title, version, changed, last_id, scanned, updated)
+                log.debug("Re-parsed chunk", extra={"series": manga_title, "last_id": last_id, "changed": len(changed), "sampled": True})
+
+        while True:
+            read_cur.execute(page_sql, params + [read_after, chunk_size])
+            rows = read_cur.fetchall()
+            if not rows:
+                break
+            read_after = rows[-1][0]
+            inflight.append((rows[-1][0], len(rows), pool.submit(call_in_correlation_scope, get_correlation_id(), reparse_chunk, rows, manga_title)))
+            apply_done(limit=workers)
+
+            if max_rows_per_sec:
+                throttle_rows += len(rows)
+                ahead = throttle_rows / max_rows_per_sec - (time.monotonic() - throttle_started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        apply_done(limit=0)
+        read_cur.close()
+
+        _apply_updates(write_conn, manga_title, version, [], last_id, scanned, updated, finished=True)
+        if updated:
+            # Per-volume prices changed under the sketch; rebuild it from the corrected rows.
+            rebuild_series_sketch(write_conn, manga_title)
+        seconds = round(time.perf_counter() - started, 3)
+        log.info("Re-parse finished", extra={"series": manga_title, "scanned": scanned, "updated": updated, "seconds": seconds})
+        return {"scanned": scanned, "updated": updated, "resumedFrom": resumed_from, "seconds": seconds}
+    except (Exception, psycopg2.DatabaseError) as error:
+        # Everything before last_id is committed with its checkpoint; a rerun resumes there.
+        log.error("Re-parse stopped: %s", error, extra={"series": manga_title, "last_id": last_id})
+        return None
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+
+def distinct_series(conn):
+    """ Registered series, plus unregistered names that have a sketch (one per scraped name). """
+    cur = conn.cursor()
+    try:
+        # Registered series' sketches are keyed "series:<id>"; their names come from the registry.
+        cur.execute("SELECT series_key FROM series UNION SELECT series_key FROM series_price_sketches WHERE series_key NOT LIKE 'series:%' ORDER BY 1")
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+# --- Command-line entry point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-derive volume counts/formats of stored listings with the current parser.")
+    parser.add_argument("titles", nargs="*", help="Series to re-parse (default: every registered series and sketched name)")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--max-rows-per-sec", type=float, default=None)
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints and start from the first row")
+    args = parser.parse_args()
+
+    with correlation_scope():
+        titles = args.titles
+        if not titles:
+            conn = get_db_connection()
+            if not conn:
+                raise SystemExit(1)
+            try:
+                titles = distinct_series(conn)
+            finally:
+                conn.close()
+        ok = True
+        for title in titles:
+            result = reparse_series(title, chunk_size=args.chunk_size, max_rows_per_sec=args.max_rows_per_sec, restart=args.restart)
+            ok = ok and result is not None
+    raise SystemExit(0 if ok else 1)
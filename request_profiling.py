@@ -0,0 +1,229 @@
+# === On-Demand Request Profiling ===
+# Opt-in profiling for slow price checks. A profiled request runs under cProfile
+# (deterministic, written as a .prof file for pstats/snakeviz) while a sampler
+# thread records stacks in collapsed "folded" format (one 'thread;frame;frame
+# count' line per stack, ready for flamegraph.pl or speedscope). Worker
+# threads the request starts (the scrape pipeline's stages) join the profile
+# through `profiled_thread(...)`: each gets its own cProfile, merged into the
+# .prof file, and is sampled alongside the handler thread. Code on the hot path
+# marks named stages with `stage(...)`; the per-stage wall-clock totals are
+# returned to the caller.
+
+# --- Standard Libraries ---
+import contextlib
+import contextvars
+import cProfile
+import collections
+import datetime
+import hmac
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+# --- Logging ---
+from scrape_logging import get_logger, get_correlation_id
+
+log = get_logger("profiling")
+
+# --- Configuration (env) ---
+# PROFILE_REQUESTS     - '1' profiles every request (for staging boxes; no token needed)
+# PROFILE_ADMIN_TOKEN  - token required in X-Admin-Token for header/query-triggered profiling
+# PROFILE_DIR          - where .prof/.folded files are written (default ./profiles)
+# PROFILE_SAMPLE_MS    - sampler interval in milliseconds (default 5)
+PROFILE_HEADER = 'X-Profile'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+_null_stage = contextlib.nullcontext()
+
+
+def _truthy(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def profiling_requested(req):
+    """Decides whether a Flask request should be profiled (env, or header/query + admin token)."""
+    if _truthy(os.environ.get('PROFILE_REQUESTS', '')):
+        return True
+    asked = _truthy(req.headers.get(PROFILE_HEADER, '')) or _truthy(req.args.get('profile', ''))
+    if not asked:
+        return False
+    expected = os.environ.get('PROFILE_ADMIN_TOKEN')
+    supplied = req.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not expected or not hmac.compare_digest(expected, supplied):
+        log.warning("Profiling requested without a valid admin token; ignoring")
+        return False
+    return True
+
+
+# --- Stage Timing ---
+def stage(name):
+    """Context manager timing a named stage of the active profile (no-op when not profiling)."""
+    profile = _active_profile.get()
+    if profile is None:
+        return _null_stage
+    return profile.time_stage(name)
+
+
+def profiling_active():
+    """True inside a profiled request (including threads that copied its context)."""
+    return _active_profile.get() is not None
+
+
+def profiled_thread(target):
+    """
+    Wraps a worker thread's target so the active profile also covers that
+    thread (profiled and sampled). Returns target unchanged when not profiling.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return target
+
+    def run(*args, **kwargs):
+        with profile.profile_thread():
+            return target(*args, **kwargs)
+    return run
+
+
+class _StackSampler(threading.Thread):
+    """Samples the watched threads' Python stacks at a fixed interval into folded-stack counts (rooted at the thread name)."""
+
+    def __init__(self, target_thread, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.targets = {target_thread.ident: target_thread.name}
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def watch(self, thread):
+        with self._lock:
+            self.targets[thread.ident] = thread.name
+
+    def unwatch(self, thread):
+        with self._lock:
+            self.targets.pop(thread.ident, None)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                targets = list(self.targets.items())
+            for thread_id, thread_name in targets:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    stack.append(thread_name)
+                    self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    """Profiles everything run inside its `with` block on the current thread (and threads joined via profiled_thread)."""
+
+    def __init__(self, label, output_dir=None, sample_interval=None):
+        self.label = label
+        self.output_dir = output_dir or os.environ.get('PROFILE_DIR', 'profiles')
+        if sample_interval is None:
+            sample_interval = float(os.environ.get('PROFILE_SAMPLE_MS', '5')) / 1000.0
+        self.sample_interval = sample_interval
+        self.stages = collections.defaultdict(float)
+        self.stage_calls = collections.Counter()
+        self.total_seconds = None
+        self.files = []
+        self._profiler = None
+        self._thread_profilers = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._token = None
+        self._started = None
+
+    @contextlib.contextmanager
+    def time_stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+            self.stage_calls[name] += 1
+
+    @contextlib.contextmanager
+    def profile_thread(self):
+        """Profiles and samples the calling (worker) thread for the duration of the block."""
+        thread = threading.current_thread()
+        self._sampler.watch(thread)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile per process; the sampler still covers this thread.
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self._thread_profilers.append(profiler)
+            self._sampler.unwatch(thread)
+
+    def __enter__(self):
+        self._token = _active_profile.set(self)
+        self._sampler = _StackSampler(threading.current_thread(), self.sample_interval)
+        self._sampler.start()
+        self._profiler = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profiler.disable()
+        self.total_seconds = time.perf_counter() - self._started
+        self._sampler.stop()
+        _active_profile.reset(self._token)
+        try:
+            self._write_files()
+        except OSError as error:
+            log.error("Could not write profile output: %s", error, extra={"dir": self.output_dir})
+        return False
+
+    def _write_files(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
+        safe_label = re.sub(r'\W+', '_', self.label).strip('_') or 'request'
+        base = os.path.join(self.output_dir, f"{safe_label}_{stamp}_{get_correlation_id()}")
+
+        prof_path = base + '.prof'
+        stats = pstats.Stats(self._profiler)
+        with self._lock:
+            if self._thread_profilers:
+                stats.add(*self._thread_profilers)
+        stats.dump_stats(prof_path)
+        folded_path = base + '.folded'
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in self._sampler.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self.files = [prof_path, folded_path]
+        log.info("Wrote request profile", extra={"prof": prof_path, "folded": folded_path, "seconds": round(self.total_seconds, 3)})
+
+    def summary(self):
+        """JSON-serialisable per-stage totals for the API response."""
+        return {
+            "totalSeconds": round(self.total_seconds or 0.0, 4),
+            "stages": {
+                name: {"seconds": round(seconds, 4), "calls": self.stage_calls[name]}
+                for name, seconds in sorted(self.stages.items(), key=lambda kv: -kv[1])
+            },
+            "samples": sum(self._sampler.counts.values()) if self._sampler else 0,
+            "files": self.files,
+        }
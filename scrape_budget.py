@@ -0,0 +1,173 @@
+# === Per-Request Scrape Time Budget ===
+# A price check used to run until every page and description was fetched: up
+# to 60 s per Oxylabs page plus paced eBay description fetches, long after
+# the client gave up. A ScrapeBudget puts a deadline on one scrape:
+#
+#   * every outbound request's timeout is capped to the time left, and retries
+#     that would sleep past the deadline are abandoned (FetchController),
+#   * result pages come first: a page is only started if the learned cost of
+#     a page still fits, since one page yields ~60 listings,
+#   * ambiguous listings that need a description are deferred until the pages
+#     are done, then fetched in order of price impact while descriptions fit,
+#   * whatever did not fit is counted and reported with the response.
+#
+# The active budget is held in a context variable, so the pipeline's stage
+# threads (which run in copies of the caller's context) see it too.
+
+# --- Standard Libraries ---
+import contextlib
+import contextvars
+import os
+import statistics
+import threading
+import time
+
+# --- Web Scraping Libraries ---
+import requests
+
+# --- Configuration (env) ---
+# SCRAPE_TIME_BUDGET_SECONDS   - default budget when a request gives none (unset = unlimited)
+# SCRAPE_MAX_TIME_BUDGET       - upper bound for a requested budget (default 600)
+# SCRAPE_BUDGET_RESERVE_SECONDS - kept back for the final price query (default 1)
+# SCRAPE_PAGE_ESTIMATE_SECONDS - assumed page cost until one is measured (default 15)
+# SCRAPE_DESC_ESTIMATE_SECONDS - assumed description cost until one is measured (default 8)
+PAGE = "page"
+DESCRIPTION = "description"
+MIN_REQUEST_TIMEOUT = 0.5
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised instead of sending (or retrying) a request the time budget can't cover."""
+
+
+class ScrapeBudget:
+    """Deadline plus learned per-kind costs and done/skipped counters for one scrape (thread-safe)."""
+
+    def __init__(self, seconds, reserve=None):
+        self.seconds = float(seconds)
+        self.reserve = reserve if reserve is not None else float(os.environ.get('SCRAPE_BUDGET_RESERVE_SECONDS', '1'))
+        self.started = time.monotonic()
+        self.deadline = self.started + self.seconds
+        self._lock = threading.Lock()
+        self._cost = {
+            PAGE: float(os.environ.get('SCRAPE_PAGE_ESTIMATE_SECONDS', '15')),
+            DESCRIPTION: float(os.environ.get('SCRAPE_DESC_ESTIMATE_SECONDS', '8')),
+        }
+        self.done = {PAGE: 0, DESCRIPTION: 0}
+        self.skipped = {PAGE: 0, DESCRIPTION: 0}
+        self.truncated = False
+
+    # --- Time left ---
+    def remaining(self):
+        """ Seconds left for scraping (the reserve for the final query excluded). """
+        return max(0.0, self.deadline - self.reserve - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cap(self, timeout):
+        """ A request timeout capped to the time left; raises DeadlineExceeded if too little is left. """
+        remaining = self.remaining()
+        if remaining < MIN_REQUEST_TIMEOUT:
+            raise DeadlineExceeded("scrape time budget exhausted")
+        if isinstance(timeout, (int, float)):
+            return min(float(timeout), remaining)
+        return remaining
+
+    # --- Costs ---
+    def can_afford(self, kind):
+        """ True if one more unit of `kind` is expected to finish before the deadline. """
+        with self._lock:
+            cost = self._cost[kind]
+        return self.remaining() >= cost
+
+    def record(self, kind, seconds):
+        with self._lock:
+            # Lean towards the latest observation: upstream latency drifts within a scrape.
+            self._cost[kind] = 0.5 * self._cost[kind] + 0.5 * seconds
+            self.done[kind] += 1
+
+    @contextlib.contextmanager
+    def measure(self, kind):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(kind, time.monotonic() - started)
+
+    def skip(self, kind, count=1):
+        with self._lock:
+            self.skipped[kind] += count
+            self.truncated = True
+
+    def mark_truncated(self):
+        self.truncated = True
+
+    def report(self):
+        """ What the scrape got done within the budget (added to price responses). """
+        with self._lock:
+            return {
+                "budgetSeconds": self.seconds,
+                "elapsedSeconds": round(time.monotonic() - self.started, 3),
+                "complete": not self.truncated,
+                "pagesFetched": self.done[PAGE],
+                "descriptionsFetched": self.done[DESCRIPTION],
+                "skipped": {"pages": self.skipped[PAGE], "descriptions": self.skipped[DESCRIPTION]},
+            }
+
+
+# --- Active budget (context variable) ---
+_current = contextvars.ContextVar("scrape_budget", default=None)
+
+
+def current_budget():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def budget_scope(budget):
+    """ Makes `budget` the active budget inside the block (None = unlimited). """
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
+
+
+def budget_from_request(value):
+    """
+    ScrapeBudget for a request's `timeBudget` (seconds), falling back to
+    SCRAPE_TIME_BUDGET_SECONDS; None when neither is set. Raises ValueError
+    for a value that isn't a positive number.
+    """
+    if value in (None, ''):
+        value = os.environ.get('SCRAPE_TIME_BUDGET_SECONDS')
+        if not value:
+            return None
+    seconds = float(value)
+    if not seconds > 0:
+        raise ValueError("timeBudget must be a positive number of seconds")
+    return ScrapeBudget(min(seconds, float(os.environ.get('SCRAPE_MAX_TIME_BUDGET', '600'))))
+
+
+def descriptions_from_request(value, budget):
+    """
+    Whether a price check fetches descriptions for ambiguous listings: the
+    request's `fetchDescriptions` flag, on by default when the request has a
+    time budget (the descriptions then get what the pages leave of it, largest
+    price impact first) and off otherwise.
+    """
+    if value in (None, ''):
+        return budget is not None
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# --- Prioritizing deferred descriptions ---
+def by_price_impact(candidates, price_per_volume):
+    """
+    Ambiguous candidates, most price-relevant first. An unresolved listing
+    would count as one volume at its full price, so the further its price is
+    from the typical per-volume price, the more resolving it changes the estimate.
+    """
+    reference = statistics.median(price_per_volume) if price_per_volume else 0.0
+    return sorted(candidates, key=lambda item_data: abs(item_data["total_price"] - reference), reverse=True)
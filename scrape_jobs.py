@@ -0,0 +1,434 @@
+# === Scrape Job Queue and Worker Fleet ===
+# Scrapes used to run only inside the web process that received the request.
+# Now they can be queued in the scrape_jobs table and run by standalone
+# workers (`python scrape_jobs.py worker`) on any number of nodes:
+#
+#   * claim: one UPDATE ... WHERE id = (SELECT ... FOR UPDATE SKIP LOCKED),
+#     so concurrent workers never wait on or double-claim the same job,
+#   * lease: a claimed job carries a lease (lease_expires_at) that the worker
+#     extends while the scrape runs. If the worker dies, the lease runs out and
+#     another worker reclaims the job; after max_attempts it is failed,
+#   * fencing: heartbeats and results only apply while (leased_by, attempts)
+#     still match the claim, so a reclaimed job ignores its stale worker. A
+#     worker that loses its lease (or can't renew it for a whole lease) also
+#     cancels its scrape rather than racing the new owner,
+#   * retries: a failed scrape is re-queued with exponential backoff,
+#   * one active job per series: enqueueing a series that is already queued
+#     or running returns the existing job.
+#
+# All lease/backoff times are computed by Postgres (now()), so worker clocks
+# don't have to agree. With SCRAPE_EXECUTION=queue the API (Flask or ASGI)
+# enqueues a job and waits for a worker instead of scraping in-process.
+
+# --- Standard Libraries ---
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+# --- Database Library ---
+import psycopg2
+
+# --- Scraper Logic ---
+from manga_scraper_logic import create_tables, get_db_connection, run_scrape
+from scrape_logging import get_logger, get_correlation_id, correlation_scope
+
+log = get_logger("jobs")
+
+# --- Configuration (env) ---
+# SCRAPE_EXECUTION           - "inline" (default: scrape in the API process) or "queue"
+# SCRAPE_JOB_LEASE_SECONDS   - lease per claim, extended while running (default 120)
+# SCRAPE_JOB_MAX_ATTEMPTS    - attempts before a job is failed (default 3)
+# SCRAPE_JOB_RETRY_SECONDS   - backoff before the first retry, doubled per attempt (default 30)
+# SCRAPE_WORKER_IDLE_SECONDS - worker poll interval when the queue is empty (default 2)
+# SCRAPE_JOB_WAIT_SECONDS    - how long a queued API request waits for its job (default 300)
+
+JOB_SCHEMA_COMMANDS = (
+    """CREATE TABLE IF NOT EXISTS scrape_jobs (id BIGSERIAL PRIMARY KEY, job_key VARCHAR(500) NOT NULL, manga_title VARCHAR(500) NOT NULL, max_pages INTEGER NOT NULL DEFAULT 3, min_price NUMERIC(10, 2) NOT NULL DEFAULT 5, fetch_descriptions BOOLEAN NOT NULL DEFAULT FALSE, priority INTEGER NOT NULL DEFAULT 0, status VARCHAR(20) NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL DEFAULT 3, run_after TIMESTAMP NOT NULL DEFAULT now(), leased_by VARCHAR(200), lease_expires_at TIMESTAMP, progress JSONB, result JSONB, last_error TEXT, correlation_id VARCHAR(64), created_at TIMESTAMP NOT NULL DEFAULT now(), started_at TIMESTAMP, finished_at TIMESTAMP, updated_at TIMESTAMP NOT NULL DEFAULT now())""",
+    """CREATE INDEX IF NOT EXISTS idx_scrape_jobs_claim ON scrape_jobs (status, priority DESC, id) WHERE status IN ('queued', 'running')""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_scrape_jobs_active_key ON scrape_jobs (job_key) WHERE status IN ('queued', 'running')""",
+)
+
+JOB_COLUMNS = ("id", "manga_title", "max_pages", "min_price", "fetch_descriptions", "status", "attempts", "max_attempts",
+               "leased_by", "progress", "result", "last_error", "correlation_id", "created_at", "started_at", "finished_at")
+_JOB_SELECT = ", ".join(JOB_COLUMNS)
+
+# Expired leases whose job has no attempts left: the worker died on its last try.
+REAP_SQL = ("UPDATE scrape_jobs SET status = 'failed', finished_at = now(), updated_at = now(), leased_by = NULL, "
+            "last_error = COALESCE(last_error || '; ', '') || 'lease expired on final attempt' "
+            "WHERE status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts")
+
+CLAIM_SQL = ("UPDATE scrape_jobs SET status = 'running', attempts = attempts + 1, leased_by = %s, "
+             "lease_expires_at = now() + make_interval(secs => %s), progress = NULL, started_at = COALESCE(started_at, now()), updated_at = now() "
+             "WHERE id = (SELECT id FROM scrape_jobs "
+             "  WHERE (status = 'queued' AND run_after <= now()) "
+             "     OR (status = 'running' AND lease_expires_at < now() AND attempts < max_attempts) "
+             "  ORDER BY priority DESC, id LIMIT 1 FOR UPDATE SKIP LOCKED) "
+             f"RETURNING {_JOB_SELECT}")
+
+
+# Enqueue (one active job per series) and job lookup; the async client uses them with $-placeholders.
+ENQUEUE_SQL = ("INSERT INTO scrape_jobs (job_key, manga_title, max_pages, min_price, fetch_descriptions, priority, max_attempts, correlation_id) "
+               "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (job_key) WHERE status IN ('queued', 'running') DO NOTHING RETURNING id")
+ACTIVE_JOB_SQL = "SELECT id FROM scrape_jobs WHERE job_key = %s AND status IN ('queued', 'running')"
+GET_JOB_SQL = f"SELECT {_JOB_SELECT} FROM scrape_jobs WHERE id = %s"
+
+
+def job_key(manga_title):
+    return manga_title.strip().lower()
+
+
+def _as_job(row):
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def create_job_tables(conn):
+    cur = conn.cursor()
+    try:
+        for command in JOB_SCHEMA_COMMANDS:
+            cur.execute(command)
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# --- Queue operations ---
+def enqueue_job(conn, manga_title, max_pages=3, min_price=5, fetch_descriptions=False, priority=0, max_attempts=None, correlation_id=None):
+    """ Queues a scrape and returns its job id (the existing one if the series is already queued or running). """
+    max_attempts = max_attempts or int(os.environ.get('SCRAPE_JOB_MAX_ATTEMPTS', '3'))
+    key = job_key(manga_title)
+    cur = conn.cursor()
+    try:
+        # Two tries: the active job we conflicted with may finish before we can read its id.
+        for _ in range(2):
+            cur.execute(ENQUEUE_SQL, (key, manga_title.strip(), max_pages, min_price, fetch_descriptions, priority, max_attempts, correlation_id))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(ACTIVE_JOB_SQL, (key,))
+                row = cur.fetchone()
+            if row is not None:
+                conn.commit()
+                return row[0]
+        conn.commit()
+        return None
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def claim_job(conn, worker_id, lease_seconds):
+    """ Claims the next runnable job (or a job whose lease expired). Returns the job dict or None. """
+    cur = conn.cursor()
+    try:
+        cur.execute(REAP_SQL)
+        reaped = cur.rowcount
+        cur.execute(CLAIM_SQL, (worker_id, lease_seconds))
+        job = _as_job(cur.fetchone())
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if reaped:
+        log.warning("Failed jobs whose worker was lost on the final attempt", extra={"jobs": reaped})
+    return job
+
+
+def heartbeat(conn, job, worker_id, lease_seconds, progress=None):
+    """ Extends the lease (and stores progress). False if the job was reclaimed by another worker. """
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE scrape_jobs SET lease_expires_at = now() + make_interval(secs => %s), progress = COALESCE(%s::jsonb, progress), updated_at = now() "
+                    "WHERE id = %s AND status = 'running' AND leased_by = %s AND attempts = %s",
+                    (lease_seconds, json.dumps(progress) if progress is not None else None, job["id"], worker_id, job["attempts"]))
+        owned = cur.rowcount == 1
+        conn.commit()
+        return owned
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def finish_job(conn, job, worker_id, success, result=None, error=None):
+    """
+    Records the outcome of an attempt: succeeded, re-queued with backoff, or
+    failed once attempts are used up. Returns the new status, or None if the
+    lease was lost (the result is then discarded).
+    """
+    retry_seconds = float(os.environ.get('SCRAPE_JOB_RETRY_SECONDS', '30'))
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE scrape_jobs SET "
+                    "status = CASE WHEN %(success)s THEN 'succeeded' WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                    "run_after = CASE WHEN %(success)s THEN run_after ELSE now() + make_interval(secs => %(retry)s * power(2, attempts - 1)) END, "
+                    "finished_at = CASE WHEN %(success)s OR attempts >= max_attempts THEN now() END, "
+                    "result = %(result)s::jsonb, last_error = COALESCE(%(error)s, last_error), "
+                    "leased_by = NULL, lease_expires_at = NULL, updated_at = now() "
+                    "WHERE id = %(id)s AND status = 'running' AND leased_by = %(worker)s AND attempts = %(attempts)s RETURNING status",
+                    {"success": success, "retry": retry_seconds, "result": json.dumps(result) if result is not None else None,
+                     "error": error, "id": job["id"], "worker": worker_id, "attempts": job["attempts"]})
+        row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_job(conn, job_id):
+    cur = conn.cursor()
+    try:
+        cur.execute(GET_JOB_SQL, (job_id,))
+        return _as_job(cur.fetchone())
+    finally:
+        cur.close()
+
+
+def queue_stats(conn):
+    """ {status: job count}, plus the age in seconds of the oldest runnable job. """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT status, COUNT(*) FROM scrape_jobs GROUP BY status")
+        stats = dict(cur.fetchall())
+        cur.execute("SELECT EXTRACT(EPOCH FROM now() - MIN(run_after)) FROM scrape_jobs WHERE status = 'queued' AND run_after <= now()")
+        oldest = cur.fetchone()[0]
+        stats["oldestQueuedSeconds"] = round(float(oldest), 1) if oldest is not None else None
+        return stats
+    finally:
+        cur.close()
+
+
+# --- Worker ---
+class ScrapeWorker:
+    """Claims jobs one at a time and runs them with run_scrape, holding the lease while it runs."""
+
+    def __init__(self, worker_id=None, lease_seconds=None, idle_seconds=None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds or float(os.environ.get('SCRAPE_JOB_LEASE_SECONDS', '120'))
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(os.environ.get('SCRAPE_WORKER_IDLE_SECONDS', '2'))
+        self._stop = threading.Event()
+        self._conn = None
+        self.jobs_run = 0
+
+    def stop(self, *_):
+        """ Finish the current job, then exit (SIGTERM/SIGINT handler). """
+        log.info("Worker stopping after current job", extra={"worker": self.worker_id})
+        self._stop.set()
+
+    def run(self, once=False):
+        """ Drains the queue until stopped (or after one job with once=True). Returns the number of jobs run. """
+        self._conn = get_db_connection()
+        if not self._conn:
+            log.error("Worker cannot start without a database connection")
+            return 0
+        try:
+            create_tables(self._conn)
+            create_job_tables(self._conn)
+            log.info("Worker started", extra={"worker": self.worker_id, "lease_seconds": self.lease_seconds})
+            while not self._stop.is_set():
+                job = None
+                try:
+                    if self._conn or self._reconnect():
+                        job = claim_job(self._conn, self.worker_id, self.lease_seconds)
+                except psycopg2.Error as error:
+                    log.error("Error claiming job: %s", error, extra={"worker": self.worker_id})
+                    self._reconnect()
+                if job is None:
+                    if once:
+                        break
+                    self._stop.wait(self.idle_seconds)
+                    continue
+                self._run_job(job)
+                self.jobs_run += 1
+                if once:
+                    break
+        finally:
+            if self._conn:
+                self._conn.close()
+        log.info("Worker stopped", extra={"worker": self.worker_id, "jobs": self.jobs_run})
+        return self.jobs_run
+
+    def _reconnect(self):
+        """ Replaces the worker's connection after a database error (it may be dead). False if the DB is unreachable. """
+        if self._conn:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = get_db_connection()
+        return bool(self._conn)
+
+    def _run_job(self, job):
+        progress = {"pages": 0, "rows": 0}
+        done = threading.Event()
+        changed = threading.Event()
+        # Jobs have no time budget; losing the lease cancels the scrape before its next request.
+        cancelled = threading.Event()
+
+        def on_page(pages, rows):
+            progress.update(pages=pages, rows=rows)
+            changed.set()
+
+        def keep_lease():
+            # Renew at a third of the lease so one slow round trip can't lose it,
+            # and right after each page so waiting clients see progress promptly.
+            renewed = time.monotonic()
+            while True:
+                changed.wait(self.lease_seconds / 3)
+                changed.clear()
+                if done.is_set():
+                    return
+                try:
+                    if self._conn or self._reconnect():
+                        if not heartbeat(self._conn, job, self.worker_id, self.lease_seconds, dict(progress)):
+                            log.warning("Lease lost; job was reclaimed, cancelling scrape", extra={"job": job["id"], "worker": self.worker_id})
+                            cancelled.set()
+                            return
+                        renewed = time.monotonic()
+                        continue
+                except psycopg2.Error as error:
+                    log.error("Heartbeat failed: %s", error, extra={"job": job["id"]})
+                    if self._reconnect():
+                        changed.set()  # renew right away on the new connection
+                        continue
+                if time.monotonic() - renewed >= self.lease_seconds:
+                    # Unrenewed for a whole lease: another worker may own the job by now.
+                    log.warning("Lease expired without renewal, cancelling scrape", extra={"job": job["id"], "worker": self.worker_id})
+                    cancelled.set()
+                    return
+
+        with correlation_scope(job["correlation_id"]):
+            log.info("Running job", extra={"job": job["id"], "series": job["manga_title"], "attempt": job["attempts"], "worker": self.worker_id})
+            # The heartbeat thread owns the connection until the scrape returns.
+            lease_thread = threading.Thread(target=keep_lease, name=f"lease-{job['id']}", daemon=True)
+            lease_thread.start()
+            started = time.perf_counter()
+            success, error = False, None
+            try:
+                success = run_scrape(job["manga_title"], max_pages=job["max_pages"], min_price=float(job["min_price"]),
+                                     fetch_descriptions=job["fetch_descriptions"], on_page=on_page, cancel=cancelled)
+                if not success:
+                    error = "scrape incomplete (see worker logs)"
+            except Exception as e:
+                log.exception("Job raised: %s", e, extra={"job": job["id"]})
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                done.set()
+                changed.set()
+                lease_thread.join()
+            result = {**progress, "success": success, "seconds": round(time.perf_counter() - started, 3), "worker": self.worker_id}
+            if not (self._conn or self._reconnect()):
+                log.error("Could not record job result: database unreachable", extra={"job": job["id"]})
+                return
+            try:
+                status = finish_job(self._conn, job, self.worker_id, success, result, error)
+            except psycopg2.Error as db_error:
+                # The lease will expire and another worker retries the job.
+                log.error("Could not record job result: %s", db_error, extra={"job": job["id"]})
+                self._reconnect()
+                return
+            log.info("Job finished", extra={"job": job["id"], "status": status, **result})
+
+
+# --- API helper: scrape through the queue ---
+def wait_for_job(conn, job_id, timeout, poll_seconds=1.0, on_progress=None):
+    """
+    Polls until the job succeeds or fails (or timeout). Returns the last seen
+    job dict. on_progress(pages, rows) is called when the job reports progress.
+    """
+    deadline = time.monotonic() + timeout
+    seen = None
+    while True:
+        job = get_job(conn, job_id)
+        # Each poll is its own snapshot.
+        conn.rollback()
+        progress = job and job["progress"]
+        if on_progress and progress and progress != seen:
+            seen = progress
+            on_progress(progress["pages"], progress["rows"])
+        if job is None or job["status"] in ('succeeded', 'failed') or time.monotonic() >= deadline:
+            return job
+        time.sleep(poll_seconds)
+
+
+def queued_execution():
+    return os.environ.get('SCRAPE_EXECUTION', 'inline').lower() == 'queue'
+
+
+def run_scrape_queued(manga_title, max_pages=3, min_price=5, fetch_descriptions=False, timeout=None, on_page=None):
+    """ run_scrape's contract via the worker fleet: enqueue (or join) the series' job and wait for it. """
+    timeout = timeout if timeout is not None else float(os.environ.get('SCRAPE_JOB_WAIT_SECONDS', '300'))
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        create_job_tables(conn)
+        correlation_id = get_correlation_id()
+        job_id = enqueue_job(conn, manga_title, max_pages=max_pages, min_price=min_price, fetch_descriptions=fetch_descriptions,
+                             correlation_id=correlation_id if correlation_id != "-" else None)
+        if job_id is None:
+            return False
+        log.info("Scrape queued", extra={"job": job_id, "series": manga_title})
+        job = wait_for_job(conn, job_id, timeout, on_progress=on_page)
+        if job is None or job["status"] != 'succeeded':
+            log.warning("Queued scrape not finished", extra={"job": job_id, "status": job and job["status"], "timeout": timeout})
+            return False
+        return True
+    except psycopg2.DatabaseError as error:
+        log.error("Error queueing scrape: %s", error, extra={"series": manga_title})
+        return False
+    finally:
+        conn.close()
+
+
+# --- Command-line entry point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape job queue: run a worker, enqueue series, or show queue status.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker_cmd = commands.add_parser("worker", help="Claim and run scrape jobs until stopped")
+    worker_cmd.add_argument("--once", action="store_true", help="Run at most one job, then exit")
+    worker_cmd.add_argument("--lease-seconds", type=float, default=None)
+    enqueue_cmd = commands.add_parser("enqueue", help="Queue scrapes for one or more series")
+    enqueue_cmd.add_argument("titles", nargs="+")
+    enqueue_cmd.add_argument("--max-pages", type=int, default=3)
+    enqueue_cmd.add_argument("--min-price", type=float, default=5)
+    enqueue_cmd.add_argument("--fetch-descriptions", action="store_true")
+    enqueue_cmd.add_argument("--priority", type=int, default=0)
+    commands.add_parser("status", help="Show job counts per status")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        worker = ScrapeWorker(lease_seconds=args.lease_seconds)
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        worker.run(once=args.once)
+        raise SystemExit(0)
+
+    conn = get_db_connection()
+    if not conn:
+        raise SystemExit(1)
+    try:
+        create_job_tables(conn)
+        if args.command == "enqueue":
+            for title in args.titles:
+                job_id = enqueue_job(conn, title, max_pages=args.max_pages, min_price=args.min_price,
+                                     fetch_descriptions=args.fetch_descriptions, priority=args.priority)
+                log.info("Enqueued", extra={"series": title, "job": job_id})
+        else:
+            print(json.dumps(queue_stats(conn), indent=2))
+    finally:
+        conn.close()
@@ -0,0 +1,220 @@
+# === Structured, Non-Blocking Logging for the Scraper and API ===
+# Log records are pushed onto an in-memory queue by the calling thread and
+# written to the real handlers by a background QueueListener, so a slow stdout
+# never stalls the scrape loop or a request thread.
+#
+# Parse pool workers are separate processes: a forked worker inherits the
+# queue handler but not the listener thread, so configure_worker_logging()
+# (the pool initializer) gives each worker its own direct handler, and
+# call_in_correlation_scope() carries the caller's correlation id across.
+
+# --- Standard Libraries ---
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import uuid
+
+# --- Configuration (env) ---
+# LOG_LEVEL        - DEBUG / INFO / WARNING / ERROR (default INFO)
+# LOG_FORMAT       - 'text' (default) or 'json'
+# LOG_SAMPLE_EVERY - keep 1 of every N per-item (sampled) messages (default 20, 1 disables sampling)
+ROOT_LOGGER_NAME = "manga_market"
+
+_correlation_id = contextvars.ContextVar("correlation_id", default="-")
+
+# Attributes present on every LogRecord; anything else was passed via `extra=` and is a structured field.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "correlation_id", "sampled"}
+
+_listener = None
+_worker_configured = False
+_setup_lock = threading.Lock()
+
+
+# --- Correlation IDs ---
+def new_correlation_id():
+    """Returns a short random id suitable for tagging one scrape or request."""
+    return uuid.uuid4().hex[:12]
+
+
+def get_correlation_id():
+    """Returns the correlation id bound to the current context ('-' if none)."""
+    return _correlation_id.get()
+
+
+@contextlib.contextmanager
+def correlation_scope(correlation_id=None):
+    """Binds a correlation id to every log record emitted inside the block."""
+    token = _correlation_id.set(correlation_id or new_correlation_id())
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+def call_in_correlation_scope(correlation_id, fn, *args, **kwargs):
+    """Calls fn with correlation_id bound; lets a process pool task log under its submitter's id."""
+    with correlation_scope(correlation_id if correlation_id != "-" else None):
+        return fn(*args, **kwargs)
+
+
+# --- Filters ---
+class CorrelationIdFilter(logging.Filter):
+    """Stamps the current correlation id onto each record (runs on the calling thread)."""
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 of every `every` records flagged with extra={'sampled': True}.
+
+    Counting is per call site (logger name + message template), so one chatty
+    loop does not starve the sampled messages of another. Warnings and errors
+    are never dropped.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, int(every))
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.every == 1 or not getattr(record, "sampled", False) or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = itertools.count()
+            return next(counter) % self.every == 0
+
+
+# --- Formatters ---
+def _extra_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED_ATTRS and not k.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    """'time LEVEL [logger] cid=... message key=value ...'"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] cid=%(correlation_id)s %(message)s")
+
+    def format(self, record):
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = "-"
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        payload.update(_extra_fields(record))
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+# --- Setup ---
+def _settings(level, fmt, sample_every):
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+    if sample_every is None:
+        sample_every = int(os.environ.get("LOG_SAMPLE_EVERY", "20"))
+    return level, fmt, sample_every
+
+
+def _output_handler(fmt, stream):
+    output_handler = logging.StreamHandler(stream)
+    output_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    return output_handler
+
+
+def _add_filters(handler, sample_every):
+    # Filters run on the emitting thread, before the record is queued or written.
+    handler.addFilter(CorrelationIdFilter())
+    handler.addFilter(SamplingFilter(sample_every))
+
+
+def _install(handler, level):
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(level)
+    root.addHandler(handler)
+    root.propagate = False
+    return root
+
+
+def configure_logging(level=None, fmt=None, sample_every=None, stream=None):
+    """Installs the queue-backed handler on the 'manga_market' logger tree (idempotent)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None or _worker_configured:
+            return logging.getLogger(ROOT_LOGGER_NAME)
+
+        level, fmt, sample_every = _settings(level, fmt, sample_every)
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        _add_filters(queue_handler, sample_every)
+        root = _install(queue_handler, level)
+
+        _listener = logging.handlers.QueueListener(log_queue, _output_handler(fmt, stream), respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return root
+
+
+def configure_worker_logging(level=None, fmt=None, sample_every=None, stream=None):
+    """
+    Process pool initializer: replaces handlers inherited from the parent
+    (whose listener thread doesn't exist in this process) with a direct
+    handler. Workers exit without atexit hooks, so nothing may stay queued.
+    """
+    global _listener, _worker_configured, _setup_lock
+    # The parent's lock may have been held by another thread at fork time.
+    _setup_lock = threading.Lock()
+    with _setup_lock:
+        _listener = None
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        level, fmt, sample_every = _settings(level, fmt, sample_every)
+        output_handler = _output_handler(fmt, stream)
+        _add_filters(output_handler, sample_every)
+        _install(output_handler, level)
+        _worker_configured = True
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the background writer."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """Returns a child of the 'manga_market' logger, configuring logging on first use."""
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
@@ -0,0 +1,346 @@
+# === Producer/Consumer Scrape Pipeline ===
+# run_scrape's work split into three stages joined by bounded queues:
+#
+#   fetch (thread, network)  ->  parse (process pool, CPU)  ->  write (thread, enrichment + batched DB)
+#
+# The fetch stage can pull the next page while earlier pages are parsed in
+# other processes, and parse does not wait for the DB. Bounded queues provide
+# backpressure: a slow writer stalls parsing, which stalls fetching, instead of
+# buffering whole scrapes in memory. The stages are generic callables; the
+# scraper module supplies the concrete fetch/parse/enrich/write functions.
+#
+# If a pool process dies (OOM kill, crash in lxml) the shared pool is broken
+# for good; the parse stage then replaces it and retries the affected pages
+# once. In a profiled request pages are parsed on the parse thread instead,
+# since the profiler can't see into the pool's processes.
+
+# --- Standard Libraries ---
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import contextvars
+import os
+import queue
+import threading
+import time
+
+# --- Logging / Stats ---
+from parse_memo import merge_counts
+from request_profiling import profiled_thread, profiling_active
+from scrape_logging import call_in_correlation_scope, configure_worker_logging, get_correlation_id, get_logger
+
+log = get_logger("pipeline")
+
+# --- Configuration (env) ---
+# SCRAPE_PARSE_WORKERS - processes in the shared parse pool (default: CPU count)
+# SCRAPE_QUEUE_SIZE    - max pages/batches buffered between stages (default 2)
+# SCRAPE_BATCH_SIZE    - max rows per DB write batch (default 100)
+
+_SENTINEL = object()
+# Returned by fetch_page to end the scrape early without failing it (e.g. time budget spent).
+END_OF_PAGES = object()
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """Process pool shared by all scrapes in this process (created on first use)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            workers = int(os.environ.get('SCRAPE_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+            # Workers get their own log handler; inherited queue handlers have no listener in the child.
+            _parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=configure_worker_logging)
+        return _parse_pool
+
+
+def reset_parse_pool(broken):
+    """
+    Drops the shared pool if it is still `broken` (a worker process died), so
+    the next get_parse_pool() starts a fresh one. Returns that fresh pool.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is broken:
+            _parse_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+    return get_parse_pool()
+
+
+class _InlinePool:
+    """Runs parse jobs on the calling thread (used while profiling)."""
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=True, cancel_futures=True)
+            _parse_pool = None
+
+
+class StageCounter:
+    """Throughput counters for one stage (thread-safe)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.units = 0          # pages for fetch/parse, rows for write
+        self.busy_seconds = 0.0  # time spent doing the stage's own work (excludes queue waits)
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, units, seconds):
+        with self._lock:
+            self.units += units
+            self.busy_seconds += seconds
+
+    def observe_queue(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def snapshot(self):
+        rate = self.units / self.busy_seconds if self.busy_seconds else 0.0
+        return {
+            "units": self.units,
+            "busySeconds": round(self.busy_seconds, 3),
+            "unitsPerSecond": round(rate, 2),
+            "maxQueueDepth": self.max_queue_depth,
+        }
+
+
+class ScrapePipeline:
+    """
+    Runs fetch -> parse -> write for pages 1..max_pages.
+
+    fetch_page(page_num)      -> html, None on a fatal fetch error (stops the scrape, success=False),
+                                 or END_OF_PAGES to stop cleanly
+    parse_page(html)          -> (listings_found, candidates[, parse memo counts]); must be picklable
+                                 (runs in the process pool); the counts are summed into parse_stats
+    enrich_item(candidate)    -> item to write, or None to drop it (runs on the writer thread)
+    write_batch(items)        -> number of rows written
+    page_delay()              -> politeness pause between page fetches (optional)
+    on_page(pages, rows)      -> progress report after each written page (optional, writer thread)
+
+    Instead of fetch_page, a `page_source` iterable of (page_key, payload) may be
+    given (e.g. results of an Oxylabs batch, in completion order); each payload
+    is handed to parse_page as-is and max_pages is ignored.
+    """
+
+    def __init__(self, fetch_page, parse_page, enrich_item, write_batch, max_pages,
+                 page_delay=None, parse_pool=None, queue_size=None, batch_size=None, parse_concurrency=None,
+                 page_source=None, on_page=None):
+        self.fetch_page = fetch_page
+        self.page_source = page_source
+        self.on_page = on_page
+        self.parse_page = parse_page
+        self.enrich_item = enrich_item
+        self.write_batch = write_batch
+        self.max_pages = max_pages
+        self.page_delay = page_delay
+        self.parse_pool = parse_pool
+        self.parse_concurrency = parse_concurrency or int(os.environ.get('SCRAPE_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+        queue_size = queue_size or int(os.environ.get('SCRAPE_QUEUE_SIZE', '2'))
+        self.batch_size = batch_size or int(os.environ.get('SCRAPE_BATCH_SIZE', '100'))
+
+        self.parse_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.counters = {name: StageCounter(name) for name in ("fetch", "parse", "write")}
+        self.pages_done = 0
+        self.rows_written = 0
+        self.parse_stats = {}
+        self.success = True
+        self._stop = threading.Event()   # no more pages wanted (end of results)
+        self._abort = threading.Event()  # a stage failed; drain and exit
+
+    # --- Queue helpers (never block forever once the pipeline is aborting) ---
+    def _put(self, q, item, counter):
+        while True:
+            try:
+                q.put(item, timeout=0.5)
+                counter.observe_queue(q.qsize())
+                return
+            except queue.Full:
+                if self._abort.is_set() and item is not _SENTINEL:
+                    return
+
+    def _fail(self, stage_name, error):
+        log.exception("Pipeline stage '%s' failed: %s", stage_name, error)
+        self.success = False
+        self._abort.set()
+
+    # --- Stages ---
+    def _fetch_stage(self):
+        if self.page_source is not None:
+            return self._source_stage()
+        counter = self.counters["fetch"]
+        try:
+            for page_num in range(1, self.max_pages + 1):
+                if self._stop.is_set() or self._abort.is_set():
+                    break
+                started = time.perf_counter()
+                html = self.fetch_page(page_num)
+                if html is END_OF_PAGES:
+                    break
+                counter.record(1, time.perf_counter() - started)
+                if html is None:
+                    self.success = False
+                    break
+                self._put(self.parse_queue, (page_num, html), self.counters["parse"])
+                if self.page_delay and page_num < self.max_pages:
+                    self.page_delay()
+        except Exception as error:
+            self._fail("fetch", error)
+        finally:
+            self._put(self.parse_queue, _SENTINEL, self.counters["parse"])
+
+    def _source_stage(self):
+        counter = self.counters["fetch"]
+        try:
+            started = time.perf_counter()
+            for page_key, payload in self.page_source:
+                counter.record(1, time.perf_counter() - started)
+                if self._abort.is_set():
+                    break
+                if payload is None:
+                    # A failed page in a batch is reported, not fatal to the other pages.
+                    self.success = False
+                else:
+                    self._put(self.parse_queue, (page_key, payload), self.counters["parse"])
+                started = time.perf_counter()
+        except Exception as error:
+            self._fail("fetch", error)
+        finally:
+            self._put(self.parse_queue, _SENTINEL, self.counters["parse"])
+
+    def _parse_stage(self):
+        counter = self.counters["parse"]
+        pool = self.parse_pool or (_InlinePool() if profiling_active() else get_parse_pool())
+        inflight = collections.deque()
+
+        def submit(html):
+            nonlocal pool
+            try:
+                return pool, pool.submit(call_in_correlation_scope, get_correlation_id(), self.parse_page, html)
+            except concurrent.futures.process.BrokenProcessPool:
+                if self.parse_pool is not None:
+                    raise  # only the shared pool is ours to replace
+                pool = reset_parse_pool(pool)
+                return pool, pool.submit(call_in_correlation_scope, get_correlation_id(), self.parse_page, html)
+
+        def result(page_num, html, used_pool, future):
+            nonlocal pool
+            try:
+                return future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                if self.parse_pool is not None:
+                    raise
+                log.warning("Parse pool broken, retrying page on a fresh pool", extra={"page": page_num})
+                if pool is used_pool:
+                    pool = reset_parse_pool(used_pool)
+                # Retried once; a second failure fails the stage.
+                return pool.submit(call_in_correlation_scope, get_correlation_id(), self.parse_page, html).result()
+
+        def drain(limit):
+            # Hand parsed pages to the writer in page order, waiting only while more than `limit` are in flight.
+            while inflight and (len(inflight) > limit or inflight[0][3].done()):
+                page_num, html, used_pool, future, submitted = inflight.popleft()
+                listings_found, candidates, *memo_counts = result(page_num, html, used_pool, future)
+                counter.record(1, time.perf_counter() - submitted)
+                if memo_counts:
+                    merge_counts(self.parse_stats, memo_counts[0])
+                if not listings_found:
+                    log.info("No listings found, stopping", extra={"page": page_num})
+                    self._stop.set()
+                    continue
+                self._put(self.write_queue, (page_num, candidates), self.counters["write"])
+
+        seen_sentinel = False
+        try:
+            while True:
+                item = self.parse_queue.get()
+                if item is _SENTINEL:
+                    seen_sentinel = True
+                    break
+                if self._abort.is_set():
+                    continue
+                page_num, html = item
+                inflight.append((page_num, html, *submit(html), time.perf_counter()))
+                drain(limit=self.parse_concurrency - 1)
+            drain(limit=0)
+        except Exception as error:
+            self._fail("parse", error)
+            # Keep consuming so the fetch stage can finish.
+            while not seen_sentinel:
+                seen_sentinel = self.parse_queue.get() is _SENTINEL
+        finally:
+            self._put(self.write_queue, _SENTINEL, self.counters["write"])
+
+    def _write_stage(self):
+        counter = self.counters["write"]
+        seen_sentinel = False
+        try:
+            while True:
+                item = self.write_queue.get()
+                if item is _SENTINEL:
+                    seen_sentinel = True
+                    break
+                if self._abort.is_set():
+                    continue
+                page_num, candidates = item
+                started = time.perf_counter()
+                batch, page_rows = [], 0
+                for candidate in candidates:
+                    enriched = self.enrich_item(candidate)
+                    if enriched is None:
+                        continue
+                    batch.append(enriched)
+                    if len(batch) >= self.batch_size:
+                        page_rows += self.write_batch(batch)
+                        batch = []
+                if batch:
+                    page_rows += self.write_batch(batch)
+                counter.record(page_rows, time.perf_counter() - started)
+                self.rows_written += page_rows
+                self.pages_done += 1
+                log.info("Finished page", extra={"page": page_num, "inserted": page_rows})
+                if self.on_page:
+                    self.on_page(self.pages_done, self.rows_written)
+        except Exception as error:
+            self._fail("write", error)
+            while not seen_sentinel:
+                seen_sentinel = self.write_queue.get() is _SENTINEL
+
+    def run(self):
+        """Runs all stages to completion. Returns True if no stage failed."""
+        started = time.perf_counter()
+        # Each stage thread runs in a copy of the caller's context so correlation ids
+        # and profiling stage() markers carry over; a profiled request also profiles the stages.
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(profiled_thread(target),), name=f"scrape-{name}", daemon=True)
+            for name, target in (("fetch", self._fetch_stage), ("parse", self._parse_stage), ("write", self._write_stage))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.info("Pipeline finished", extra={
+            "seconds": round(time.perf_counter() - started, 3),
+            "pages": self.pages_done,
+            "rows": self.rows_written,
+            "stats": self.stats(),
+        })
+        return self.success
+
+    def stats(self):
+        stats = {name: counter.snapshot() for name, counter in self.counters.items()}
+        if self.parse_stats:
+            stats["parse"]["memo"] = dict(self.parse_stats)
+        return stats
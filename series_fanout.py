@@ -0,0 +1,101 @@
+# === Shared Search Fan-out ===
+# A search for one series returns plenty of valid single-series sales of
+# *other* series we track (a "Naruto" search surfaces Boruto volumes, a broad
+# "manga english" search surfaces everything). Those used to be classified
+# against the searched title and dropped. In fan-out mode each parsed listing
+# is routed through the tracked-series dictionary (the series registry's
+# aliases) and filed under the one series it names, so one search populates
+# many series and fewer Oxylabs calls are needed per refreshed series.
+#
+#   * Aliases are matched on word boundaries, longest first, ignoring a plural
+#     "s" ("Naruto Next Generation" matches "... Next Generations"). An alias
+#     mention inside a longer matched alias ("naruto" in "boruto naruto next
+#     generations") belongs to the longer one.
+#   * A title naming two or more tracked series in separate mentions is a
+#     mixed lot and is dropped ("Naruto 1-72 ... Boruto 1-18").
+#   * Aliases that can't identify a series on their own ("manga", "vol 1";
+#     see series_registry.is_trackable_name) are ignored.
+#   * A title naming none falls back to the searched series (the old
+#     behaviour), or is dropped in a broad, series-less search.
+#
+# Run a broad sweep with:  python series_fanout.py "manga english" --max-pages 5
+
+# --- Standard Libraries ---
+import argparse
+import re
+
+# --- Series Identity ---
+from series_registry import is_trackable_name
+
+
+def _tokens(text):
+    # Plural-insensitive, so near-miss spellings of a long alias still match as one mention.
+    return [token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token
+            for token in re.findall(r'[a-z0-9]+', text.lower())]
+
+
+class SeriesRouter:
+    """Listing title -> tracked series name. Plain data only, so it pickles into the parse pool."""
+
+    def __init__(self, aliases, names):
+        """ aliases: {alias_key: series_id}; names: {series_id: canonical_name}. """
+        self.names = dict(names)
+        self._by_first = {}
+        for alias_key, series_id in aliases.items():
+            tokens = tuple(_tokens(alias_key))
+            if tokens and series_id in self.names and is_trackable_name(alias_key):
+                self._by_first.setdefault(tokens[0], []).append((tokens, series_id))
+        for candidates in self._by_first.values():
+            candidates.sort(key=lambda candidate: len(candidate[0]), reverse=True)
+
+    def __len__(self):
+        return len(self.names)
+
+    def mentions(self, title):
+        """ [(start, end, series_id)] token spans of tracked aliases in the title, longest match per start. """
+        tokens = _tokens(title)
+        spans = []
+        for start, token in enumerate(tokens):
+            for alias_tokens, series_id in self._by_first.get(token, ()):
+                end = start + len(alias_tokens)
+                if tuple(tokens[start:end]) == alias_tokens:
+                    spans.append((start, end, series_id))
+                    break
+        # Drop aliases that sit inside a longer matched alias.
+        return [span for span in spans
+                if not any(other[0] <= span[0] and span[1] <= other[1] and other[1] - other[0] > span[1] - span[0] for other in spans)]
+
+    def series_named(self, title):
+        """ Distinct tracked series the title names (more than one: a mixed lot). """
+        return {series_id for _, _, series_id in self.mentions(title)}
+
+    def route(self, title):
+        """ Canonical name of the single tracked series the title names, else None (none, or a mixed lot). """
+        series_ids = self.series_named(title)
+        return self.names[series_ids.pop()] if len(series_ids) == 1 else None
+
+
+def listing_series(router, title, manga_title):
+    """ Series a parsed listing is filed under, or None to drop it. """
+    if router is None:
+        return manga_title
+    series_ids = router.series_named(title)
+    if len(series_ids) > 1:
+        return None
+    return router.names[series_ids.pop()] if series_ids else manga_title
+
+
+# --- Command-line entry point for broad sweeps ---
+if __name__ == "__main__":
+    from manga_scraper_logic import run_fanout_scrape
+    from scrape_logging import correlation_scope
+
+    parser = argparse.ArgumentParser(description="Run one broad search and file its listings under every tracked series.")
+    parser.add_argument("query", help='Search terms, e.g. "manga english"')
+    parser.add_argument("--max-pages", type=int, default=3)
+    parser.add_argument("--min-price", type=float, default=5)
+    parser.add_argument("--fetch-descriptions", action="store_true")
+    args = parser.parse_args()
+    with correlation_scope():
+        ok = run_fanout_scrape(args.query, max_pages=args.max_pages, min_price=args.min_price, fetch_descriptions=args.fetch_descriptions)
+    raise SystemExit(0 if ok else 1)
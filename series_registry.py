@@ -0,0 +1,332 @@
+# === Canonical Series Registry ===
+# Series identity used to be a substring of the free-text title, matched with
+# ILIKE on every query ("Naruto" also matched "Boruto: Naruto Next
+# Generations"). Now every series has a row in `series`, every spelling of it
+# an entry in `series_aliases`, and each listing a `series_id` resolved once at
+# ingest. Price queries become an indexed equality lookup on series_id.
+#
+# At ingest a listing goes to the most specific known series named in its
+# title: a Boruto listing returned by a "Naruto" search is filed under Boruto
+# if Boruto is a known series, not under Naruto.
+#
+# Series are never registered straight from request input. A searched name
+# becomes a series only once a scrape for it stores listings that name it
+# (and the name isn't just generic words like "manga" or "english"), or
+# through the CLI below.
+
+# --- Standard Libraries ---
+import argparse
+import re
+import threading
+
+# --- Database Library ---
+import psycopg2
+
+# --- Shared Helpers ---
+from price_sketch import rebuild_series_sketch, series_key
+from scrape_logging import get_logger
+
+log = get_logger("series")
+
+SERIES_SCHEMA_COMMANDS = (
+    """CREATE TABLE IF NOT EXISTS series (id SERIAL PRIMARY KEY, canonical_name VARCHAR(500) NOT NULL, series_key VARCHAR(500) UNIQUE NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS series_aliases (alias_key VARCHAR(500) PRIMARY KEY, series_id INTEGER NOT NULL REFERENCES series(id) ON DELETE CASCADE)""",
+    """ALTER TABLE manga_listings ADD COLUMN IF NOT EXISTS series_id INTEGER REFERENCES series(id)""",
+    """CREATE INDEX IF NOT EXISTS idx_manga_listings_series ON manga_listings (series_id, format, date_sold)""",
+)
+
+BACKFILL_BATCH = 5000
+# Listing-title words that never identify a series on their own.
+GENERIC_WORDS = frozenset((
+    'a', 'an', 'and', 'the', 'of', 'in', 'to', 'for', 'with', 'by', 'my',
+    'manga', 'mangas', 'comic', 'comics', 'anime', 'english', 'japanese', 'book', 'books', 'novel', 'novels', 'graphic',
+    'vol', 'vols', 'volume', 'volumes', 'lot', 'lots', 'set', 'sets', 'box', 'bundle', 'collection', 'complete',
+    'series', 'edition', 'omnibus', 'deluxe', 'new', 'used', 'paperback', 'hardcover',
+))
+
+
+class SeriesCache:
+    """Process-wide alias_key -> series_id map (aliases are only ever added)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.aliases = {}
+        self.loaded = False
+
+    def get(self, key):
+        with self._lock:
+            return self.aliases.get(key)
+
+    def update(self, mapping):
+        with self._lock:
+            self.aliases.update(mapping)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.aliases)
+
+
+_cache = SeriesCache()
+
+
+def remember_series(aliases, loaded=False):
+    """ Adds alias_key -> series_id pairs to the process cache (used by the async client). """
+    _cache.update(aliases)
+    if loaded:
+        _cache.loaded = True
+
+
+def _load_aliases(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT alias_key, series_id FROM series_aliases")
+        remember_series(dict(cur.fetchall()), loaded=True)
+    finally:
+        cur.close()
+
+
+def tracked_series(conn):
+    """ ({alias_key: series_id}, {series_id: canonical_name}) for every registered series. """
+    _load_aliases(conn)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, canonical_name FROM series")
+        names = dict(cur.fetchall())
+    finally:
+        cur.close()
+    return _cache.snapshot(), names
+
+
+def is_trackable_name(name):
+    """ False for names that can't identify a series: too short, or only numbers and generic listing words ("manga", "vol 1"). """
+    words = re.findall(r'[a-z0-9]+', (name or '').lower())
+    return len(''.join(words)) >= 3 and any(word not in GENERIC_WORDS and not word.isdigit() for word in words)
+
+
+def names_series(title, key):
+    """ True if a listing title names the series key as whole words. """
+    return re.search(r'(?<![a-z0-9])' + re.escape(key) + r'(?![a-z0-9])', series_key(title)) is not None
+
+
+def series_match(conn, name):
+    """
+    (SQL predicate, params) selecting a series' listings: series_id equality
+    for a registered series, the legacy title ILIKE otherwise.
+    """
+    series_id = lookup_series_id(conn, name)
+    if series_id is not None:
+        return "series_id = %s", [series_id]
+    return "title ILIKE %s", [f'%{name}%']
+
+
+def lookup_series_id(conn, name):
+    """ series_id for a name or alias, or None if the series is unknown. """
+    key = series_key(name)
+    series_id = _cache.get(key)
+    if series_id is not None or not conn:
+        return series_id
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT series_id FROM series_aliases WHERE alias_key = %s", (key,))
+        row = cur.fetchone()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("Error looking up series: %s", error, extra={"series": key})
+        conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+    if row:
+        _cache.update({key: row[0]})
+        return row[0]
+    return None
+
+
+def resolve_series(conn, name, backfill=True):
+    """
+    series_id for a name, registering the series (and its name as an alias) if
+    it is new. A new series is backfilled from already stored listings.
+    """
+    series_id = lookup_series_id(conn, name)
+    if series_id is not None or not conn:
+        return series_id
+    key = series_key(name)
+    cur = None
+    try:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO series (canonical_name, series_key) VALUES (%s, %s) ON CONFLICT (series_key) DO NOTHING", (name.strip(), key))
+        cur.execute("SELECT id FROM series WHERE series_key = %s", (key,))
+        series_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO series_aliases (alias_key, series_id) VALUES (%s, %s) ON CONFLICT (alias_key) DO NOTHING", (key, series_id))
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("Error registering series: %s", error, extra={"series": key})
+        conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+    _cache.update({key: series_id})
+    log.info("Registered series", extra={"series": key, "series_id": series_id})
+    if backfill:
+        backfill_series(conn, series_id)
+    return series_id
+
+
+def add_alias(conn, series_id, alias):
+    """ Maps another spelling to an existing series. """
+    key = series_key(alias)
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO series_aliases (alias_key, series_id) VALUES (%s, %s) ON CONFLICT (alias_key) DO UPDATE SET series_id = EXCLUDED.series_id", (key, series_id))
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError):
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    _cache.update({key: series_id})
+
+
+def more_specific_aliases(conn, series_id, own=None):
+    """
+    Known aliases of *other* series that contain one of this series' aliases
+    ("boruto: naruto ..." for "naruto"). `own` gives the alias keys of a
+    series that isn't registered (yet).
+    """
+    if not _cache.loaded and conn:
+        _load_aliases(conn)
+    aliases = _cache.snapshot()
+    own = own if own is not None else [key for key, sid in aliases.items() if sid == series_id]
+    return {key: sid for key, sid in aliases.items() if sid != series_id and any(o in key and o != key for o in own)}
+
+
+def less_specific_series(series_id):
+    """ Series whose aliases are contained in one of this series' aliases ("naruto" for "boruto: naruto ..."). """
+    aliases = _cache.snapshot()
+    own = [key for key, sid in aliases.items() if sid == series_id]
+    return sorted({sid for key, sid in aliases.items() if sid != series_id and any(key in o and key != o for o in own)})
+
+
+def series_for_title(title, series_id, specific):
+    """ The series a listing title belongs to: the most specific matching alias, else the requested series. """
+    normalized = series_key(title)
+    best = None
+    for key, sid in specific.items():
+        if key in normalized and (best is None or len(key) > len(best[0])):
+            best = (key, sid)
+    return best[1] if best else series_id
+
+
+def should_register(manga_title, items):
+    """
+    True if a batch scraped for an unregistered name is evidence of a real
+    series: the name isn't generic and at least one listing names it without
+    being filed under another (more specific) series.
+    """
+    key = series_key(manga_title)
+    return is_trackable_name(manga_title) and any(
+        item_data.get('series_id') is None and names_series(item_data['title'], key) for item_data in items)
+
+
+def tag_series(items, series_id, specific):
+    for item_data in items:
+        item_data['series_id'] = series_for_title(item_data['title'], series_id, specific) if specific else series_id
+
+
+def assign_series(conn, items, manga_title):
+    """
+    Sets item_data['series_id'] on a batch of listings scraped for
+    manga_title. An unregistered name is registered only if the batch names
+    it (should_register); until then its listings keep series_id NULL, unless
+    they belong to a more specific known series.
+    """
+    series_id = lookup_series_id(conn, manga_title)
+    if series_id is None:
+        tag_series(items, None, more_specific_aliases(conn, None, own=[series_key(manga_title)]))
+        if not should_register(manga_title, items):
+            return None
+        series_id = resolve_series(conn, manga_title)
+        if series_id is None:
+            return None
+    tag_series(items, series_id, more_specific_aliases(conn, series_id))
+    return series_id
+
+
+def backfill_params(series_id):
+    """ (series patterns, excluded patterns, reclaimable series ids) for a backfill batch. """
+    own = [key for key, sid in _cache.snapshot().items() if sid == series_id]
+    patterns = [f'%{key}%' for key in own]
+    excluded = [f'%{key}%' for key in more_specific_aliases(None, series_id)] or ['']
+    # -1 never matches a real id; keeps the array non-empty.
+    reclaim = less_specific_series(series_id) or [-1]
+    return patterns, excluded, reclaim
+
+
+def backfill_series(conn, series_id):
+    """
+    Tags stored listings of a series that predate the registry (or were filed
+    under a less specific series, e.g. Boruto rows under Naruto), in batches so
+    live inserts aren't blocked. Titles naming a more specific known series are
+    skipped. The sketches of the series and of those it took rows from are rebuilt.
+    """
+    if not _cache.loaded:
+        _load_aliases(conn)
+    patterns, excluded, reclaim = backfill_params(series_id)
+    if not patterns:
+        return 0
+    total = 0
+    cur = None
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute("UPDATE manga_listings SET series_id = %s WHERE (id, date_sold) IN ("
+                        " SELECT id, date_sold FROM manga_listings WHERE (series_id IS NULL OR series_id = ANY(%s)) AND lower(title) LIKE ANY(%s)"
+                        " AND NOT lower(title) LIKE ANY(%s) LIMIT %s)",
+                        (series_id, reclaim, patterns, excluded, BACKFILL_BATCH))
+            updated = cur.rowcount
+            conn.commit()
+            total += updated
+            if updated < BACKFILL_BATCH:
+                break
+    except (Exception, psycopg2.DatabaseError) as error:
+        log.error("Error backfilling series: %s", error, extra={"series_id": series_id})
+        conn.rollback()
+    finally:
+        if cur:
+            cur.close()
+    if total:
+        log.info("Backfilled listings", extra={"series_id": series_id, "rows": total})
+        for affected in sketch_series_after_backfill(series_id, reclaim):
+            rebuild_series_sketch(conn, None, series_id=affected)
+    return total
+
+
+def sketch_series_after_backfill(series_id, reclaim):
+    """ Series whose price sketch a backfill made stale: the series itself and those it may have taken rows from. """
+    return [series_id] + [sid for sid in reclaim if sid != -1]
+
+
+# --- Command-line entry point ---
+if __name__ == "__main__":
+    from manga_scraper_logic import create_tables, get_db_connection
+
+    parser = argparse.ArgumentParser(description="Register series/aliases and backfill listings' series_id.")
+    parser.add_argument("title", help="Canonical series name")
+    parser.add_argument("--alias", action="append", default=[], help="Alternative spelling (repeatable)")
+    args = parser.parse_args()
+    conn = get_db_connection()
+    if not conn:
+        raise SystemExit(1)
+    try:
+        create_tables(conn)
+        series_id = resolve_series(conn, args.title, backfill=False)
+        if series_id is None:
+            raise SystemExit(1)
+        for alias in args.alias:
+            add_alias(conn, series_id, alias)
+        rows = backfill_series(conn, series_id)
+        log.info("Series ready", extra={"series_id": series_id, "aliases": len(args.alias) + 1, "backfilled": rows})
+    finally:
+        conn.close()
@@ -0,0 +1,304 @@
+# === Series Autocomplete Index ===
+# In-process index behind /api/series/suggest. A typo in seriesName used to
+# cost a full scrape and a 404; the frontend can now offer known series first.
+#
+#   * Prefix map: every prefix (up to MAX_PREFIX chars) of every word of every
+#     name -> entry ids, so typing "chain" finds "Chainsaw Man" in one dict hit.
+#   * Trigram map: character trigrams -> series ids, for typos ("narto").
+#   * Ranked prefix lists: a prefix's ids in suggestion order (capped at
+#     SUGGEST_SCAN_LIMIT), computed on first use and dropped when an entry
+#     under the prefix changes, so a query never scores every match of "a".
+#
+# Entries are canonical series names and aliases (ranked by listing count) and
+# recent distinct listing titles (ranked lower; past SUGGEST_MAX_TITLES the
+# least recently seen title is evicted). The index is built from the DB in the
+# background, then kept current incrementally: record_listings() reports new
+# listings directly, and a periodic delta query picks up rows written by other
+# processes (only series/listings with ids above the last seen ones). Series
+# weights are recounted in full every SUGGEST_REWEIGH_SECONDS, since the delta
+# never revisits a series' listing count. After a failed refresh (e.g. the DB
+# is down) the next attempt waits SUGGEST_RETRY_SECONDS, and only one refresh
+# runs at a time, so suggest traffic doesn't turn into connection attempts.
+
+# --- Standard Libraries ---
+import heapq
+import os
+from collections import OrderedDict
+import re
+import threading
+import time
+
+# --- Logging ---
+from scrape_logging import get_logger
+
+log = get_logger("suggest")
+
+# --- Configuration (env) ---
+# SUGGEST_MAX_TITLES      - distinct listing titles indexed (default 20000)
+# SUGGEST_REFRESH_SECONDS - how often the DB delta is pulled (default 300)
+# SUGGEST_REWEIGH_SECONDS - how often series listing counts are recounted (default 3600)
+# SUGGEST_RETRY_SECONDS   - wait after a failed refresh before the next attempt (default 30)
+# SUGGEST_SCAN_LIMIT      - most matches of one prefix a query looks at (default 1000)
+MAX_PREFIX = 12
+KIND_RANK = {"series": 0, "title": 1}
+
+SERIES_ROWS_QUERY = "SELECT s.id, s.canonical_name, a.alias_key, COUNT(m.id) FROM series s JOIN series_aliases a ON a.series_id = s.id LEFT JOIN manga_listings m ON m.series_id = s.id WHERE s.id > %s GROUP BY s.id, s.canonical_name, a.alias_key"
+TITLE_ROWS_QUERY = "SELECT MAX(id), title FROM manga_listings WHERE id > %s GROUP BY title ORDER BY MAX(id) DESC LIMIT %s"
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', re.sub(r'[^a-z0-9]+', ' ', text.lower())).strip()
+
+
+def _prefixes(normalized):
+    """ Every word prefix (up to MAX_PREFIX chars) a normalized name is indexed under. """
+    return {word[:length] for word in normalized.split() for length in range(1, min(len(word), MAX_PREFIX) + 1)}
+
+
+def _trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestIndex:
+    """Prefix + trigram index over series names and listing titles (thread-safe)."""
+
+    def __init__(self, max_titles=None, scan_limit=None):
+        self.max_titles = max_titles if max_titles is not None else int(os.environ.get('SUGGEST_MAX_TITLES', '20000'))
+        self.scan_limit = scan_limit if scan_limit is not None else int(os.environ.get('SUGGEST_SCAN_LIMIT', '1000'))
+        self._lock = threading.RLock()
+        self._entries = {}          # id -> {"name", "kind", "weight", "normalized", "trigrams"}
+        self._next_id = 0
+        self._by_key = {}           # (kind, normalized) -> id
+        self._prefixes = {kind: {} for kind in KIND_RANK}   # kind -> prefix -> set(ids)
+        self._grams = {kind: {} for kind in KIND_RANK}      # kind -> trigram -> set(ids)
+        self._ranked = {kind: {} for kind in KIND_RANK}     # kind -> prefix -> [ids] best first
+        self._titles = OrderedDict()                        # title ids, least recently seen first
+        self.last_series_id = 0
+        self.last_listing_id = 0
+        self.built_at = None
+        self.reweighed_at = None
+        self.failed_at = None
+
+    # --- Updates ---
+    def add(self, name, kind="series", weight=1):
+        """ Adds an entry or increases its weight (a title also counts as seen again). """
+        normalized = _normalize(name)
+        if not normalized:
+            return
+        with self._lock:
+            entry_id = self._by_key.get((kind, normalized))
+            if entry_id is not None:
+                if kind == "title":
+                    self._titles.move_to_end(entry_id)
+                if weight:
+                    self._set_weight(entry_id, self._entries[entry_id]["weight"] + weight)
+                return
+            if kind == "title":
+                while self._titles and len(self._titles) >= self.max_titles:
+                    self._remove(next(iter(self._titles)))
+                if self.max_titles <= 0:
+                    return
+            entry_id = self._next_id
+            self._next_id += 1
+            grams = _trigrams(normalized)
+            self._entries[entry_id] = {"name": name.strip(), "kind": kind, "weight": weight, "normalized": normalized, "trigrams": len(grams)}
+            self._by_key[(kind, normalized)] = entry_id
+            if kind == "title":
+                self._titles[entry_id] = None
+            for prefix in _prefixes(normalized):
+                self._prefixes[kind].setdefault(prefix, set()).add(entry_id)
+                self._ranked[kind].pop(prefix, None)
+            for gram in grams:
+                self._grams[kind].setdefault(gram, set()).add(entry_id)
+
+    def _set_weight(self, entry_id, weight):
+        entry = self._entries[entry_id]
+        if entry["weight"] != weight:
+            entry["weight"] = weight
+            for prefix in _prefixes(entry["normalized"]):
+                self._ranked[entry["kind"]].pop(prefix, None)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        kind = entry["kind"]
+        del self._by_key[(kind, entry["normalized"])]
+        self._titles.pop(entry_id, None)
+        for prefix in _prefixes(entry["normalized"]):
+            ids = self._prefixes[kind][prefix]
+            ids.discard(entry_id)
+            if not ids:
+                del self._prefixes[kind][prefix]
+            self._ranked[kind].pop(prefix, None)
+        for gram in _trigrams(entry["normalized"]):
+            ids = self._grams[kind][gram]
+            ids.discard(entry_id)
+            if not ids:
+                del self._grams[kind][gram]
+
+    def observe_listings(self, manga_title, titles, new_rows):
+        """ Incremental update from an ingest batch: its titles, and new_rows more listings for the series (None: not a series). """
+        with self._lock:
+            if manga_title:
+                self.add(manga_title, "series", new_rows)
+            for title in titles:
+                self.add(title, "title", 0)
+
+    def series_rows_after(self):
+        """ Series id the next SERIES_ROWS_QUERY starts after: the last seen one, or 0 when weights are due a recount. """
+        return 0 if self.reweigh_due() else self.last_series_id
+
+    def apply_rows(self, series_rows, title_rows, recount=False):
+        """
+        Loads DB rows: series_rows (id, canonical_name, alias_key, listings), title_rows (listing id, title).
+        With recount (series_rows cover every series) listing counts replace the weights instead of raising them.
+        """
+        with self._lock:
+            for series_id, canonical_name, alias_key, listings in series_rows:
+                self.add(canonical_name, "series", 0)
+                if _normalize(alias_key) != _normalize(canonical_name):
+                    self.add(alias_key, "series", 0)
+                # Weight = listings, counted once per series (on its canonical name).
+                entry_id = self._by_key.get(("series", _normalize(canonical_name)))
+                if entry_id is not None:
+                    weight = int(listings) if recount else max(self._entries[entry_id]["weight"], int(listings))
+                    self._set_weight(entry_id, weight)
+            # Oldest first, so the newest titles are the last to be evicted.
+            for listing_id, title in sorted(title_rows):
+                self.add(title, "title")
+            if series_rows:
+                self.last_series_id = max(self.last_series_id, max(row[0] for row in series_rows))
+            if title_rows:
+                self.last_listing_id = max(self.last_listing_id, max(row[0] for row in title_rows))
+            self.built_at = time.monotonic()
+            self.failed_at = None
+            if recount:
+                self.reweighed_at = self.built_at
+
+    # --- Queries ---
+    def _ranked_ids(self, kind, prefix):
+        """ Up to scan_limit ids under a prefix, in suggestion order for a one-word query (cached). """
+        ranked = self._ranked[kind].get(prefix)
+        if ranked is None:
+            entries = self._entries
+            ranked = heapq.nsmallest(self.scan_limit, self._prefixes[kind].get(prefix, ()),
+                                     key=lambda entry_id: (not entries[entry_id]["normalized"].startswith(prefix), -entries[entry_id]["weight"],
+                                                           len(entries[entry_id]["name"]), entry_id))
+            self._ranked[kind][prefix] = ranked
+        return ranked
+
+    def _match(self, kind, normalized, limit):
+        """ Top `limit` (sort key, entry id) for one kind: word-prefix matches, else (series only) trigram matches for typos. """
+        prefixes = [word[:MAX_PREFIX] for word in normalized.split()]
+        matches = [self._prefixes[kind].get(prefix, ()) for prefix in prefixes]
+        scored = {}
+        if all(matches):
+            # Walk the rarest word's matches best first; the other words only filter them.
+            rarest = min(range(len(prefixes)), key=lambda i: len(matches[i]))
+            others = [ids for i, ids in enumerate(matches) if i != rarest]
+            for entry_id in self._ranked_ids(kind, prefixes[rarest]):
+                if all(entry_id in ids for ids in others):
+                    scored[entry_id] = 2.0 if self._entries[entry_id]["normalized"].startswith(normalized) else 1.5
+                    if prefixes == [normalized] and len(scored) >= limit:
+                        break  # one short word: ranked order is already the final order
+        if not scored and kind == "series" and len(normalized) >= 3:
+            # Nothing starts with what was typed: likely a typo, fall back to trigram similarity.
+            grams = _trigrams(normalized)
+            overlap = {}
+            for gram in grams:
+                for entry_id in self._grams[kind].get(gram, ()):
+                    overlap[entry_id] = overlap.get(entry_id, 0) + 1
+            for entry_id, shared in overlap.items():
+                if entry_id not in scored:
+                    dice = 2.0 * shared / (len(grams) + self._entries[entry_id]["trigrams"])
+                    if dice >= 0.4:
+                        scored[entry_id] = dice
+        # Better score, then more listings, then shorter name (entry id keeps it deterministic).
+        return heapq.nsmallest(limit, ((-score, -self._entries[entry_id]["weight"], len(self._entries[entry_id]["name"]), entry_id)
+                                       for entry_id, score in scored.items()))
+
+    def suggest(self, query, limit=10):
+        """ Ranked [{"name", "kind", "listings", "score"}]: series first, then listing titles to fill up. """
+        normalized = _normalize(query)
+        if not normalized:
+            return []
+        with self._lock:
+            ranked = self._match("series", normalized, limit)
+            if len(ranked) < limit:
+                ranked += self._match("title", normalized, limit - len(ranked))
+            return [{"name": self._entries[entry_id]["name"], "kind": self._entries[entry_id]["kind"],
+                     "listings": self._entries[entry_id]["weight"], "score": round(-neg_score, 3)}
+                    for neg_score, _, _, entry_id in ranked]
+
+    def stale(self):
+        refresh = float(os.environ.get('SUGGEST_REFRESH_SECONDS', '300'))
+        return self.built_at is None or time.monotonic() - self.built_at >= refresh
+
+    def refresh_due(self):
+        """ stale(), unless a refresh failed less than SUGGEST_RETRY_SECONDS ago. """
+        retry = float(os.environ.get('SUGGEST_RETRY_SECONDS', '30'))
+        if self.failed_at is not None and time.monotonic() - self.failed_at < retry:
+            return False
+        return self.stale()
+
+    def refresh_failed(self):
+        self.failed_at = time.monotonic()
+
+    def reweigh_due(self):
+        reweigh = float(os.environ.get('SUGGEST_REWEIGH_SECONDS', '3600'))
+        return self.reweighed_at is None or time.monotonic() - self.reweighed_at >= reweigh
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "titles": len(self._titles), "prefixes": sum(len(p) for p in self._prefixes.values())}
+
+
+_index = SuggestIndex()
+_refresh_lock = threading.Lock()
+
+
+def get_suggest_index():
+    return _index
+
+
+def load_delta(store, index=None):
+    """ Pulls series and titles added since the index last saw the store. False if the store couldn't be read. """
+    index = index or _index
+    after = index.series_rows_after()
+    rows = store.suggest_rows(after, index.last_listing_id, index.max_titles)
+    if rows is None:
+        return False
+    series_rows, title_rows = rows
+    index.apply_rows(series_rows, title_rows, recount=after == 0)
+    log.info("Suggest index refreshed", extra={"series_rows": len(series_rows), "titles": len(title_rows), "recount": after == 0, **index.stats()})
+    return True
+
+
+def ensure_index(open_store, index=None):
+    """
+    Builds (on first use) or refreshes a stale index in a background thread
+    through `open_store` (storage.open_store), so suggest requests never wait
+    on the DB; until the first build finishes the index is empty (check
+    `built_at`). Call it at startup to start the first build early.
+    """
+    index = index or _index
+    # One refresh at a time, none for a while after a failure; meanwhile requests answer from the current index.
+    if not index.refresh_due() or not _refresh_lock.acquire(blocking=False):
+        return index
+
+    def refresh():
+        store = None
+        try:
+            store = open_store()
+            if not (store.available and load_delta(store, index)):
+                index.refresh_failed()
+        except Exception as error:
+            log.error("Suggest index refresh failed: %s", error)
+            index.refresh_failed()
+        finally:
+            if store is not None:
+                store.close()
+            _refresh_lock.release()
+
+    threading.Thread(target=refresh, name="suggest-refresh", daemon=True).start()
+    return index
@@ -0,0 +1,239 @@
+# === Listing Storage Backends ===
+# One interface over where listings live, so small single-node deployments
+# and CI can run without a network database:
+#
+#   * PostgresStore - the existing psycopg2 path (partitions, series registry,
+#     price sketches), delegating to manga_scraper_logic.
+#   * SQLiteStore   - an embedded file database in WAL mode with the same
+#     manga_listings columns and uniqueness; price distributions are computed
+#     from the rows on demand instead of a stored sketch.
+#
+# STORAGE_BACKEND selects the backend ("postgres" default, or "sqlite");
+# SQLITE_PATH names the database file (default manga_market.db).
+# storage_benchmark.py compares the two on the manga_price_data corpus.
+
+# --- Standard Libraries ---
+import datetime
+import os
+import sqlite3
+import threading
+
+# --- Database Library ---
+import psycopg2
+
+# --- Scraper Logic ---
+# Module import (not from-import): manga_scraper_logic imports this module too.
+import manga_scraper_logic as scraper
+from listing_dedupe import get_dedupe_index, warm_from_db
+from listing_partitions import price_window_start
+from price_sketch import TDigest, get_price_summary_from_db
+from scrape_logging import get_logger
+from series_registry import should_register, tracked_series
+from series_suggest import SERIES_ROWS_QUERY, TITLE_ROWS_QUERY, get_suggest_index
+
+log = get_logger("storage")
+
+SQLITE_SCHEMA_COMMANDS = (
+    """CREATE TABLE IF NOT EXISTS manga_listings (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, total_price NUMERIC NOT NULL, date_sold DATE NOT NULL, num_volumes INTEGER, price_per_volume NUMERIC, format TEXT, parse_source TEXT, link TEXT NOT NULL, scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, dup_cluster TEXT, series_id INTEGER, UNIQUE (link, date_sold))""",
+    """CREATE INDEX IF NOT EXISTS idx_manga_listings_format_date ON manga_listings (format, date_sold)""",
+    """CREATE INDEX IF NOT EXISTS idx_manga_listings_dup_cluster ON manga_listings (dup_cluster)""",
+)
+
+
+class PostgresStore:
+    """The existing psycopg2 storage path behind the store interface."""
+
+    name = "postgres"
+
+    def __init__(self, conn=None):
+        self.conn = conn or scraper.get_db_connection()
+
+    @property
+    def available(self):
+        return self.conn is not None
+
+    def create_schema(self):
+        scraper.create_tables(self.conn)
+
+    def warm_dedupe(self, manga_title):
+        return warm_from_db(self.conn, manga_title)
+
+    def tracked_series(self):
+        """ Series registry dictionary for fan-out routing (an unregistered searched series is the fallback, not an entry). """
+        try:
+            return tracked_series(self.conn)
+        except psycopg2.DatabaseError as error:
+            log.error("Error loading tracked series: %s", error)
+            self.conn.rollback()
+            return {}, {}
+
+    def suggest_rows(self, series_after, listing_after, max_titles):
+        """ (series rows, title rows) for the suggest index past the given ids, or None on a DB error. """
+        cur = None
+        try:
+            cur = self.conn.cursor()
+            cur.execute(SERIES_ROWS_QUERY, (series_after,))
+            series_rows = cur.fetchall()
+            cur.execute(TITLE_ROWS_QUERY, (listing_after, max_titles))
+            return series_rows, cur.fetchall()
+        except psycopg2.DatabaseError as error:
+            log.error("Error loading suggest index rows: %s", error)
+            self.conn.rollback()
+            return None
+        finally:
+            if cur:
+                cur.close()
+
+    def insert_listings(self, items):
+        """ Bulk insert; returns (rows attempted, number of new rows). """
+        attempted, new_rows = scraper.insert_listings(self.conn, items)
+        return attempted, len(new_rows)
+
+    def record_listings(self, items, manga_title):
+        return scraper.record_listings(self.conn, items, manga_title)
+
+    def avg_price(self, manga_title):
+        return scraper.get_avg_price_from_db(self.conn, manga_title_like=manga_title)
+
+    def series_freshness(self, manga_title):
+        return scraper.get_series_freshness(self.conn, manga_title_like=manga_title)
+
+    def price_summary(self, manga_title):
+        return get_price_summary_from_db(self.conn, manga_title)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SQLiteStore:
+    """Embedded SQLite (WAL) storage with the same listing schema and query semantics."""
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('SQLITE_PATH', 'manga_market.db')
+        # The scrape pipeline writes from its own thread; one connection guarded by a lock.
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.conn is not None
+
+    def create_schema(self):
+        with self._lock:
+            for command in SQLITE_SCHEMA_COMMANDS:
+                self.conn.execute(command)
+            self.conn.commit()
+
+    def warm_dedupe(self, manga_title):
+        index = get_dedupe_index()
+        if not index.needs_warm(manga_title):
+            return 0
+        with self._lock:
+            rows = self.conn.execute("SELECT title, num_volumes, format FROM manga_listings WHERE title LIKE ? AND parse_source = 'Description' AND num_volumes > 0 ORDER BY scraped_at DESC LIMIT 5000",
+                                     (f'%{manga_title}%',)).fetchall()
+        return index.warm(manga_title, rows)
+
+    def tracked_series(self):
+        # No series registry here: fan-out files everything under the searched series.
+        return {}, {}
+
+    def suggest_rows(self, series_after, listing_after, max_titles):
+        # No series registry here: only listing titles (series names arrive through record_listings).
+        try:
+            with self._lock:
+                title_rows = self.conn.execute(TITLE_ROWS_QUERY.replace('%s', '?'), (listing_after, max_titles)).fetchall()
+        except sqlite3.Error as error:
+            log.error("Error loading suggest index rows: %s", error)
+            return None
+        return [], title_rows
+
+    @staticmethod
+    def _row(item_data):
+        row = scraper.listing_row(item_data)
+        if row is None:
+            return None
+        row = list(row)
+        # Match the Postgres NUMERIC(10, 2) columns; dates are stored as ISO text.
+        for position in (1, 4):
+            if row[position] is not None:
+                row[position] = round(float(row[position]), 2)
+        row[2] = row[2].isoformat()
+        row[8] = row[8].isoformat(sep=' ')
+        return row
+
+    def insert_listings(self, items):
+        """ Bulk insert in one transaction; returns (rows attempted, number of new rows). """
+        if not items:
+            return 0, 0
+        sql_insert = f"INSERT INTO manga_listings ({', '.join(scraper.LISTING_COLUMNS)}) VALUES ({', '.join('?' * len(scraper.LISTING_COLUMNS))}) ON CONFLICT (link, date_sold) DO NOTHING"
+        rows = [row for row in map(self._row, items) if row is not None]
+        if not rows:
+            return 0, 0
+        with self._lock:
+            try:
+                before = self.conn.total_changes
+                self.conn.executemany(sql_insert, rows)
+                self.conn.commit()
+                return len(rows), self.conn.total_changes - before
+            except sqlite3.Error as error:
+                log.error("Error inserting listings: %s", error, extra={"rows": len(rows)})
+                self.conn.rollback()
+                return 0, 0
+
+    def record_listings(self, items, manga_title):
+        attempted, new_rows = self.insert_listings(items)
+        if new_rows:
+            # No registry here: suggest the name only once its listings name it, as registration would.
+            get_suggest_index().observe_listings(manga_title if should_register(manga_title, items) else None,
+                                                 [item_data['title'] for item_data in items], new_rows)
+        return attempted
+
+    def _series_where(self, manga_title):
+        # LIKE is case-insensitive for ASCII in SQLite, matching the Postgres ILIKE fallback.
+        return ("title LIKE ? AND format IN ('Single', 'Lot') AND price_per_volume IS NOT NULL AND date_sold >= ?",
+                (f'%{manga_title}%', price_window_start().isoformat()))
+
+    def avg_price(self, manga_title):
+        where, params = self._series_where(manga_title)
+        with self._lock:
+            row = self.conn.execute(f"SELECT AVG(price_per_volume), COUNT(*) FROM manga_listings WHERE {where}", params).fetchone()
+        if row and row[0] is not None:
+            return float(row[0]), int(row[1])
+        return None, 0
+
+    def series_freshness(self, manga_title):
+        where, params = self._series_where(manga_title)
+        with self._lock:
+            row = self.conn.execute(f"SELECT MAX(scraped_at), COUNT(*) FROM manga_listings WHERE {where}", params).fetchone()
+        if row and row[0] is not None:
+            return datetime.datetime.fromisoformat(row[0]), int(row[1])
+        return None, 0
+
+    def price_summary(self, manga_title):
+        # Small deployments: a sketch over the series' rows is cheap to build per request.
+        # Same rows as avg_price, so the summary and the average agree.
+        where, params = self._series_where(manga_title)
+        with self._lock:
+            rows = self.conn.execute(f"SELECT price_per_volume FROM manga_listings WHERE {where}", params).fetchall()
+        return TDigest().update(float(price) for (price,) in rows).summary() if rows else None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def open_store(backend=None):
+    """ Opens the configured store (STORAGE_BACKEND). Check `.available` before use. """
+    backend = (backend or os.environ.get('STORAGE_BACKEND', 'postgres')).lower()
+    if backend == 'sqlite':
+        return SQLiteStore()
+    if backend != 'postgres':
+        log.warning("Unknown STORAGE_BACKEND, using postgres", extra={"backend": backend})
+    return PostgresStore()
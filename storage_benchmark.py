@@ -0,0 +1,164 @@
+# === Storage Backend Benchmark ===
+# Loads the manga_price_data CSV exports into each storage backend and times
+# the operations the scraper and API actually perform:
+#
+#   * bulk insert in pipeline-sized batches (SCRAPE_BATCH_SIZE rows),
+#   * re-insert of the same rows (the ON CONFLICT no-op path of a re-scrape),
+#   * per-series aggregates: average price, freshness and price distribution.
+#
+# SQLite always runs against a throwaway file. Postgres runs only with
+# --postgres, against the database configured in .env but inside a scratch
+# schema that is dropped afterwards, so manga_listings is never touched.
+
+# --- Standard Libraries ---
+import argparse
+import contextlib
+import csv
+import glob
+import os
+import re
+import statistics
+import tempfile
+import time
+
+# --- Third-party Libraries ---
+from psycopg2 import sql
+
+# --- Storage Backends ---
+from manga_scraper_logic import get_db_connection
+from storage import PostgresStore, SQLiteStore
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manga_price_data')
+_FILE_NAME = re.compile(r'^(?P<series>.+?)_(?:Omnibus|SinglesLots)_\d{4}-\d{2}-\d{2}(?:_\d+)?\.csv$')
+
+
+def load_corpus(directory=CORPUS_DIR):
+    """
+    {series: [item_data]} from the CSV exports (the scraper's item_data shape).
+    Volume counts and formats come from the exports as scraped: omnibus files
+    carry "Volumes Contained (est.)", singles/lots files "Num Volumes" and
+    "Parse Source". Rows without volumes or formatted Exclude are dropped, as
+    the scraper never stores them.
+    """
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        match = _FILE_NAME.match(os.path.basename(path))
+        if not match:
+            continue
+        series = match.group('series').replace('_', ' ')
+        with open(path, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                volumes = row.get('Num Volumes') or row.get('Volumes Contained (est.)') or ''
+                num_volumes, format_type = (int(volumes) if volumes.isdigit() else 0), row['Format']
+                if num_volumes == 0 or format_type == 'Exclude':
+                    continue
+                corpus.setdefault(series, []).append({
+                    'title': row['Title'],
+                    'total_price': float(row['Total Price']),
+                    # "Sold  Apr 7, 2025" -> "Apr 7, 2025" (the format listing_row parses)
+                    'date': re.sub(r'^Sold\s+', '', row['Date Sold']).strip(),
+                    'num_volumes': num_volumes,
+                    'format': format_type,
+                    'link': row['Link'],
+                    'parse_source': row.get('Parse Source') or 'Title',
+                })
+    return corpus
+
+
+@contextlib.contextmanager
+def scratch_postgres_store():
+    """
+    A PostgresStore on the .env database whose tables live in a scratch schema
+    (first on the search_path), dropped with everything in it on exit. Yields
+    None when Postgres is not reachable.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        yield None
+        return
+    schema = sql.Identifier(f"storage_benchmark_{os.getpid()}")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE SCHEMA {}").format(schema))
+            cur.execute(sql.SQL("SET search_path TO {}").format(schema))
+        conn.commit()
+        yield PostgresStore(conn)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(schema))
+        conn.commit()
+        conn.close()
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def run_benchmark(store, corpus, batch_size, repeats):
+    """ Times schema setup, bulk inserts and per-series aggregates on one store. """
+    results = {"backend": store.name}
+    results["create_schema_s"], _ = _timed(store.create_schema)
+
+    items = [item_data for series_items in corpus.values() for item_data in series_items]
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    for label in ("insert", "reinsert"):
+        elapsed, new_rows = 0.0, 0
+        for batch in batches:
+            seconds, (_, inserted) = _timed(store.insert_listings, batch)
+            elapsed += seconds
+            new_rows += inserted
+        results[f"{label}_s"] = elapsed
+        results[f"{label}_rows_per_s"] = len(items) / elapsed if elapsed else 0.0
+        results[f"{label}_new_rows"] = new_rows
+
+    for query in ("avg_price", "series_freshness", "price_summary"):
+        timings = []
+        for _ in range(repeats):
+            for series in corpus:
+                seconds, _ = _timed(getattr(store, query), series)
+                timings.append(seconds * 1000)
+        results[f"{query}_ms_median"] = statistics.median(timings)
+        results[f"{query}_ms_p95"] = sorted(timings)[int(len(timings) * 0.95) - 1]
+    return results
+
+
+def print_results(all_results, rows, series):
+    print(f"Corpus: {rows} listings, {series} series")
+    keys = [key for key in all_results[0] if key != "backend"]
+    print(f"{'metric':<28}" + "".join(f"{r['backend']:>14}" for r in all_results))
+    for key in keys:
+        print(f"{key:<28}" + "".join(f"{r[key]:>14.3f}" if isinstance(r[key], float) else f"{r[key]:>14}" for r in all_results))
+
+
+# --- Command-line entry point ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare storage backends on the manga_price_data corpus.")
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get('SCRAPE_BATCH_SIZE', '100')))
+    parser.add_argument("--repeats", type=int, default=20, help="Aggregate query passes over all series")
+    parser.add_argument("--postgres", action="store_true", help="Also benchmark the configured Postgres database")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    rows = sum(len(items) for items in corpus.values())
+    if not rows:
+        raise SystemExit(f"No CSV exports found in {args.corpus}")
+
+    all_results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        store = SQLiteStore(os.path.join(scratch, 'bench.db'))
+        try:
+            all_results.append(run_benchmark(store, corpus, args.batch_size, args.repeats))
+        finally:
+            store.close()
+
+    if args.postgres:
+        with scratch_postgres_store() as store:
+            if store is None:
+                raise SystemExit("Postgres is not reachable (check .env)")
+            all_results.append(run_benchmark(store, corpus, args.batch_size, args.repeats))
+
+    print_results(all_results, rows, len(corpus))
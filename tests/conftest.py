@@ -0,0 +1,60 @@
+# === Shared Test Fixtures ===
+# A local Oxylabs stub (oxylabs_stub_server.py) serving one eBay results page,
+# with the scraper pointed at it and at a throwaway SQLite store.
+
+# --- Standard Libraries ---
+import datetime
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oxylabs_stub_server import serve
+
+LISTINGS = (
+    ("Naruto Manga Vol 1 English Paperback", "12.00", "111"),
+    ("Naruto Manga Volumes 1-3 English Lot", "30.00", "222"),
+    ("Naruto Vol 5 Manga English", "9.50", "333"),
+)
+
+
+def search_page(listings=LISTINGS):
+    """ An eBay sold-listings page with listings, sold in the last few days. """
+    items = []
+    for days_ago, (title, price, item_id) in enumerate(listings, start=1):
+        sold = (datetime.date.today() - datetime.timedelta(days=days_ago)).strftime("%b %d, %Y")
+        items.append(f'<li class="s-item"><div class="s-item__title"><span role="heading">{title}</span></div>'
+                     f'<span class="s-item__price">${price}</span><span class="POSITIVE">Sold  {sold}</span>'
+                     f'<a class="s-item__link" href="https://www.ebay.com/itm/{item_id}?hash=1">x</a></li>')
+    return f'<html><body><ul class="srp-results srp-list clearfix">{"".join(items)}</ul></body></html>'
+
+
+@pytest.fixture
+def stub(request, monkeypatch, tmp_path):
+    """
+    Stub Oxylabs API on a free port, with the scraper pointed at it and at a fresh SQLite file.
+    Serves LISTINGS unless parametrized (indirect=True) with other listings.
+    """
+    server = serve(search_page(getattr(request, "param", LISTINGS)), port=0, delay=0.2, fault_marker="_pgn=2")
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    monkeypatch.setenv("OXYLABS_BATCH_BASE_URL", base_url)
+    monkeypatch.setenv("OXYLABS_REALTIME_ENDPOINT", f"{base_url}/queries")
+    monkeypatch.setenv("OXYLABS_BATCH_POLL_SECONDS", "0.05")
+    monkeypatch.setenv("OXYLABS_BATCH_TIMEOUT", "10")
+    monkeypatch.setenv("OXYLABS_USERNAME", "stub")
+    monkeypatch.setenv("OXYLABS_PASSWORD", "stub")
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "listings.db"))
+    yield tmp_path / "listings.db"
+    server.shutdown()
+
+
+def stored_links(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(link for (link,) in conn.execute("SELECT link FROM manga_listings"))
+    finally:
+        conn.close()
@@ -0,0 +1,46 @@
+# === Deferred Descriptions Within a Time Budget ===
+# A budgeted run_scrape puts the descriptions of ambiguous listings off until the
+# pages are in, fetches them largest price impact first, and stops at the deadline.
+
+import time
+
+import pytest
+
+import manga_scraper_logic
+from manga_scraper_logic import run_scrape
+from scrape_budget import ScrapeBudget, descriptions_from_request
+
+BUDGET_LISTINGS = (
+    ("Naruto Vol 1 English Manga", "10.00", "101"),
+    ("Naruto Vol 2 English Manga", "10.00", "102"),
+    ("Naruto Manga English Paperback", "12.00", "201"),
+    ("Naruto Manga Bundle Used", "50.00", "202"),
+    ("Naruto Manga Softcover English Used", "25.00", "203"),
+)
+
+
+@pytest.mark.parametrize("stub", [BUDGET_LISTINGS], indirect=True)
+def test_deferred_descriptions_run_by_price_impact_until_the_deadline(stub, monkeypatch):
+    budget = ScrapeBudget(30, reserve=0)
+    described = []
+
+    def describe(link, headers=None):
+        described.append(link.rsplit("/", 1)[-1])
+        if len(described) == 2:
+            budget.deadline = time.monotonic()  # the time runs out after the second description
+        return 1, "Single"
+
+    monkeypatch.setattr(manga_scraper_logic, "get_volumes_from_description", describe)
+
+    assert run_scrape("Naruto", max_pages=1, min_price=5, fetch_descriptions=True, budget=budget)
+
+    # $50 and $25 sit furthest from the $10 page median; the $12 lot is left undescribed.
+    assert described == ["202", "203"]
+    assert budget.report()["skipped"]["descriptions"] == 1
+
+
+def test_descriptions_default_on_with_a_time_budget():
+    assert descriptions_from_request(None, ScrapeBudget(5))
+    assert not descriptions_from_request(None, None)
+    assert not descriptions_from_request("false", ScrapeBudget(5))
+    assert descriptions_from_request("1", None)
@@ -0,0 +1,40 @@
+# === Freshness of Stored Listings ===
+# scraped_at is a naive TIMESTAMP holding UTC, whatever the server's time zone,
+# and is_fresh / make_validators read it that way.
+
+import datetime
+import time
+
+from http_caching import is_fresh, make_validators
+from manga_scraper_logic import run_scrape
+from storage import SQLiteStore
+
+
+def test_naive_scraped_at_is_read_as_utc(monkeypatch):
+    monkeypatch.setenv("PRICES_CACHE_MAX_AGE", "3600")
+    now = datetime.datetime(2025, 4, 7, 12, 0, tzinfo=datetime.timezone.utc)
+
+    assert is_fresh(datetime.datetime(2025, 4, 7, 11, 30), now=now)
+    assert not is_fresh(datetime.datetime(2025, 4, 7, 10, 30), now=now)
+    _, last_modified = make_validators(datetime.datetime(2025, 4, 7, 11, 30, 15, 500), 3, "Naruto")
+    assert last_modified == datetime.datetime(2025, 4, 7, 11, 30, 15, tzinfo=datetime.timezone.utc)
+
+
+def test_scraped_at_is_written_in_utc(stub, monkeypatch):
+    # A server far from UTC: local time would be 14 hours ahead.
+    monkeypatch.setenv("TZ", "Pacific/Kiritimati")
+    time.tzset()
+    try:
+        assert run_scrape("Naruto", max_pages=1, min_price=5)
+        store = SQLiteStore(str(stub))
+        try:
+            newest, _ = store.series_freshness("Naruto")
+        finally:
+            store.close()
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+
+    utc_now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    assert abs((utc_now - newest).total_seconds()) < 60
+    assert is_fresh(newest)
@@ -0,0 +1,27 @@
+# === Oxylabs Batch and Realtime Modes Against the Local Stub ===
+# Runs run_batch_scrape (submit, poll, parse, write) and run_scrape end to end
+# against oxylabs_stub_server.py with the SQLite store, so no credentials,
+# network or Postgres are needed.
+
+import oxylabs_batch
+from conftest import LISTINGS, stored_links
+from manga_scraper_logic import run_scrape
+
+
+def test_batch_scrape_writes_listings_from_every_finished_page(stub):
+    assert oxylabs_batch.run_batch_scrape(["Naruto"], max_pages=1, min_price=5)
+
+    assert stored_links(stub) == [f"https://www.ebay.com/itm/{item_id}" for _, _, item_id in LISTINGS]
+
+
+def test_batch_scrape_skips_faulted_pages(stub):
+    # Page 2 is faulted by the stub: the sweep goes on but reports it.
+    assert not oxylabs_batch.run_batch_scrape(["Naruto"], max_pages=2, min_price=5)
+
+    assert len(stored_links(stub)) == len(LISTINGS)
+
+
+def test_realtime_scrape_uses_configured_endpoint(stub):
+    assert run_scrape("Naruto", max_pages=1, min_price=5)
+
+    assert len(stored_links(stub)) == len(LISTINGS)
@@ -0,0 +1,44 @@
+# === Scrape Worker Lease Handling ===
+# A worker whose lease is lost cancels its scrape; a cancelled scrape stops
+# before its next request and reports failure. The job table calls are
+# replaced, so no Postgres is needed.
+
+import threading
+import time
+
+import scrape_jobs
+from conftest import stored_links
+from manga_scraper_logic import run_scrape
+
+JOB = {"id": 1, "correlation_id": None, "manga_title": "Naruto", "attempts": 1, "max_pages": 3, "min_price": 5, "fetch_descriptions": False}
+
+
+def test_cancelled_scrape_stops_before_fetching(stub):
+    cancel = threading.Event()
+    cancel.set()
+
+    assert not run_scrape("Naruto", max_pages=1, min_price=5, cancel=cancel)
+    assert stored_links(stub) == []
+
+
+def test_lost_lease_cancels_a_job_without_time_budget(monkeypatch):
+    calls, finished = {}, []
+
+    def scrape(manga_title, cancel, on_page, budget=None, **_):
+        calls["budget"] = budget
+        deadline = time.monotonic() + 5
+        while not cancel.is_set() and time.monotonic() < deadline:
+            on_page(1, 1)  # each page prompts a heartbeat
+            time.sleep(0.05)
+        return not cancel.is_set()
+
+    monkeypatch.setattr(scrape_jobs, "run_scrape", scrape)
+    monkeypatch.setattr(scrape_jobs, "heartbeat", lambda *args: False)  # another worker reclaimed the job
+    monkeypatch.setattr(scrape_jobs, "finish_job", lambda conn, job, worker_id, success, result, error: finished.append(success))
+    worker = scrape_jobs.ScrapeWorker(lease_seconds=3)
+    worker._conn = object()
+
+    worker._run_job(dict(JOB))
+
+    assert calls["budget"] is None
+    assert finished == [False]
@@ -0,0 +1,49 @@
+# === Profiling and the Scrape Pipeline ===
+# A profiled run_scrape must show the pipeline's stage threads (fetch, parse),
+# not just the request thread waiting for them; and a parse pool that lost a
+# worker process is replaced instead of failing every later scrape.
+
+# --- Standard Libraries ---
+import os
+import pstats
+
+import scrape_pipeline
+from manga_scraper_logic import run_scrape
+from request_profiling import RequestProfiler
+from scrape_pipeline import ScrapePipeline, get_parse_pool, shutdown_parse_pool
+
+
+def test_profile_covers_fetch_and_parse_stage_threads(stub, tmp_path):
+    profiler = RequestProfiler(label="Naruto", output_dir=str(tmp_path / "profiles"), sample_interval=0.001)
+    with profiler:
+        assert run_scrape("Naruto", max_pages=2, min_price=5)
+
+    prof_path, folded_path = profiler.files
+    with open(folded_path, encoding="utf-8") as f:
+        folded = f.read()
+    assert "scrape-fetch;" in folded and "fetch_search_page" in folded
+    assert "scrape-parse;" in folded and "parse_search_page" in folded
+    profiled_functions = {function for _, _, function in pstats.Stats(prof_path).stats}
+    assert {"fetch_search_page", "parse_search_page"} <= profiled_functions
+
+
+def die_once(marker):
+    """ Parse function that kills its pool process the first time (like an OOM kill). """
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return 1, [marker]
+
+
+def test_parse_stage_replaces_a_broken_pool(tmp_path):
+    marker = str(tmp_path / "died")
+    pool = get_parse_pool()
+    written = []
+    pipeline = ScrapePipeline(fetch_page=lambda page_num: marker, parse_page=die_once, enrich_item=lambda item: item,
+                              write_batch=lambda items: written.extend(items) or len(items), max_pages=1)
+    try:
+        assert pipeline.run()
+        assert written == [marker]
+        assert scrape_pipeline._parse_pool is not pool
+    finally:
+        shutdown_parse_pool()
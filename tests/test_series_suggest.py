@@ -0,0 +1,55 @@
+# === Suggest Index Refresh ===
+# The index is built in the background through the configured store, and a
+# failing store is retried at most once per SUGGEST_RETRY_SECONDS.
+
+import threading
+import time
+
+from series_suggest import SuggestIndex, ensure_index
+from storage import SQLiteStore, open_store
+
+
+def wait_for_refresh():
+    for thread in threading.enumerate():
+        if thread.name == "suggest-refresh":
+            thread.join(5)
+
+
+def test_index_builds_from_the_sqlite_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "listings.db"))
+    store = SQLiteStore()
+    store.create_schema()
+    store.insert_listings([{"title": "Chainsaw Man Vol 1 English Manga", "total_price": 9.0, "date": "Apr 7, 2025",
+                            "num_volumes": 1, "format": "Single", "link": "https://www.ebay.com/itm/1", "parse_source": "Title"}])
+    store.close()
+    index = SuggestIndex()
+
+    ensure_index(open_store, index)
+    wait_for_refresh()
+
+    assert index.built_at is not None
+    assert [s["name"] for s in index.suggest("chainsaw", 5)] == ["Chainsaw Man Vol 1 English Manga"]
+
+
+def test_failed_refresh_is_not_retried_on_every_request(monkeypatch):
+    monkeypatch.setenv("SUGGEST_RETRY_SECONDS", "60")
+    attempts = []
+
+    class DownStore:
+        available = False
+
+        def close(self):
+            pass
+
+    def open_down_store():
+        attempts.append(time.monotonic())
+        return DownStore()
+
+    index = SuggestIndex()
+    for _ in range(20):
+        ensure_index(open_down_store, index)
+        wait_for_refresh()
+
+    assert len(attempts) == 1
+    assert index.built_at is None and not index.refresh_due()